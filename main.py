@@ -8,18 +8,98 @@
 
 import sys
 
+from PyQt5.QtCore import QAbstractTableModel, QThread, Qt, pyqtSignal
 from PyQt5.QtWidgets import QDialog, QApplication
 from PyQt5.QtWidgets import QFileDialog
 
-from pyduct import calculate
+from pyduct import CALCULATE_STAGES, Cancelled, calculate
+from pyduct_network import FITTING_TYPES
+from pyduct_results import result_chunks
 from pyduct_ui import Ui_Dialog
 
 
+class CalculateThread(QThread):
+    # runs calculate() off the GUI thread and reports each stage and sizing pass
+    stage = pyqtSignal(str)
+    iteration = pyqtSignal(int, float, float)  # pass, dpdl, residual
+    finished_ok = pyqtSignal(object)  # ducts
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, filename, parent=None):
+        super(CalculateThread, self).__init__(parent)
+        self.filename = filename
+        self._cancel = False
+
+    def cancel(self):  # takes effect at the next stage or sizing pass
+        self._cancel = True
+
+    def progress(self, stage, info):
+        if self._cancel:
+            raise Cancelled()
+        if info:
+            self.iteration.emit(info['iteration'], info['dpdl'], info['residual'])
+        else:
+            self.stage.emit(stage)
+
+    def run(self):
+        try:
+            ducts = calculate(self.filename, echo=False, progress=self.progress)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as error:
+            self.failed.emit(str(error))
+        else:
+            self.finished_ok.emit(ducts)
+
+
+class ResultsModel(QAbstractTableModel):
+    # the results table, cells are only formatted when the view shows them
+    headers = ('ID', 'Fitting', 'Velocity (fpm)', 'Q (cfm)', 'DeltaP (in. wg)', 'Diameter (in)',
+               'Diffuser pressure (in. wg)')
+    keys = ('ID', 'type', 'velocity', 'flow', 'pdrop', 'size', 'diffuser_psum')
+    formats = ('%d', '%s', '%.3f', '%.1f', '%.3f', '%.3f', '%.3f')
+
+    def __init__(self, network=None, parent=None):
+        super(ResultsModel, self).__init__(parent)
+        self.columns = None
+        self.rows = 0
+        if network is not None and len(network.ID):
+            self.columns = next(result_chunks(network, len(network.ID)))
+            self.rows = len(network.ID)
+
+    def rowCount(self, parent=None):
+        return self.rows
+
+    def columnCount(self, parent=None):
+        return len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        value = self.columns[self.keys[index.column()]][index.row()]
+        if index.column() == 1:
+            value = FITTING_TYPES[value]
+        elif value != value:  # no diffuser pressure
+            return ''
+        return self.formats[index.column()] % value
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+
 class main_window(QDialog):
     def __init__(self):
         super(main_window, self).__init__()
         self.ui = Ui_Dialog()
         self.ui.setupUi(self)
+        self.ui.progressBar.setRange(0, len(CALCULATE_STAGES))
+        self.ui.tableView.setModel(ResultsModel())
+        self.worker = None
         self.assign_widgets()
         self.show()
 
@@ -28,16 +108,69 @@ class main_window(QDialog):
         self.ui.pushButton.clicked.connect(self.getFileName)
         self.ui.buttonBox.accepted.connect(self.runPyduct)
         self.ui.buttonBox.rejected.connect(self.ExitApp)
+        self.ui.cancelButton.clicked.connect(self.cancelPyduct)
 
     def getFileName(self):  # Get file from user
         filename = QFileDialog.getOpenFileName()
         self.ui.lineEdit.setText(str(filename[0]))
 
-    def runPyduct(self):
-        print('Running...')  # Says the program is running
-        calculate(str(self.ui.lineEdit.text()))  # Runs pyduct.py and gets all the values, then prints them
+    def runPyduct(self):  # sizes the network in the background, the dialog stays responsive
+        if self.worker is not None or not self.ui.lineEdit.text():
+            return
+        self.worker = CalculateThread(str(self.ui.lineEdit.text()), self)
+        self.worker.stage.connect(self.showStage)
+        self.worker.iteration.connect(self.showIteration)
+        self.worker.finished_ok.connect(self.showResults)
+        self.worker.failed.connect(self.showError)
+        self.worker.cancelled.connect(self.showCancelled)
+        self.worker.finished.connect(self.workerDone)
+        self.ui.progressBar.setValue(0)
+        self.ui.statusLabel.setText('Running...')
+        self.ui.buttonBox.button(self.ui.buttonBox.Ok).setEnabled(False)
+        self.ui.cancelButton.setEnabled(True)
+        self.worker.start()
+
+    def cancelPyduct(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.ui.statusLabel.setText('Stopping...')
+
+    def showStage(self, stage):
+        if stage in CALCULATE_STAGES:
+            self.ui.progressBar.setValue(CALCULATE_STAGES.index(stage))
+        self.ui.statusLabel.setText(stage.replace('_', ' ').capitalize() + '...')
+
+    def showIteration(self, iteration, dpdl, residual):
+        self.ui.statusLabel.setText('Sizing, pass %d: dpdl %.6f in. wg/ft, residual %.2e' % (iteration, dpdl, residual))
+
+    def showResults(self, ducts):
+        self.ui.tableView.setModel(ResultsModel(ducts['network']))
+        self.ui.progressBar.setValue(len(CALCULATE_STAGES))
+        self.ui.statusLabel.setText('%d fittings sized, results also in pyductresult.txt' % len(ducts['fittings']))
+
+    def showError(self, message):
+        self.ui.statusLabel.setText('Failed: ' + message.splitlines()[0])
+
+    def showCancelled(self):
+        self.ui.progressBar.setValue(0)
+        self.ui.statusLabel.setText('Stopped')
+
+    def workerDone(self):
+        self.worker = None
+        self.ui.buttonBox.button(self.ui.buttonBox.Ok).setEnabled(True)
+        self.ui.cancelButton.setEnabled(False)
+
+    def stopWorker(self):  # a running QThread must not outlive the dialog
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+
+    def reject(self):  # window close button and Esc
+        self.stopWorker()
+        super(main_window, self).reject()
 
     def ExitApp(self):
+        self.stopWorker()
         app.exit()
 
 
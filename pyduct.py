@@ -1,24 +1,50 @@
-import re
 import sys
+import time
 import warnings
 
 import numpy as np
-from scipy.optimize import fsolve
+
+from pyduct_fittings import PLEATED_ELBOW_90, SD5_10_BRANCH, SD5_10_MAIN
+import pyduct_instrument
+from pyduct_friction import SolverError, colebrook_f, duct_size_cache, friction_cache, size_ducts
+from pyduct_network import (AHU, BRANCH, DIFFUSER, DUCT, ELBOW, FITTING_TYPES, MAIN, NO_PORT, TEE, DuctNetwork,
+                            FittingList, NetworkError)
+from pyduct_results import write_results
+
+__version__ = '1.0'
 
 # suppress sqrt warning. it's going to happen. Don't really care if it does.
 warnings.filterwarnings('ignore', 'invalid value encountered in sqrt')
 
 
 def new_duct_network():
-    ducts = dict(title=None, fan_pressure=None, air_density=None, roughness=None, rounding=None, fittings=[])
+    ducts = dict(title=None, fan_pressure=None, air_density=None, roughness=None, rounding=None, fittings=[],
+                 network=None, fan_pressures={})  # fan_pressures: air handler ID -> its own fan pressure
     return ducts
 
 
+_BLANK_FITTING = dict(ID=None, type=None, IDup=None, BranchUP=None, IDdownMain=None, IDdownBranch=None, flow=None,
+                      flowMain=None, flowBranch=None, size=None, sizeMain=None, sizeBranch=None,
+                      pdrop=None, pdropMain=None, pdropBranch=None, length=None, fandist=None, diffuser_psum=None)
+
+
 def new_fitting():
-    fitting = dict(ID=None, type=None, IDup=None, BranchUP=None, IDdownMain=None, IDdownBranch=None, flow=None,
-                   flowMain=None, flowBranch=None, size=None, sizeMain=None, sizeBranch=None,
-                   pdrop=None, pdropMain=None, pdropBranch=None, length=None, fandist=None, diffuser_psum=None)
-    return fitting
+    return _BLANK_FITTING.copy()
+
+
+class Cancelled(Exception):
+    """Raised by a progress callback to stop a calculation."""
+
+
+class InputError(ValueError):
+    """Raised for malformed input lines, with every problem found and its line number."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)  # (line number, message)
+        super(InputError, self).__init__(self.errors)
+
+    def __str__(self):
+        return '\n'.join('line %d: %s' % error for error in self.errors)
 
 
 def read_input_file(filename):
@@ -28,148 +54,253 @@ def read_input_file(filename):
     return data
 
 
+def read_ducts(filename):  # parses the input file a line at a time without reading it all in first
+    with open(filename, 'r') as file:
+        return process_keywords(file)
+
+
+def strip_comment(line):
+    # drops everything from the first # that is not inside quotes
+    hash_index = line.find('#')
+    if hash_index == -1:
+        return line
+    if "'" not in line and '"' not in line:
+        return line[:hash_index]
+    quote = None
+    for i, char in enumerate(line):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char == "'" or char == '"':
+            quote = char
+        elif char == '#':
+            return line[:i]
+    return line
+
+
+def parse_ID(text):
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        ID = float(text)  # still lets "12.0" through
+    except ValueError:
+        ID = None
+    if ID is None or not ID.is_integer():
+        raise ValueError('%r is not a whole number fitting ID' % text)
+    return int(ID)
+
+
+def tokenize(lines):
+    """Single pass over the input lines yielding (line number, keyword, rest of the line).
+
+    Comments (from an unquoted # to the end of the line) and blank lines are
+    skipped. The keyword is lowercased, the rest of the line after its comma is
+    left as written. An unquoted title is kept whole, # and all, so only a quoted
+    title can be followed by a comment.
+    """
+    for lineno, line in enumerate(lines, 1):
+        keyword, _, rest = line.partition(',')
+        if '#' in line and (keyword.strip().lower() != 'title' or rest.lstrip()[:1] in ('"', "'")):
+            keyword, _, rest = strip_comment(line).partition(',')
+        keyword = keyword.strip()
+        if keyword or rest.strip():
+            yield lineno, keyword.lower(), rest
+
+
 def process_keywords(data):
-    ducts = new_duct_network()
-    for line in data:
-        line = line.lower()
-        if line.find('#') != -1:
-            continue  # comment line. not the lines we are looking for.
-        else:
-            item = [x.strip() for x in line.split(',')]
-            if item[0] == 'title':
-                ducts['title'] = item[1]
-            elif item[0] == 'fan_pressure':
-                ducts['fan_pressure'] = float(item[1])
-            elif item[0] == 'air_density':
-                ducts['air_density'] = float(item[1])
-            elif item[0] == 'roughness':
-                ducts['roughness'] = float(item[1])
-            elif item[0] == 'rounding':
-                ducts['rounding'] = item[1]
-            elif item[0] == 'fitting':  # initializing fittings information
-                fitting = new_fitting()
-                fitting['fandist'] = 0
-                fitting['ID'] = float(item[1])
-                fitting['type'] = item[2]
-                try:  # checking for air handeling units
-                    fitting['IDup'] = item[3]
-                except Exception:
-                    pass
-                if item[2] == 'duct':  # check for ducts. Ducts should have length feet
-                    fitting['length'] = float(item[4])
-                elif item[2] == 'diffuser':  # check for diffusers. Diffusers should have flowrate in CFM
-                    fitting['flow'] = float(item[4])
-                else:  # Everything not a duct or diffuser
-                    pass
-                ducts['fittings'].append(fitting)
-            else:
-                continue
+    """Builds the duct network from the input lines (a list or an open file).
+
+    The fittings go straight into the columns of a connected DuctNetwork,
+    ducts['fittings'] holds views of its rows.
+    """
+    ducts, columns = parse_keywords(data)
+    network = ducts['network'] = make_network(columns)
+    ducts['fittings'] = network.fittings
     return ducts
 
 
+def parse_keywords(data):
+    """Reads the settings and fitting columns from the input lines, without connecting them.
+
+    Every malformed line is collected and raised together as an InputError:
+    bad numbers, unknown fitting types or tee ports, missing fields and
+    duplicate fitting IDs.
+
+    :return: ducts dict without its network, and the fitting columns for make_network
+    """
+    ducts = new_duct_network()
+    IDs, types, IDups, ports, lengths, flows = [], [], [], [], [], []
+    errors = []
+    first_seen = {}  # fitting ID -> line number
+    for lineno, keyword, rest in tokenize(data):
+        item = [x.strip() for x in rest.split(',')]
+        try:
+            if keyword == 'fitting':  # initializing fittings information
+                ID = parse_ID(item[0])
+                fitting_type = item[1].lower()
+                if fitting_type not in FITTING_TYPES:
+                    raise ValueError('unknown fitting type %r' % item[1])
+                if ID in first_seen:
+                    raise ValueError('duplicate fitting ID %d, first given on line %d' % (ID, first_seen[ID]))
+                IDup = -1
+                port = NO_PORT
+                if fitting_type != 'air_handling_unit':  # everything else hangs off an upstream fitting
+                    if len(item) < 3 or not item[2]:
+                        raise ValueError('%s %d has no upstream fitting' % (fitting_type, ID))
+                    # resolve "N-main"/"N-branch" tee ports once here
+                    IDup, _, port_name = item[2].partition('-')
+                    IDup = parse_ID(IDup)
+                    if port_name:
+                        port_name = port_name.strip().lower()
+                        if port_name not in ('main', 'branch'):
+                            raise ValueError('unknown tee port %r' % item[2])
+                        port = BRANCH if port_name == 'branch' else MAIN
+                length = flow = np.nan
+                if fitting_type == 'duct':  # check for ducts. Ducts should have length feet
+                    length = float(item[3])
+                elif fitting_type == 'diffuser':  # check for diffusers. Diffusers should have flowrate in CFM
+                    flow = float(item[3])
+                first_seen[ID] = lineno
+                IDs.append(ID)
+                types.append(FITTING_TYPES.index(fitting_type))
+                IDups.append(IDup)
+                ports.append(port)
+                lengths.append(length)
+                flows.append(flow)
+            elif keyword == 'title':
+                ducts['title'] = rest.strip()
+            elif keyword == 'fan_pressure':
+                if len(item) > 1 and item[1]:  # "fan_pressure, 1.2, 101" is for air handler 101 only
+                    ducts['fan_pressures'][parse_ID(item[1])] = float(item[0])
+                else:
+                    ducts['fan_pressure'] = float(item[0])
+            elif keyword == 'air_density':
+                ducts['air_density'] = float(item[0])
+            elif keyword == 'roughness':
+                ducts['roughness'] = float(item[0])
+            elif keyword == 'rounding':
+                ducts['rounding'] = item[0].lower()
+        except IndexError:
+            errors.append((lineno, '%s line is missing fields' % keyword))
+        except ValueError as error:
+            errors.append((lineno, str(error)))
+    if errors:
+        raise InputError(errors)
+    return ducts, dict(ID=IDs, type=types, IDup=IDups, port=ports, length=lengths, flow=flows)
+
+
+def make_network(columns):  # connects the fitting columns of parse_keywords
+    network = DuctNetwork(**columns)
+    network.fandist[:] = 0
+    return network
+
+
 def find_fitting(ID, fittings):
+    pyduct_instrument.count('find_fitting.calls')
     for fitting in fittings:
         if fitting['ID'] == ID:
             return fitting
 
 
 def make_connections(fittings):
-    # regex patterns for matching main and branch ID up text
-    main_pattern = re.compile(r'\d+\b-main\b')
-    branch_pattern = re.compile(r'\d+\b-branch\b')
-    for fitting in fittings:
-        if fitting['IDup'] is None:  # check for AHUs
-            continue
-        elif main_pattern.match(fitting['IDup']):  # main line from Tee
-            # Find index of hyphen when present
-            index_of_hyphen = fitting['IDup'].find('-')
-            tee_ID = int(fitting['IDup'][:index_of_hyphen])
-            tee_fitting = find_fitting(tee_ID, fittings)
-            tee_fitting['IDdownMain'] = fitting['ID']
-        elif branch_pattern.match(fitting['IDup']):  # branch from Tee
-            index_of_hyphen = fitting['IDup'].find('-')
-            tee_ID = int(fitting['IDup'][:index_of_hyphen])
-            tee_fitting = find_fitting(tee_ID, fittings)
-            tee_fitting['IDdownBranch'] = fitting['ID']
-        else:  # all other fittings
-            fittingUp = find_fitting(float(fitting['IDup']), fittings)
-            fittingUp['IDdownMain'] = fitting['ID']
+    # the network behind the fittings; fitting dicts get copied into a new one and their downstream IDs set
+    if isinstance(fittings, FittingList):
+        return fittings.network
+    network = DuctNetwork.from_fittings(fittings)
+    for fitting, view in zip(fittings, network.fittings):
+        fitting['IDdownMain'] = view['IDdownMain']
+        fitting['IDdownBranch'] = view['IDdownBranch']
+    return network
 
 
-def setup_fan_distances(fittings):
-    for fitting in fittings:
-        # check for AHU
-        if fitting['type'] == 'air_handling_unit':
-            fitting['fandist'] = 0
-        # fittingUp is a tee
-        elif fitting['IDup'].find('-') != -1:
-            index_of_hyphen = fitting['IDup'].find('-')
-            tee_ID = int(fitting['IDup'][:index_of_hyphen])
-            fittingUp = find_fitting(tee_ID, fittings)
-            fitting['fandist'] = fittingUp['fandist']
-        # fittings up is duct. Add length
-        elif find_fitting(int(fitting['IDup']), fittings)['type'] == 'duct':
-            fittingUp = find_fitting(int(fitting['IDup']), fittings)
-            fitting['fandist'] = fittingUp['fandist'] + fittingUp['length']
-        # all the elbow, tee, and duct fittings
-        else:
-            fittingUp = find_fitting(int(fitting['IDup']), fittings)
-            fitting['fandist'] = fittingUp['fandist']
-
-
-def setup_flowrates(fittings):  # Iterates, takes flow from duct downstream and makes it the flow of the fitting
-    for i in range(1000):  # Iterations
-        for fitting in fittings:
-            if fitting['IDdownBranch'] is None and fitting['IDdownMain'] is not None:  # Straightaways
-                MainDown = find_fitting(fitting['IDdownMain'], fittings)
-                flow = MainDown['flow']
-                if flow is None:  # Avoids errors
-                    continue
-                fitting['flow'] = flow  # Sets flowrate to singular downstream piece
-            elif fitting['IDdownMain'] is None:  # Diffusers
-                continue
-            elif fitting['IDdownBranch'] is not None and fitting['IDdownMain'] is not None:  # Tee's
-                MainDown = find_fitting(fitting['IDdownMain'], fittings)
-                flow = MainDown['flow']  # Sets partial flow to main downstream piece
-                if flow is None:  # Avoids errors
-                    continue
-                BranchDown = find_fitting(fitting['IDdownBranch'], fittings)
-                if BranchDown['flow'] is None:  # Avoids errors
-                    continue
-                flow = BranchDown['flow'] + flow  # Adds branch flow to mainflow
-                fitting['flow'] = flow  # Sets flow for fitting
-            else:
-                print("There was an error in the flow rate.")  # Error message, just in case
+def as_network(fittings):
+    # the network to work on for a DuctNetwork, its ducts['fittings'] views or a list of fitting dicts
+    if isinstance(fittings, DuctNetwork):
+        return fittings
+    return make_connections(fittings)
 
 
-def get_little_f(dia, velocity, roughness):
-    def func(vals):
-        f = vals
-        Re = 8.5 * (dia / 12) * velocity  # eqn (21)
+def write_back(network, fittings):
+    # fitting dicts given in place of a network get what was worked out for them
+    if not isinstance(fittings, (DuctNetwork, FittingList)):
+        for fitting, view in zip(fittings, network.fittings):
+            fitting.update(view)
 
-        # eqn (19) 2013 version corrected for units
-        left_side = 1 / np.sqrt(f)
-        right_right = (-1) * 2 * np.log10((roughness / (3.7 * (dia / 12))) + (2.51 / (Re * np.sqrt(f))))
-        return (right_right - left_side)
 
-    guess = 10
-    finished = False
-    while not finished:
-        f = fsolve(func, guess, full_output=True)
-        if int(f[2]) == 1:  # check solution flag
-            finished = True
+def setup_fan_distances(fittings):
+    # one pass over the rows, upstream fittings always come first
+    # ducts add their length, the elbow, tee, and tee port fittings nothing
+    network = as_network(fittings)
+    step = np.where(network.type == DUCT, network.length, 0.0).tolist()
+    parent = network.parent.tolist()
+    fandist = network.fandist.tolist()
+    for i in network.order.tolist():
+        up = parent[i]
+        if up < 0:  # air handling unit
+            fandist[i] = 0
         else:
-            guess = guess / 2.0  # update guess
-    return f[0][0]
+            fandist[i] = fandist[up] + step[up]
+    network.fandist[:] = fandist
+    network.farthest = None  # fan distances changed
+    write_back(network, fittings)
+
+
+def setup_flowrates(fittings):  # sums diffuser flows from the terminals back up to the fan in one pass
+    network = as_network(fittings)
+    network.validate()  # every problem with the network at once, before anything is summed or solved
+
+    types = network.type.tolist()
+    main_child = network.main_child.tolist()
+    branch_child = network.branch_child.tolist()
+    flow = network.flow.tolist()
+    flowMain = network.flowMain.tolist()
+    flowBranch = network.flowBranch.tolist()
+    for i in reversed(network.order.tolist()):  # downstream fittings always come first
+        if types[i] == DIFFUSER:
+            continue
+        main = main_child[i]
+        if types[i] == TEE:
+            branch = branch_child[i]
+            flowMain[i] = flow[main]
+            flowBranch[i] = flow[branch]
+            flow[i] = flow[main] + flow[branch]  # Adds branch flow to mainflow
+        else:
+            flow[i] = flow[main]  # Sets flowrate to singular downstream piece
+
+    network.flow[:] = flow
+    network.flowMain[:] = flowMain
+    network.flowBranch[:] = flowBranch
+    write_back(network, fittings)
+
+
+def get_little_f(dia, velocity, roughness):  # dia [inches], velocity [fpm], roughness [ft]
+    pyduct_instrument.count('get_little_f.calls')
+    if np.ndim(dia) or np.ndim(velocity):  # arrays go straight to the vectorized solver
+        return colebrook_f(dia, velocity, roughness)
+    key = friction_cache.key(dia, velocity, roughness)
+    f = friction_cache.get(key)
+    if f is None:
+        f = colebrook_f(dia, velocity, roughness)
+        friction_cache.put(key, f)
+    return f
 
 
 def largest_path(fittings):  # Finds the diffuser with the longest path to the fan
-    fitting_compare = find_fitting(1, fittings)  # Sets the initial fitting that will be compared
-    for fitting in fittings:
-        if fitting['type'] == 'diffuser':
-            if fitting['fandist'] > fitting_compare['fandist']:  # compare fan distances
-                fitting_compare = fitting  # sets new comparison
-    return fitting_compare
+    network = as_network(fittings)
+    if network.farthest is None:  # not found yet, or fan distances changed since
+        farthest = network.roots[0]  # Sets the initial fitting that will be compared
+        diffusers = np.nonzero(network.type == DIFFUSER)[0]
+        if len(diffusers):
+            # first of the equally far diffusers in input order, and only if farther than the fan
+            candidate = diffusers[np.argmax(network.fandist[diffusers])]
+            if network.fandist[candidate] > network.fandist[farthest]:
+                farthest = candidate
+        network.farthest = int(farthest)
+    if isinstance(fittings, DuctNetwork):
+        return network.view(network.farthest)
+    return fittings[network.farthest]  # the caller's own fitting
 
 
 def duct_pressure_drop(dia, flow, length, density, roughness):  # dia [inches], length [ft]
@@ -180,139 +311,107 @@ def duct_pressure_drop(dia, flow, length, density, roughness):  # dia [inches],
     return pdrop
 
 
+def route_step_losses(network):
+    # pressure drop picked up stepping from each fitting's upstream fitting down into it,
+    # as (all losses, tee and elbow losses only) columns
+    loss = np.where((network.type == DUCT) | (network.type == ELBOW), network.pdrop, 0.0)
+    fitting_loss = np.where(network.type == ELBOW, network.pdrop, 0.0)
+    below_tee = network.parent >= 0
+    below_tee[below_tee] = network.type[network.parent[below_tee]] == TEE
+    tee_loss = np.where(network.port == BRANCH, network.pdropBranch, network.pdropMain)
+    loss[below_tee] += tee_loss[below_tee]
+    fitting_loss[below_tee] += tee_loss[below_tee]
+    return loss, fitting_loss
+
+
+def route_totals(network, tops=None):
+    """Pressure drop from the fan to every fitting below tops, in one top-down pass.
+
+    Each fitting's total is its upstream fitting's total plus its route_step_losses,
+    so the whole network costs O(n) however many diffusers there are. tops are IDs
+    whose subtrees to cover (default the air handlers); their starting totals come
+    from one walk up to the fan each.
+
+    :return: (pressure drop, tee and elbow losses only) from the fan to each fitting,
+             as columns that are NaN outside the covered subtrees
+    """
+    step, fitting_step = route_step_losses(network)
+    step = step.tolist()
+    fitting_step = fitting_step.tolist()
+    parent = network.parent.tolist()
+    loss = [np.nan] * len(parent)
+    fitting_loss = [np.nan] * len(parent)
+    if tops is None:
+        routes = [[i] for i in network.roots.tolist()]
+    else:
+        routes = sorted((network.route_rows(network.position[ID]) for ID in tops), key=len)  # outermost first
+
+    def fill(rows):  # rows below covered fittings, upstream fittings first
+        for i in rows:
+            up = parent[i]
+            if up >= 0:
+                loss[i] = loss[up] + step[i]
+                fitting_loss[i] = fitting_loss[up] + fitting_step[i]
+
+    for route in routes:
+        top = route[0]
+        if loss[top] == loss[top]:  # inside a subtree already covered
+            continue
+        loss[top] = fitting_loss[top] = 0.0
+        for i in reversed(route[:-1]):
+            loss[top] += step[i]
+            fitting_loss[top] += fitting_step[i]
+        if tops is not None:
+            fill(network.subtree_rows(top)[1:])
+    if tops is None:
+        fill(network.order.tolist())
+    return np.array(loss), np.array(fitting_loss)
+
+
+def route_pressure_drop(route, network, fittings_only=False):
+    # route runs from the terminal fitting back to the air handler
+    rows = network.positions(route).tolist()
+    types = network.type
+    pdrop_sum = 0
+    for i in range(len(rows)):
+        row = rows[i]
+        if types[row] == ELBOW or (types[row] == DUCT and not fittings_only):
+            pdrop_sum += network.pdrop[row]
+        elif types[row] == TEE:
+            # next downstream fitting
+            next_row = rows[i - 1]
+            if network.port[next_row] == BRANCH:
+                pdrop_sum += network.pdropBranch[next_row]
+            else:
+                pdrop_sum += network.pdropMain[next_row]
+    return float(pdrop_sum)
+
+
 # Nick and Charlie
 def pressure_drop_sum(ID, fittings):  # calculates total pressure loss of ANY RUN
-    # find the fitting dictionary attached to the ID in quesiton
-    fitting = find_fitting(int(ID), fittings)
-    route = [int(fitting['ID'])]
-    main_pattern = re.compile(r'\d+\b-main\b')
-    branch_pattern = re.compile(r'\d+\b-branch\b')
-
-    # find route IDs
-    while fitting['type'] != 'air_handling_unit':  # while not at the air handler
-        if main_pattern.match(fitting['IDup']):  # matching main if IDup is tee
-            index_of_hyphen = fitting['IDup'].find('-')
-            ID = int(fitting['IDup'][:index_of_hyphen])
-            route.append(ID)
-            fitting = find_fitting(ID, fittings)
-        elif branch_pattern.match(fitting['IDup']):  # matching branch if IDup is tee
-            index_of_hyphen = fitting['IDup'].find('-')
-            ID = int(fitting['IDup'][:index_of_hyphen])
-            route.append(ID)
-            fitting = find_fitting(ID, fittings)
-        else:
-            ID = int(fitting['IDup'])
-            route.append(ID)
-            fitting = find_fitting(ID, fittings)
-
-    pdrop_sum = 0
-    for i in range(len(route)):
-        fitting = find_fitting(int(route[i]), fittings)
-        if fitting['type'] == 'duct' or fitting['type'] == 'elbow':
-            pdrop_sum += fitting['pdrop']
-        elif fitting['type'] == 'tee':
-            # next downstream fitting ID
-            next_fitting_ID = route[i - 1]
-            if next_fitting_ID == fitting['IDdownMain']:
-                pdrop_sum += find_fitting(int(next_fitting_ID), fittings)['pdropMain']
-            elif next_fitting_ID == fitting['IDdownBranch']:
-                pdrop_sum += find_fitting(int(next_fitting_ID), fittings)['pdropBranch']
-    return pdrop_sum
+    network = as_network(fittings)
+    return route_pressure_drop(network.path_to_fan(ID), network)
 
 
 def fitting_loss_sum(fittings):  # calculates total pressure loss of tees and elbows only, of LONGEST RUN
-    farthest_fitting = largest_path(fittings)
-    fitting = farthest_fitting
-    longest_route = [int(fitting['ID'])]
-    main_pattern = re.compile(r'\d+\b-main\b')
-    branch_pattern = re.compile(r'\d+\b-branch\b')
-
-    # find longest route using farthest diffusers
-    while fitting['type'] != 'air_handling_unit':  # while not at the air handler
-        if main_pattern.match(fitting['IDup']):  # matching main if IDup is tee
-            index_of_hyphen = fitting['IDup'].find('-')
-            ID = int(fitting['IDup'][:index_of_hyphen])
-            longest_route.append(ID)
-            fitting = find_fitting(ID, fittings)
-        elif branch_pattern.match(fitting['IDup']):  # matching branch if IDup is tee
-            index_of_hyphen = fitting['IDup'].find('-')
-            ID = int(fitting['IDup'][:index_of_hyphen])
-            longest_route.append(ID)
-            fitting = find_fitting(ID, fittings)
-        else:
-            ID = int(fitting['IDup'])
-            longest_route.append(ID)
-            fitting = find_fitting(ID, fittings)
-
-    pdrop_fitloss_sum = 0
-    for i in range(len(longest_route)):
-        fitting = find_fitting(int(longest_route[i]), fittings)
-        if fitting['type'] == 'elbow':
-            pdrop_fitloss_sum += fitting['pdrop']
-        elif fitting['type'] == 'tee':
-            # next downstream fitting ID
-            next_fitting_ID = longest_route[i - 1]
-            if next_fitting_ID == fitting['IDdownMain']:
-                pdrop_fitloss_sum += find_fitting(int(next_fitting_ID), fittings)['pdropMain']
-            elif next_fitting_ID == fitting['IDdownBranch']:
-                pdrop_fitloss_sum += find_fitting(int(next_fitting_ID), fittings)['pdropBranch']
-    return pdrop_fitloss_sum
+    network = as_network(fittings)
+    farthest_fitting = largest_path(network)
+    longest_route = network.path_to_fan(farthest_fitting['ID'])
+    return route_pressure_drop(longest_route, network, fittings_only=True)
 
 
 def get_duct_size(deltap, flow, length, density, roughness):
-    def func(vals):
-        dia = vals
-        return deltap - duct_pressure_drop(dia, flow, length, density, roughness)
-
-    finished = False
-    guess = .01
-    while not finished:
-        # print(guess)
-        f = fsolve(func, guess, full_output=True)
-        if int(f[2]) == 1:
-            finished = True
-        else:
-            guess = guess * 2.0
-    diameter = f[0][0]
+    # the diameter only depends on the pressure drop per foot, not the length itself
+    pyduct_instrument.count('get_duct_size.calls')
+    dpdl = deltap / length
+    key = duct_size_cache.key(flow, dpdl, density, roughness)
+    diameter = duct_size_cache.get(key)
+    if diameter is None:
+        diameter = size_ducts(flow, dpdl, density, roughness)
+        duct_size_cache.put(key, diameter)
     return diameter
 
 
-def findBetween(x, xlist):
-    # iterate over xlist to find where x fits in
-    for position in range(0, len(xlist) - 1):
-        # check if the current iteration in xlist is good
-        if (xlist[position] <= x <= xlist[position + 1]) or (xlist[position] >= x >= xlist[position + 1]):
-            return position
-
-
-def interp1D(x, xlist, ylist):
-    # find between value
-    position = findBetween(x, xlist)
-
-    # gather needed numbers from xlist and ylist
-    x1 = xlist[position]
-    x3 = xlist[position + 1]
-    y1 = ylist[position]
-    y3 = ylist[position + 1]
-
-    # interpolate value of y
-    y = (((x - x1) * (y3 - y1)) / (x3 - x1)) + y1
-    return y
-
-
-def interp2D(x, y, xlist, ylist, zmatrix):
-    # find the correct column to use
-    yposition = findBetween(y, ylist)
-
-    # extract and interpolate each column
-    x1 = interp1D(x, xlist, zmatrix[:, yposition])
-    x2 = interp1D(x, xlist, zmatrix[:, yposition + 1])
-
-    # interpolate between columns
-    z = interp1D(y, ylist[yposition:yposition + 2], [x1, x2])
-    return z
-
-
 def tee_pressure_drop(dia, density, flow, outlet_flow, outlet_dia, branch):
     '''
 
@@ -324,30 +423,6 @@ def tee_pressure_drop(dia, density, flow, outlet_flow, outlet_dia, branch):
     :param branch: Boolean
     :return:
     '''
-    Q = np.array([.1, .2, .3, .4, .5, .6, .7, .8, .9])  # top most row Q_(branch/main)/Q_common
-    A = np.array([.1, .2, .3, .4, .5, .6, .7, .8, .9])  # right most column A_(branch/main)/A_common
-
-    # Table from 2009 ASHRAE Handbook 21.50 for SD5-10 Tee, Concial Branch Tapered into Body, Diverging
-    # c_branch values
-    sd5cb = np.array([[0.65, 0.24, 0.15, 0.11, 0.09, 0.07, 0.06, 0.05, 0.05],
-                      [2.98, 0.65, 0.33, 0.24, 0.18, 0.15, 0.13, 0.11, 0.10],
-                      [7.36, 1.56, 0.65, 0.39, 0.29, 0.24, 0.20, 0.17, 0.15],
-                      [13.78, 2.98, 1.20, 0.65, 0.43, 0.33, 0.27, 0.24, 0.21],
-                      [22.24, 4.92, 1.98, 1.04, 0.65, 0.47, 0.36, 0.30, 0.26],
-                      [32.73, 7.36, 2.98, 1.56, 0.96, 0.65, 0.49, 0.39, 0.33],
-                      [45.26, 10.32, 4.21, 2.21, 1.34, 0.90, 0.65, 0.51, 0.42],
-                      [59.82, 13.78, 5.67, 2.98, 1.80, 1.20, 0.86, 0.65, 0.52],
-                      [76.41, 17.75, 7.36, 3.88, 2.35, 1.56, 1.11, 0.83, 0.65]])
-    # c_main values
-    sd5cm = np.array([[0.13, 0.16, 0.57, 0.74, 0.74, 0.70, 0.65, 0.60, 0.56],
-                      [0.20, 0.13, 0.15, 0.16, 0.28, 0.57, 0.69, 0.74, 0.75],
-                      [0.90, 0.13, 0.13, 0.14, 0.15, 0.16, 0.20, 0.42, 0.57],
-                      [2.88, 0.20, 0.14, 0.13, 0.14, 0.15, 0.15, 0.16, 0.34],
-                      [6.25, 0.37, 0.17, 0.14, 0.13, 0.14, 0.14, 0.15, 0.15],
-                      [11.88, 0.90, 0.20, 0.13, 0.14, 0.13, 0.14, 0.14, 0.15],
-                      [18.62, 1.71, 0.33, 0.18, 0.16, 0.14, 0.13, 0.15, 0.14],
-                      [26.88, 2.88, 0.50, 0.20, 0.15, 0.14, 0.13, 0.13, 0.14],
-                      [36.45, 4.46, 0.90, 0.30, 0.19, 0.16, 0.15, 0.14, 0.13]])
     area = (np.pi * (dia / 12) ** 2) / 4
     velocity = flow / area
     p_v = density * (velocity / 1097) ** 2
@@ -356,36 +431,19 @@ def tee_pressure_drop(dia, density, flow, outlet_flow, outlet_dia, branch):
     area_ratio = A_outlet / A_common
     flow_ratio = outlet_flow / flow
 
-    # protect from extrapolating on the table
-    if area_ratio > .9:
-        area_ratio = .9
-    elif area_ratio < .1:
-        area_ratio = .1
-    if flow_ratio > .9:
-        flow_ratio = .9
-    elif flow_ratio < .1:
-        flow_ratio = .1
+    # the tables clamp both ratios to .1-.9 so they are never extrapolated
     if branch:
-        c_branch = interp2D(area_ratio, flow_ratio, A, Q, sd5cb)
+        c_branch = SD5_10_BRANCH(area_ratio, flow_ratio)
         pdrop = c_branch * p_v
     else:
-        c_main = interp2D(area_ratio, flow_ratio, A, Q, sd5cm)
+        c_main = SD5_10_MAIN(area_ratio, flow_ratio)
         pdrop = c_main * p_v
     return pdrop
 
 
 def elbow_pressure_drop(dia, flow, density):
-    # Table from ASHRAE 2009 chapter 21 for pleated 90 degree elbow
-    D = np.array([4, 6, 8, 10, 12, 14, 16])
-    Co = np.array([0.57, 0.43, 0.34, 0.28, 0.26, 0.25, 0.25])
-
-    # protect from extrapolating on the table
-    if dia >= 16:
-        c_o = 0.25
-    elif dia <= 4:
-        c_o = 0.57
-    else:
-        c_o = interp1D(dia, D, Co)
+    # pleated 90 degree elbow, c_o is held at the table ends outside 4-16 inches
+    c_o = PLEATED_ELBOW_90(dia)
 
     area = (np.pi * (dia / 12) ** 2) / 4
     velocity = flow / area
@@ -394,203 +452,256 @@ def elbow_pressure_drop(dia, flow, density):
     return pdrop
 
 
+def check_settings(ducts):
+    # the settings sizing needs: air_density, roughness and a fan pressure for every air handler, its own
+    # or fan_pressure; all that are missing are raised together as a NetworkError, as validate does
+    network = ducts['network']
+    own = dict((int(ID), pressure) for ID, pressure in (ducts.get('fan_pressures') or {}).items())
+    roots = network.ID[network.roots].tolist()
+    problems = ['fan pressure given for %d, which is not an air handler' % ID for ID in sorted(set(own) - set(roots))]
+    if ducts.get('fan_pressure') is None:
+        missing = [ID for ID in roots if own.get(ID) is None]
+        if len(missing) == len(roots):
+            problems.append('no fan_pressure given')
+        else:
+            problems.extend('no fan pressure for air handler %d' % ID for ID in missing)
+    problems.extend('no %s given' % name for name in ('air_density', 'roughness') if ducts.get(name) is None)
+    if problems:
+        raise NetworkError(problems)
+
+
 # Nick Nelsen 5/4/17
-def sizing_iterate_nick(ducts):
+def size_network(ducts, dpdl=None, changed=None, tol=1e-10, rtol=0.0, maxiter=100, accelerate=True, progress=None,
+                 budget=None):
+    """Equal friction sizing of every fitting, iterating on the pressure drop per foot.
+
+    dpdl = (fan_pressure - fitting losses on the longest run) / longest run is a
+    fixed point problem: each pass sizes the whole network for a dpdl and gives
+    the next one. The passes are accelerated with secant steps on the residual
+    (falling back to the plain update when a secant step is not usable, or to
+    halving dpdl when the fittings take all of the fan pressure) and stop once the
+    residual is below tol or rtol * dpdl. Raises SolverError if that takes more
+    than maxiter passes or budget seconds (default no limit besides maxiter).
+
+    dpdl warm starts the iteration from an earlier solution. If changed (a set of
+    fitting IDs) is also given, every other fitting is assumed to already be sized
+    for that dpdl and the first pass only re-sizes the changed ones.
+
+    progress, if given, is called as progress('sizing', info) after every pass with
+    info holding the pass number (iteration), its dpdl and residual. It may raise
+    Cancelled to stop.
+
+    :return: dict with the final dpdl, number of passes, converged flag, final residual
+             and the (dpdl, residual) history of every pass
+    """
     # assign for easier use later
     density = ducts['air_density']
     roughness = ducts['roughness']
     fan_pressure = ducts['fan_pressure']
-    fittings = ducts['fittings']
-    maxlength = largest_path(fittings)['fandist']
+    network = ducts['network']
+    if network is None:
+        network = ducts['network'] = make_connections(ducts['fittings'])
+    check_settings(ducts)
+    maxlength = largest_path(network)['fandist']
+    if not maxlength > 0:
+        raise NetworkError(['there is no duct between the fan and its farthest diffuser'])
 
     # take care of nonetype errors the cheesy way
-    for fitting in fittings:
-        if fitting['pdrop'] is None:
-            fitting['pdrop'] = 0.0
-        if fitting['pdropMain'] is None:
-            fitting['pdropMain'] = 0.0
-        if fitting['pdropBranch'] is None:
-            fitting['pdropBranch'] = 0.0
-
-    psum = fitting_loss_sum(fittings)
-    dpdl = (fan_pressure - psum) / maxlength
-    dpdl_old = 0
-    count = 0
-    # main loop to size ducts first, then elbows, and finally tees
-    while abs(dpdl - dpdl_old) >= 1e-10:
-        for fitting in fittings:  # solving ducts
-            if fitting['type'] == 'duct':
-                length = fitting['length']
-                deltap = dpdl * length
-                flow = fitting['flow']
-                diameter = get_duct_size(deltap, flow, length, density, roughness)
-                fitting['size'] = diameter
-                # p_duct = duct_pressure_drop(diameter, flow, length, density, roughness)
-                p_duct = deltap
-                # print(p_duct, p_duct2)
-                fitting['pdrop'] = p_duct
-
-        for fitting in fittings:  # solving elbows
-            if fitting['type'] == 'elbow':
-                down_fitting = find_fitting(int(fitting['IDdownMain']), fittings)
-                if down_fitting['type'] == 'duct':
-                    e_diameter = down_fitting['size']
-                    p_elbow = elbow_pressure_drop(e_diameter, fitting['flow'], density)
-                    fitting['size'] = e_diameter
-                    fitting['pdrop'] = p_elbow
-
-                # if up_fitting is a tee
-                elif fitting['IDup'].find('-') != -1:
-                    index_of_hyphen = fitting['IDup'].find('-')
-                    tee_ID = int(fitting['IDup'][:index_of_hyphen])
-                    up_fitting = find_fitting(tee_ID, fittings)
-                    e_diameter = up_fitting['size']
-                    p_elbow = elbow_pressure_drop(e_diameter, fitting['flow'], density)
-                    fitting['size'] = e_diameter
-                    fitting['pdrop'] = p_elbow
-                # if up_fitting has no hyphen
+    if dpdl is None:
+        for column in (network.pdrop, network.pdropMain, network.pdropBranch):
+            column[np.isnan(column)] = 0.0
+
+    def size_pass(dpdl, rows):  # size ducts first, then elbows, and finally tees
+        types = network.type[rows]
+        # every duct is sized together in one batch; each pass has a new dpdl, so a cache would never hit here
+        duct_rows = rows[types == DUCT]
+        network.size[duct_rows] = size_ducts(network.flow[duct_rows], dpdl, density, roughness)  # solving ducts
+        network.pdrop[duct_rows] = dpdl * network.length[duct_rows]
+
+        # elbows and tees take their sizes from their neighbours, one at a time in input order
+        size = network.size.tolist()
+        elbow_rows = rows[types == ELBOW]
+        if len(elbow_rows):  # solving elbows
+            for i in elbow_rows.tolist():
+                down = network.main_child[i]
+                if network.type[down] == DUCT:
+                    size[i] = size[down]
+                # otherwise take the size of the fitting (or tee) upstream
                 else:
-                    up_fitting = find_fitting(int(fitting['IDup']), fittings)
-                    # if up_fitting['size'] is not None:
-                    e_diameter = up_fitting['size']
-                    p_elbow = elbow_pressure_drop(e_diameter, fitting['flow'], density)
-                    fitting['size'] = e_diameter
-                    fitting['pdrop'] = p_elbow
-
-        for fitting in fittings:  # solving tees
-            if fitting['type'] == 'tee':
-                up_fitting = find_fitting(int(fitting['IDup']), fittings)
-                tee_inlet_diameter = up_fitting['size']
-                p_tee_main = tee_pressure_drop(tee_inlet_diameter, density, fitting['flow'],
-                                               find_fitting(fitting['IDdownMain'], fittings)['flow'],
-                                               find_fitting(fitting['IDdownMain'], fittings)['size'], False)
-                p_tee_branch = tee_pressure_drop(tee_inlet_diameter, density, fitting['flow'],
-                                                 find_fitting(fitting['IDdownBranch'], fittings)['flow'],
-                                                 find_fitting(fitting['IDdownBranch'], fittings)['size'], True)
-                fitting['size'] = tee_inlet_diameter
-                fitting['sizeMain'] = find_fitting(fitting['IDdownMain'], fittings)['size']
-                fitting['sizeBranch'] = find_fitting(fitting['IDdownBranch'], fittings)['size']
-                fitting['pdropMain'] = p_tee_main
-                fitting['pdropBranch'] = p_tee_branch
-
-        psum = fitting_loss_sum(fittings)
-        dpdl_old = dpdl
+                    size[i] = size[network.parent[i]]
+            network.size[elbow_rows] = [size[i] for i in elbow_rows.tolist()]
+            network.pdrop[elbow_rows] = elbow_pressure_drop(network.size[elbow_rows], network.flow[elbow_rows], density)
+
+        tee_rows = rows[types == TEE]
+        if len(tee_rows):  # solving tees, sizes in order then all the table lookups at once
+            outlet_sizes = []
+            for i in tee_rows.tolist():
+                size[i] = size[network.parent[i]]
+                outlet_sizes.append((size[network.main_child[i]], size[network.branch_child[i]]))
+            network.size[tee_rows] = [size[i] for i in tee_rows.tolist()]
+            network.sizeMain[tee_rows], network.sizeBranch[tee_rows] = np.transpose(outlet_sizes)
+            dia = network.size[tee_rows]
+            flow = network.flow[tee_rows]
+            network.pdropMain[tee_rows] = tee_pressure_drop(dia, density, flow, network.flowMain[tee_rows],
+                                                            network.sizeMain[tee_rows], False)
+            network.pdropBranch[tee_rows] = tee_pressure_drop(dia, density, flow, network.flowBranch[tee_rows],
+                                                              network.sizeBranch[tee_rows], True)
+
+        psum = fitting_loss_sum(network)
+        return (fan_pressure - psum) / maxlength - dpdl
+
+    if dpdl is None:
+        psum = fitting_loss_sum(network)
         dpdl = (fan_pressure - psum) / maxlength
-
-    for fitting in fittings:
-        if fitting['type'] == 'diffuser':
-            fitting['diffuser_psum'] = pressure_drop_sum(int(fitting['ID']), fittings)
-
-    # rounding stuff
-    if ducts['rounding'] is not None:
-        if ducts['rounding'] == 'nearest':
-            for fitting in fittings:
-                if fitting['type'] != 'air_handling_unit' and fitting['type'] != 'diffuser':
-                    fitting['size'] = round(fitting['size'])
-                    if fitting['type'] == 'tee':
-                        fitting['sizeMain'] = round(fitting['sizeMain'])
-                        fitting['sizeBranch'] = round(fitting['sizeBranch'])
-        elif ducts['rounding'] == 'up':
-            for fitting in fittings:
-                if fitting['type'] != 'air_handling_unit' and fitting['type'] != 'diffuser':
-                    fitting['size'] = np.ceil(fitting['size'])
-                    if fitting['type'] == 'tee':
-                        fitting['sizeMain'] = np.ceil(fitting['sizeMain'])
-                        fitting['sizeBranch'] = np.ceil(fitting['sizeBranch'])
-        elif ducts['rounding'] == 'down':
-            for fitting in fittings:
-                if fitting['type'] != 'air_handling_unit' and fitting['type'] != 'diffuser':
-                    fitting['size'] = np.floor(fitting['size'])
-                    if fitting['type'] == 'tee':
-                        fitting['sizeMain'] = np.floor(fitting['sizeMain'])
-                        fitting['sizeBranch'] = np.floor(fitting['sizeBranch'])
-
-        # recalculate pdrop everything after rounding
-        for fitting in fittings:
-            if fitting['type'] == 'duct':
-                fitting['pdrop'] = duct_pressure_drop(fitting['size'], fitting['flow'], fitting['length'], density,
-                                                      roughness)
-            elif fitting['type'] == 'tee':
-                fitting['flowMain'] = find_fitting(int(fitting['IDdownMain']), fittings)['flow']
-                fitting['pdropMain'] = tee_pressure_drop(fitting['size'], density, fitting['flow'], fitting['flowMain'],
-                                                         fitting['sizeMain'], False)
-                fitting['flowBranch'] = find_fitting(int(fitting['IDdownBranch']), fittings)['flow']
-                fitting['pdropBranch'] = tee_pressure_drop(fitting['size'], density, fitting['flow'],
-                                                           fitting['flowBranch'], fitting['sizeBranch'], True)
-            elif fitting['type'] == 'elbow':
-                fitting['pdrop'] = elbow_pressure_drop(fitting['size'], fitting['flow'], density)
+        changed = None
+        if not dpdl > 0:
+            raise SolverError('size_network', 'has no pressure for the ducts, fan pressure %s in. wg' % fan_pressure)
+    all_rows = np.arange(len(network.ID))
+    pass_rows = all_rows
+    if changed is not None:  # first pass only touches the changed fittings, in input order
+        pass_rows = np.sort(network.positions(list(changed)))
+    history = []
+    previous = None
+    converged = False
+    start = time.perf_counter()
+    residual = np.nan
+    for count in range(maxiter):
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+        residual = size_pass(dpdl, pass_rows)
+        pass_rows = all_rows
+        history.append((dpdl, residual))
+        if progress is not None:
+            progress('sizing', dict(iteration=len(history), dpdl=dpdl, residual=residual))
+        if abs(residual) < max(tol, rtol * abs(dpdl)):
+            converged = True
+            break
+        dpdl_next = dpdl + residual
+        if accelerate and previous is not None and residual != previous[1]:
+            secant = dpdl - residual * (dpdl - previous[0]) / (residual - previous[1])
+            if secant > 0:  # ducts can only be sized for a positive dpdl
+                dpdl_next = secant
+        if not dpdl_next > 0:  # the fittings took all of the fan pressure at this dpdl's sizes
+            dpdl_next = dpdl / 2
+        previous = (dpdl, residual)
+        dpdl = dpdl_next
+    stats = pyduct_instrument.current
+    if stats is not None:
+        stats.count('size_network.passes', len(history))
+        stats.convergence.update(iterations=len(history), dpdl=dpdl, residual=residual, converged=converged)
+    if not converged:
+        detail = 'ran out of its %g s budget' % budget if len(history) < maxiter else 'did not converge'
+        raise SolverError('size_network', '%s, last dpdl %g in. wg/ft' % (detail, dpdl), len(history), residual,
+                          time.perf_counter() - start)
+
+    return dict(dpdl=dpdl, iterations=len(history), converged=converged, residual=residual, history=history)
+
+
+def diffuser_pressures(network, tops=None):  # total pressure loss from the fan to each diffuser below tops
+    totals = route_totals(network, tops)
+    diffusers = (network.type == DIFFUSER) & ~np.isnan(totals[0])
+    network.diffuser_psum[diffusers] = totals[0][diffusers]
+    return totals
+
+
+def apply_rounding(network, rounding, density, roughness, fan_pressure=None):
+    # rounds the sizes in place and recalculates the pressure drops that depend on them;
+    # 'optimal' picks standard sizes within fan_pressure (or {air handler ID: fan pressure})
+    # instead. In every mode diffuser_psum keeps the design pressures from before rounding,
+    # call diffuser_pressures for those of the rounded sizes
+    if rounding is None:
+        return
+    if rounding == 'optimal':
+        from pyduct_optimize import optimize_sizes  # not needed for the plain rounding modes
+        design = network.diffuser_psum.copy()
+        optimized = optimize_sizes(network, fan_pressure, density, roughness)
+        network.diffuser_psum[:] = design
+        return optimized
+    round_size = {'nearest': np.round, 'up': np.ceil, 'down': np.floor}.get(rounding)
+    types = network.type
+    if round_size is not None:
+        sized = (types != AHU) & (types != DIFFUSER)
+        network.size[sized] = round_size(network.size[sized])
+        tees = types == TEE
+        network.sizeMain[tees] = round_size(network.sizeMain[tees])
+        network.sizeBranch[tees] = round_size(network.sizeBranch[tees])
+    fitting_pressure_drops(network, density, roughness)  # recalculate pdrop everything after rounding
+
+
+def fitting_pressure_drops(network, density, roughness):
+    # pdrop, pdropMain and pdropBranch of every fitting for its current sizes and flows,
+    # each fitting type in one batch
+    types = network.type
+    ducts = types == DUCT
+    if ducts.any():
+        network.pdrop[ducts] = duct_pressure_drop(network.size[ducts], network.flow[ducts], network.length[ducts],
+                                                  density, roughness)
+    tees = types == TEE
+    if tees.any():
+        dia = network.size[tees]
+        flow = network.flow[tees]
+        network.pdropMain[tees] = tee_pressure_drop(dia, density, flow, network.flowMain[tees],
+                                                    network.sizeMain[tees], False)
+        network.pdropBranch[tees] = tee_pressure_drop(dia, density, flow, network.flowBranch[tees],
+                                                      network.sizeBranch[tees], True)
+    elbows = types == ELBOW
+    if elbows.any():
+        network.pdrop[elbows] = elbow_pressure_drop(network.size[elbows], network.flow[elbows], density)
+
+
+def sizing_iterate_nick(ducts, tol=1e-10, rtol=0.0, maxiter=100, accelerate=True, progress=None, workers=None,
+                        budget=None):
+    # sizes the network, totals the diffuser pressures, then applies the rounding option;
+    # several air handlers (or a fan pressure of its own for one) size each tree on its own, see pyduct_ahu
+    if ducts.get('network') is None:  # fitting dicts put together by hand, they get the results written into them
+        ducts['network'] = make_connections(ducts['fittings'])
+        convergence = sizing_iterate_nick(ducts, tol, rtol, maxiter, accelerate, progress, workers, budget)
+        write_back(ducts['network'], ducts['fittings'])
+        return convergence
+    network = ducts['network']
+    if len(network.roots) > 1 or ducts.get('fan_pressures'):
+        from pyduct_ahu import size_air_handlers  # imports this module
+        return size_air_handlers(ducts, workers, progress, tol=tol, rtol=rtol, maxiter=maxiter, accelerate=accelerate,
+                                 budget=budget)
+    convergence = size_network(ducts, tol=tol, rtol=rtol, maxiter=maxiter, accelerate=accelerate, progress=progress,
+                               budget=budget)
+    network = ducts['network']
+    totals = diffuser_pressures(network)
+    farthest = largest_path(network)
+    convergence['critical_path'] = list(reversed(network.path_to_fan(farthest['ID'])))  # fan to diffuser
+    convergence['critical_fitting_loss'] = float(totals[1][network.farthest])
+    optimized = apply_rounding(network, ducts['rounding'], ducts['air_density'], ducts['roughness'],
+                               ducts['fan_pressure'])
+    if optimized is not None:
+        convergence['optimized'] = optimized
 
     # finally apply sizes to diffuers
-    for fitting in fittings:
-        if fitting['type'] == 'diffuser':
-            fitting['size'] = find_fitting(int(fitting['IDup']), fittings)['size']
-
-    return
-
-
-def print_results(fittings):
-    # file=open("pyductresults.txt","w")
-    print('ID'.rjust(4), 'Fitting'.rjust(20), 'Velocity (fpm)'.rjust(15), 'Q (cfm)'.rjust(15), 'DeltaP (in. wg)'.rjust(16),
-          'Diameter (in)'.rjust(17), 'Diffuser pressure (in. wg)'.rjust(25))
-    print('-'*120)
-    orig_stdout = sys.stdout
-    file = open("pyductresult.txt", "w+")
-    sys.stdout = file
-    print('ID'.rjust(4), 'Fitting'.rjust(20), 'Velocity (fpm)'.rjust(15), 'Q (cfm)'.rjust(15), 'DeltaP (in. wg)'.rjust(16),
-          'Diameter (in)'.rjust(17), 'Diffuser pressure (in. wg)'.rjust(25))
-    print('-'*120)
-    sys.stdout = orig_stdout
-    for fitting in fittings:
-        if fitting['type'] != 'air_handling_unit':
-            # TODO: @sziske needs to fix this
-            # velocity = 5
-            velocity = fitting['flow'] / (np.pi * (fitting['size'] / 12) * (fitting['size'] / 12))
-        else:
-            velocity = 0.0
-            fitting['size'] = 0.0
-        if fitting['pdrop'] is None:
-            fitting['pdrop'] = 0.0
-        if fitting['size'] is None:
-            fitting['size'] = 0.0
-        if fitting['diffuser_psum'] is None:
-            print(repr(fitting['ID']).rjust(4), fitting['type'].rjust(20), ("%.3f" % velocity).rjust(15),
-                  ("%.1f" % fitting['flow']).rjust(15), ("%.3f" % fitting['pdrop']).rjust(16),
-                  ("%.3f" % fitting['size']).rjust(17))
-            orig_stdout = sys.stdout
-            sys.stdout = file
-            print(repr(fitting['ID']).rjust(4), fitting['type'].rjust(20), ("%.3f" % velocity).rjust(15),
-                  ("%.1f" % fitting['flow']).rjust(15), ("%.3f" % fitting['pdrop']).rjust(16),
-                  ("%.3f" % fitting['size']).rjust(17))
-            sys.stdout = orig_stdout
-        else:
-            print(repr(fitting['ID']).rjust(4), fitting['type'].rjust(20), ("%.3f" % velocity).rjust(15),
-                  ("%.1f" % fitting['flow']).rjust(15), ("%.3f" % fitting['pdrop']).rjust(16),
-                  ("%.3f" % fitting['size']).rjust(17), ("%.3f" % fitting['diffuser_psum']).rjust(25))
-            orig_stdout = sys.stdout
-            sys.stdout = file
-            print(repr(fitting['ID']).rjust(4), fitting['type'].rjust(20), ("%.3f" % velocity).rjust(15),
-                  ("%.1f" % fitting['flow']).rjust(15), ("%.3f" % fitting['pdrop']).rjust(16),
-                ("%.3f" % fitting['size']).rjust(17), ("%.3f" % fitting['diffuser_psum']).rjust(25))
-            sys.stdout = orig_stdout
+    diffusers = network.type == DIFFUSER
+    network.size[diffusers] = network.size[network.parent[diffusers]]
+
+    return convergence
 
-    file.close()
+
+def print_results(fittings, result_file='pyductresult.txt', echo=True, format=None):
+    # writes the results to result_file (a name or an open stream), and to the console too when echo is set
+    write_results(fittings, result_file, format, echo)
 
 
 def print_fitting(f):
-    print(' ', int(f['ID']), ' ', end='')
+    print(' ', f['ID'], ' ', end='')
     print(f['type'], ' ', end='')
     if f['IDup'] is not None:
         print('connects to: ', f['IDup'], end='')
     if f['BranchUP'] is not None:
-        print('-', f['branchUp'])
+        print('-', f['BranchUP'])
     else:
         print('\n', end='')
     if f['length'] is not None:
         print('    length: ', f['length'])
     if f['IDdownMain'] is not None:
-        print('    IDdownMain: ', int(f['IDdownMain']))
+        print('    IDdownMain: ', f['IDdownMain'])
     if f['IDdownBranch'] is not None:
-        print('    IDdownBranch', int(f['IDdownBranch']))
+        print('    IDdownBranch', f['IDdownBranch'])
     if f['flow'] is not None:
         print('    flow: ', f['flow'])
     if f['fandist'] is not None:
@@ -610,6 +721,8 @@ def print_fitting(f):
 def print_summary(ducts):
     print('title: ', ducts['title'])
     print('fan_pressure: ', ducts['fan_pressure'])
+    for ID, fan_pressure in sorted(ducts['fan_pressures'].items()):
+        print('fan_pressure of %d: ' % ID, fan_pressure)
     print('air_density: ', ducts['air_density'])
     print('roughness: ', ducts['roughness'])
     print('rounding: ', ducts['rounding'])
@@ -618,18 +731,89 @@ def print_summary(ducts):
         print_fitting(f)
 
 
-def calculate(filename):
-    file_data = read_input_file(filename)
-    ducts = process_keywords(file_data)
-    fittings = ducts['fittings']
-    make_connections(fittings)
-    setup_flowrates(fittings)
-    setup_fan_distances(fittings)
-    sizing_iterate_nick(ducts)
-    print_results(fittings)
+def calculate(filename, result_file='pyductresult.txt', echo=True, cache_dir=None, result_format=None,
+              instrument=None, progress=None, workers=None, budget=None):
+    # cache_dir keeps the compiled network of each input on disk, see pyduct_cache
+    # result_format is 'table', 'csv' or 'jsonl', see pyduct_results
+    # instrument=True (or an Instrumentation to add to) records stage times and solver
+    # counts in ducts['instrumentation'], see pyduct_instrument
+    # progress(stage, info) is called as each stage starts (info empty) and after every
+    # sizing pass (see size_network); raising Cancelled from it stops the calculation
+    # workers is how many processes size the trees of several air handlers, see pyduct_ahu
+    # budget is the most seconds each sizing may take before it raises SolverError, see size_network
+    if not instrument:
+        return _calculate(filename, result_file, echo, cache_dir, result_format, progress, workers, budget)
+    with pyduct_instrument.recording(None if instrument is True else instrument) as instrumentation:
+        ducts = _calculate(filename, result_file, echo, cache_dir, result_format, progress, workers, budget)
+    ducts['instrumentation'] = instrumentation
+    return ducts
+
+
+CALCULATE_STAGES = ('parse', 'flows', 'fan_distances', 'sizing', 'output')  # 'load' replaces the first three
+
+
+def _calculate(filename, result_file, echo, cache_dir, result_format, progress=None, workers=None, budget=None):
+    def stage(name):
+        if progress is not None:
+            progress(name, {})
+        return pyduct_instrument.stage(name)
+
+    if cache_dir is None:
+        with stage('parse'):
+            ducts = read_ducts(filename)
+        with stage('flows'):
+            setup_flowrates(ducts['network'])
+        with stage('fan_distances'):
+            setup_fan_distances(ducts['network'])
+    else:
+        from pyduct_cache import load_ducts  # imports this module
+        with stage('load'):
+            ducts = load_ducts(filename, cache_dir)
+    with stage('sizing'):
+        sizing_iterate_nick(ducts, progress=progress, workers=workers, budget=budget)
+    with stage('output'):
+        print_results(ducts['fittings'], result_file, echo, result_format)
+    return ducts
+
+
+def main(argv=None):
+    # headless entry point for one input file, python -m pyduct input.txt
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m pyduct', description='Size the duct network of one input file.')
+    parser.add_argument('input', help='pyduct input file')
+    parser.add_argument('-o', '--output', default='pyductresult.txt', help='result file, - for standard output')
+    parser.add_argument('-f', '--format', choices=('table', 'csv', 'jsonl'), default=None,
+                        help='result format (default: from the output extension, else table)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not echo the results to the console')
+    parser.add_argument('--cache', nargs='?', const='', default=None, metavar='DIR',
+                        help='reuse the compiled network if the input is unchanged')
+    parser.add_argument('--stats', metavar='FILE', help='write stage times and solver counts as JSON')
+    parser.add_argument('-j', '--jobs', type=int, help='processes sizing the trees of several air handlers')
+    parser.add_argument('--version', action='version', version='pyduct ' + __version__)
+    args = parser.parse_args(argv)
+
+    cache_dir = args.cache
+    if cache_dir == '':
+        from pyduct_cache import default_cache_dir
+        cache_dir = default_cache_dir()
+    output = args.output
+    echo = not args.quiet
+    if output == '-':
+        output = sys.stdout
+        echo = False
+    try:
+        ducts = calculate(args.input, output, echo, cache_dir, args.format, instrument=bool(args.stats),
+                          workers=args.jobs)
+    except (OSError, InputError, NetworkError, SolverError) as error:
+        print('pyduct: %s' % error, file=sys.stderr)
+        return 1
+    if args.stats:
+        ducts['instrumentation'].to_json(args.stats)
+    return 0
 
 
 if __name__ == '__main__':
-    # filename = 'Duct Design Sample Input.txt'
-    # calculate(filename)
-    print('Please run from main.py')
+    # run as python -m pyduct this file is __main__, while pyduct_cache and pyduct_ahu import it again as
+    # pyduct; only that module's main catches the InputError they raise, this copy's class is another one
+    import pyduct
+    sys.exit(pyduct.main())
@@ -0,0 +1,140 @@
+# Networks with several air handlers: one independent supply tree per AHU.
+#
+#   fan_pressure, 1.0          the default for every air handler
+#   fan_pressure, 1.4, 101     air handler 101 only
+#
+# Each air handler's tree is cut out into a network of its own, with its own fan
+# pressure, and sized exactly as a file with only that air handler would be, so
+# the dpdl of one tree never depends on another. Large networks size the trees
+# across a process pool, biggest first, so the sizing takes about as long as the
+# largest tree rather than all of them. The sized columns are then written back
+# into the full network, which is reported as usual.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyduct_instrument
+from pyduct import check_settings, diffuser_pressures, size_network, sizing_iterate_nick
+from pyduct_network import FLOAT_COLUMNS, DuctNetwork
+
+PARALLEL_MIN_FITTINGS = 20000  # smaller networks are sized in this process, a pool costs more than it saves
+
+
+def fan_pressures(ducts):
+    # air handler ID -> fan pressure [in. wg], for every air handler in the network
+    check_settings(ducts)  # every air handler has one
+    network = ducts['network']
+    given = dict((int(ID), pressure) for ID, pressure in (ducts.get('fan_pressures') or {}).items())
+    return dict((ID, ducts['fan_pressure'] if given.get(ID) is None else given[ID])
+                for ID in network.ID[network.roots].tolist())
+
+
+def split_air_handlers(ducts):
+    """One ducts dict per air handler, holding a network of only its tree.
+
+    :return: list of (air handler ID, rows of its tree in the full network, ducts),
+             the rows in input order
+    """
+    network = ducts['network']
+    pressures = fan_pressures(ducts)
+    trees = []
+    for root in network.roots.tolist():
+        rows = sorted(network.subtree_rows(root))  # input order, elbows and tees are sized in it
+        tree = network.select(rows)
+        ID = int(network.ID[root])
+        trees.append((ID, rows, dict(ducts, network=tree, fittings=tree.fittings, fan_pressure=pressures[ID],
+                                     fan_pressures={})))
+    return trees
+
+
+def _size_tree(ducts, finish, options, progress=None):
+    if finish:
+        return sizing_iterate_nick(ducts, progress=progress, workers=1, **options)
+    convergence = size_network(ducts, progress=progress, **options)
+    diffuser_pressures(ducts['network'])
+    return convergence
+
+
+def _size_tree_arrays(settings, arrays, finish, options, instrument=False):
+    # runs in a worker process: sizes one tree from its saved arrays, returns the sized columns,
+    # the convergence and, if instrument is set, the solver counters of the worker for the caller to add up
+    network = DuctNetwork.from_arrays(arrays)
+    ducts = dict(settings, network=network, fittings=network.fittings)
+    if not instrument:
+        return network.columns, _size_tree(ducts, finish, options), None
+    with pyduct_instrument.recording() as instrumentation:
+        convergence = _size_tree(ducts, finish, options)
+    return network.columns, convergence, instrumentation.counts
+
+
+def size_air_handlers(ducts, workers=None, progress=None, finish=True, **options):
+    """Sizes the tree of every air handler on its own, with its own fan pressure.
+
+    A tree that fails raises its SolverError or NetworkError here, the same with or
+    without a pool, and the trees still being sized are abandoned.
+
+    :param workers: processes to size the trees in; default all CPUs for networks of at
+           least PARALLEL_MIN_FITTINGS fittings, otherwise 1 (no pool)
+    :param progress: as for size_network; with a pool it is called once per finished tree
+    :param finish: size as sizing_iterate_nick does (diffuser pressures, rounding and diffuser
+           sizes); otherwise only size_network and diffuser_pressures, as DuctModel needs
+    :param options: tol, rtol, maxiter, accelerate and budget for size_network
+    :return: the convergence of the first air handler, with the passes, converged flag and
+             residual over all of them, and every air handler's convergence and ID in
+             'air_handlers'
+    """
+    network = ducts['network']
+    trees = split_air_handlers(ducts)
+    if workers is None:
+        workers = os.cpu_count() if len(network.ID) >= PARALLEL_MIN_FITTINGS else 1
+    workers = min(workers, len(trees))
+    stats = pyduct_instrument.current
+
+    convergences = {}
+    if workers <= 1:
+        for ID, rows, tree in trees:
+            convergences[ID] = _size_tree(tree, finish, options, progress)
+            _merge(network, rows, tree['network'].columns)
+    else:
+        pool = ProcessPoolExecutor(workers)
+        try:
+            futures = {}
+            for ID, rows, tree in sorted(trees, key=lambda tree: -len(tree[1])):  # largest first
+                settings = dict((key, value) for key, value in tree.items() if key not in ('network', 'fittings'))
+                futures[pool.submit(_size_tree_arrays, settings, tree['network'].arrays(), finish, options,
+                                    stats is not None)] = (ID, rows)
+            for done, future in enumerate(as_completed(futures), 1):
+                ID, rows = futures[future]
+                columns, convergences[ID], counts = future.result()
+                _merge(network, rows, columns)
+                for name, n in (counts or {}).items():
+                    stats.count(name, n)
+                if progress is not None:
+                    progress('sizing', dict(iteration=done, dpdl=convergences[ID]['dpdl'],
+                                            residual=convergences[ID]['residual']))
+        except BaseException:  # a failed tree fails the sizing, the others need not finish
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            pool.shutdown()
+
+    air_handlers = [dict(convergences[ID], ID=ID, fan_pressure=tree['fan_pressure']) for ID, rows, tree in trees]
+    convergence = dict(air_handlers[0])
+    del convergence['ID']
+    convergence.update(iterations=max(c['iterations'] for c in air_handlers),
+                       converged=all(c['converged'] for c in air_handlers),
+                       residual=max((c['residual'] for c in air_handlers), key=abs),
+                       air_handlers=air_handlers)
+    network.farthest = None
+    if stats is not None:  # each tree's size_network left only its own, keep them all
+        keys = ('dpdl', 'iterations', 'converged', 'residual')
+        stats.convergence.clear()
+        stats.convergence.update((key, convergence[key]) for key in keys)
+        stats.convergence['air_handlers'] = [dict([('ID', c['ID'])] + [(key, c[key]) for key in keys])
+                                             for c in air_handlers]
+    return convergence
+
+
+def _merge(network, rows, columns):
+    for key in FLOAT_COLUMNS:
+        network.columns[key][rows] = columns[key]
@@ -0,0 +1,293 @@
+# Flow balancing: the flows that a network of fixed duct sizes actually delivers.
+#
+#   python pyduct_balance.py "Duct Design Sample Input.txt" --rounding up -o balanced.txt
+#   python pyduct_balance.py zone.txt --fan-curve 0:1.3 600:1.1 900:0.6
+#
+# Design sizing takes the diffuser flows and gives the sizes. Here the sizes are
+# fixed (as built, e.g. rounded) and the flows are found. Every diffuser ends in a
+# terminal resistance K [in. wg/cfm^2]. By default K is that of a balancing damper
+# set for the design: K Q^2 takes up the fan pressure left over at that
+# diffuser's design flow and diffuser_psum. The loss from the fan to each
+# diffuser is the route total of diffuser_pressures, made of pyduct's duct, elbow
+# and tee losses at the simulated flows. The design sizes therefore give back the
+# design flows, and rounded sizes give the flows they really deliver.
+#
+# The solver is Hardy Cross style successive substitution on the tree. Each
+# fitting's loss is written as R q^2, with R taken at the current flows. That tree
+# of quadratic resistances is solved exactly in one pass up and one pass down.
+# Going up, series resistances add and the two outlets of a tee combine as
+# 1/sqrt(R) sums. Going down, the fan pressure or fan curve gives each air
+# handler's flow and the tees split it by their outlets' resistances. R is then
+# updated at the new flows until the diffuser flows settle. Friction factors and
+# tee coefficients change only slowly with flow, so a few passes are enough.
+#
+# An outlet without resistance, e.g. the critical diffuser right on a tee port
+# with no damper, holds the tee at zero pressure and takes all of its flow. If
+# neither outlet has any, every split balances and the current one is kept. A
+# fitting left without flow keeps the R of the last flow it carried.
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from pyduct import (apply_rounding, diffuser_pressures, fitting_pressure_drops, read_ducts, route_step_losses,
+                    setup_fan_distances, setup_flowrates, sizing_iterate_nick)
+from pyduct_ahu import fan_pressures
+from pyduct_friction import SolverError
+from pyduct_network import AHU, DIFFUSER, TEE
+from pyduct_results import write_results
+
+
+def air_handler_rows(network):
+    # row of each fitting's air handler, -1 for rows no air handler reaches
+    root = np.full(len(network.ID), -1, dtype=np.int64)
+    root[network.roots] = network.roots
+    parent = network.parent.tolist()
+    top = root.tolist()
+    for i in network.order.tolist():
+        if parent[i] >= 0:
+            top[i] = top[parent[i]]
+    return np.array(top, dtype=np.int64)
+
+
+def design_terminals(network, fan_pressure):
+    """Terminal resistance of every diffuser that gives its design flow at the design sizes.
+
+    Takes the design pressures from diffuser_psum, which every rounding mode
+    leaves at those of the sizes before rounding (see apply_rounding).
+
+    :param fan_pressure: fan pressure [in. wg] of every air handler, or a dict of air
+           handler ID to its fan pressure
+    :return: K [in. wg/cfm^2] per row, NaN for anything but diffusers; zero where the
+             design pressure drop already takes all of the fan pressure
+    """
+    pressures = _root_pressures(network, fan_pressure)[air_handler_rows(network)]
+    diffusers = network.type == DIFFUSER
+    K = np.full(len(network.ID), np.nan)
+    K[diffusers] = np.maximum(pressures[diffusers] - network.diffuser_psum[diffusers], 0.0) \
+        / network.flow[diffusers] ** 2
+    return K
+
+
+def _root_pressures(network, fan_pressure):
+    # fan pressure per row of the air handlers, NaN elsewhere
+    pressures = np.full(len(network.ID), np.nan)
+    for i in network.roots.tolist():
+        pressures[i] = fan_pressure.get(int(network.ID[i])) if isinstance(fan_pressure, dict) else fan_pressure
+    return pressures
+
+
+def fan_flow(resistance, fan_pressure=None, fan_curve=None, tol=1e-12, maxiter=200):
+    """Air handler flow [cfm] into a system of resistance [in. wg/cfm^2].
+
+    With a fan_curve, a pair of flow [cfm] and pressure [in. wg] arrays with the
+    flows increasing, the flow is where the curve meets the system curve
+    resistance * Q^2, found by bisection. Beyond its ends the curve is held at its
+    end pressures.
+    """
+    if fan_curve is None:
+        return np.sqrt(fan_pressure / resistance)
+    flows, pressures = (np.asarray(column, dtype=float) for column in fan_curve)
+    low, high = 0.0, np.sqrt(pressures.max() / resistance)
+    for count in range(maxiter):
+        middle = (low + high) / 2
+        if np.interp(middle, flows, pressures) > resistance * middle ** 2:
+            low = middle
+        else:
+            high = middle
+        if high - low <= tol * high:
+            return (low + high) / 2
+    raise SolverError('fan_flow', 'found no operating point on the fan curve', maxiter, high - low)
+
+
+def balance_flows(network, density, roughness, fan_pressure=None, fan_curve=None, terminals=None, tol=1e-10,
+                  maxiter=100, budget=None):
+    """Flows through a network of fixed sizes, for a fan pressure or a fan curve.
+
+    The network must be connected with its flows set up and be sized, e.g. by
+    calculate. Its sizes, sizeMain and sizeBranch are used as they are and its
+    flows are only the starting guess. The network itself is not changed.
+
+    :param fan_pressure: fan pressure [in. wg] of every air handler, or a dict of air
+           handler ID to its fan pressure
+    :param fan_curve: (flows [cfm], pressures [in. wg]) of the fan of every air handler,
+           in place of fan_pressure
+    :param terminals: K [in. wg/cfm^2] of every diffuser as a column over the rows, or one
+           value for all; default design_terminals(network, fan_pressure), with the fan
+           curve's pressure at the design flow if only a fan curve is given
+    :param tol: stop once no diffuser flow changes by more than tol of its design flow in a pass
+    :param maxiter: passes before giving up with a SolverError
+    :param budget: seconds before giving up with a SolverError, default no limit
+    :return: dict with the balanced network (a copy with the simulated flows, pressure
+             drops and diffuser_psum), the passes, the largest relative imbalance at a
+             diffuser (residual) and each air handler's flow and pressure by ID
+    """
+    if fan_curve is None and fan_pressure is None:
+        raise ValueError('balance_flows needs a fan pressure or a fan curve')
+    if terminals is None:
+        if fan_pressure is None:  # dampers set for the design flow on the fan curve
+            fan_pressure = dict((int(network.ID[i]), float(np.interp(network.flow[i], *fan_curve)))
+                                for i in network.roots.tolist())
+        terminals = design_terminals(network, fan_pressure)
+    start = time.perf_counter()
+    n = len(network.ID)
+    diffusers = network.type == DIFFUSER
+    K = np.zeros(n)
+    K[diffusers] = np.broadcast_to(terminals, (n,))[diffusers]
+    root_pressure = _root_pressures(network, fan_pressure) if fan_curve is None else np.full(n, np.nan)
+
+    balanced = network.copy()
+    for column in (balanced.pdrop, balanced.pdropMain, balanced.pdropBranch):
+        column[np.isnan(column)] = 0.0  # rows without a loss of that kind
+    order = network.order.tolist()
+    bottom_up = order[::-1]
+    types = network.type.tolist()
+    main_child = network.main_child.tolist()
+    branch_child = network.branch_child.tolist()
+    tees = network.type == TEE
+    tee_main = network.main_child[tees]
+    tee_branch = network.branch_child[tees]
+    flow = balanced.flow.copy()
+    carried = flow.copy()  # the last flow of every row that was not zero, the one its R is taken at
+    change = np.inf
+    count = 0
+    while count < maxiter:
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+        count += 1
+        # losses at the current flows, as resistances of each step down into a fitting
+        carried = np.where(flow > 0, flow, carried)
+        _set_flows(balanced, carried, tees, tee_main, tee_branch)
+        fitting_pressure_drops(balanced, density, roughness)
+        step = route_step_losses(balanced)[0]
+        R = (step / carried ** 2 + K).tolist()
+
+        # up: resistance of every fitting's subtree from its inlet
+        S = R[:]
+        for i in bottom_up:
+            main = main_child[i]
+            if main < 0:
+                continue
+            if types[i] == TEE:
+                branch = branch_child[i]
+                if S[main] > 0 and S[branch] > 0:  # an outlet without resistance adds none
+                    S[i] += 1 / (S[main] ** -0.5 + S[branch] ** -0.5) ** 2
+            else:
+                S[i] += S[main]
+
+        # down: each air handler's flow from its fan, split at the tees
+        current = flow.tolist()
+        new = flow.tolist()
+        for i in order:
+            if types[i] == AHU:
+                new[i] = fan_flow(S[i], root_pressure[i], fan_curve)
+            main = main_child[i]
+            if main < 0:
+                continue
+            if types[i] == TEE:
+                branch = branch_child[i]
+                if S[main] > 0 and S[branch] > 0:
+                    share = S[main] ** -0.5 / (S[main] ** -0.5 + S[branch] ** -0.5)
+                elif S[main] > 0 or S[branch] > 0:  # all of it through the outlet without resistance
+                    share = float(S[main] == 0)
+                else:  # any split balances, keep this one
+                    share = current[main] / current[i] if current[i] > 0 else 0.5
+                new[main] = new[i] * share
+                new[branch] = new[i] - new[main]
+            else:
+                new[main] = new[i]
+        new = np.array(new)
+        change = np.max(np.abs(new[diffusers] - flow[diffusers]) / network.flow[diffusers], initial=0.0)
+        flow = new
+        if change <= tol:
+            break
+    if not change <= tol:
+        detail = 'ran out of its %g s budget' % budget if count < maxiter else 'did not converge'
+        raise SolverError('balance_flows', detail, count, change, time.perf_counter() - start)
+
+    # the losses R q^2 at the balanced flows, nothing where no air flows
+    carried = np.where(flow > 0, flow, carried)
+    _set_flows(balanced, carried, tees, tee_main, tee_branch)
+    fitting_pressure_drops(balanced, density, roughness)
+    scale = (flow / carried) ** 2
+    for column in (balanced.pdrop, balanced.pdropMain, balanced.pdropBranch):
+        column *= scale
+    _set_flows(balanced, flow, tees, tee_main, tee_branch)
+    diffuser_pressures(balanced)
+    top = air_handler_rows(network)
+    pressures = root_pressure.copy()
+    if fan_curve is not None:
+        pressures[network.roots] = np.interp(flow[network.roots], *fan_curve)
+    drop = balanced.diffuser_psum + K * flow ** 2  # from the fan through the diffuser's terminal
+    residual = np.max(np.abs(drop[diffusers] - pressures[top[diffusers]]) / pressures[top[diffusers]], initial=0.0)
+    air_handlers = [dict(ID=int(network.ID[i]), flow=float(flow[i]), fan_pressure=float(pressures[i]))
+                    for i in network.roots.tolist()]
+    return dict(network=balanced, iterations=count, residual=float(residual), air_handlers=air_handlers)
+
+
+def _set_flows(network, flow, tees, tee_main, tee_branch):
+    network.flow[:] = flow
+    network.flowMain[tees] = flow[tee_main]
+    network.flowBranch[tees] = flow[tee_branch]
+
+
+def parse_curve(points):
+    # "cfm:in_wg" points into (flows, pressures), sorted by flow
+    pairs = sorted(tuple(float(value) for value in point.split(':')) for point in points)
+    if len(pairs) < 2 or any(len(pair) != 2 for pair in pairs):
+        raise ValueError('a fan curve needs at least two cfm:pressure points')
+    return tuple(np.array(column) for column in zip(*pairs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flows a sized duct network delivers, for its fan pressure or a '
+                                                 'fan curve.')
+    parser.add_argument('input', help='pyduct input file, sized as calculate would')
+    parser.add_argument('--rounding', choices=('none', 'nearest', 'up', 'down', 'optimal'),
+                        help='size with this rounding instead of the one in the file')
+    parser.add_argument('--fan-curve', nargs='+', metavar='CFM:IN_WG',
+                        help='fan curve points for every air handler, in place of the fan pressure')
+    parser.add_argument('-o', '--output', help='write every fitting at the balanced flows, as pyduct results')
+    parser.add_argument('-f', '--format', choices=('table', 'csv', 'jsonl'), default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        fan_curve = parse_curve(args.fan_curve) if args.fan_curve else None
+        ducts = read_ducts(args.input)
+        rounding = args.rounding if args.rounding is not None else ducts['rounding']
+        network = ducts['network']
+        setup_flowrates(network)
+        setup_fan_distances(network)
+        pressures = fan_pressures(ducts)
+        # dampers set for the design pressures, then the sizes rounded as sizing_iterate_nick would
+        sizing_iterate_nick(dict(ducts, rounding=None))
+        settings = pressures
+        if fan_curve is not None:  # the fan curve's pressure at the design flow
+            settings = dict((ID, float(np.interp(network.flow[network.position[ID]], *fan_curve))) for ID in pressures)
+        terminals = design_terminals(network, settings)
+        apply_rounding(network, rounding, ducts['air_density'], ducts['roughness'], pressures)
+        diffusers = network.type == DIFFUSER
+        network.size[diffusers] = network.size[network.parent[diffusers]]
+        result = balance_flows(network, ducts['air_density'], ducts['roughness'], pressures, fan_curve, terminals)
+    except (OSError, ValueError, SolverError) as error:  # InputError and NetworkError are ValueErrors
+        print('pyduct_balance: %s' % error, file=sys.stderr)
+        return 1
+
+    balanced = result['network']
+    print('%d passes, largest imbalance %.2e' % (result['iterations'], result['residual']))
+    for air_handler in result['air_handlers']:
+        print('air handler %d: %.1f cfm at %.3f in. wg' % (air_handler['ID'], air_handler['flow'],
+                                                          air_handler['fan_pressure']))
+    print('%8s %12s %12s %9s' % ('diffuser', 'design cfm', 'actual cfm', 'change'))
+    for i in np.nonzero(network.type == DIFFUSER)[0].tolist():
+        design, actual = network.flow[i], balanced.flow[i]
+        print('%8d %12.1f %12.1f %8.1f%%' % (network.ID[i], design, actual, 100 * (actual - design) / design))
+    if args.output:
+        write_results(balanced, args.output, args.format)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# Headless batch sizing of many pyduct input files across a process pool.
+#
+#   python pyduct_batch.py zones/ extra_zone.txt -j 8 -o results/
+#
+# Every input gets its own <name>_result.txt (or .csv/.jsonl with -f) in the output
+# directory. A file that fails to size gets a <name>_error.txt with the traceback
+# instead and does not stop the rest of the batch, not even if it kills its worker
+# process. Bad networks are rejected before sizing, and --timeout caps the sizing
+# time of each input.
+
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from pyduct import calculate
+from pyduct_cache import default_cache_dir
+from pyduct_results import FORMATS
+
+
+def find_inputs(paths, pattern='*.txt'):
+    # expands directories into the matching files inside them, keeps the given order otherwise
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+RESULT_EXTENSIONS = dict(table='.txt', csv='.csv', jsonl='.jsonl')
+
+
+def result_names(filenames, output_dir):
+    # one result file per input, numbered when two inputs share a name
+    names = []
+    used = set()
+    for filename in filenames:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        name = stem
+        count = 1
+        while name in used:
+            count += 1
+            name = '%s_%d' % (stem, count)
+        used.add(name)
+        names.append(os.path.join(output_dir, name))
+    return names
+
+
+def run_job(filename, result_base, cache_dir=None, result_format='table', stats=False, timeout=None):
+    # stats also writes the stage times and solver counts to <name>_stats.json
+    # timeout [s] is the sizing budget, the job fails with a SolverError past it
+    start = time.time()
+    output = result_base + '_result' + RESULT_EXTENSIONS[result_format]
+    try:
+        ducts = calculate(filename, output, echo=False, cache_dir=cache_dir, result_format=result_format,
+                          instrument=stats, workers=1, budget=timeout)  # the batch is parallel already
+        if stats:
+            ducts['instrumentation'].to_json(result_base + '_stats.json')
+    except Exception:
+        with open(result_base + '_error.txt', 'w') as file:
+            file.write(traceback.format_exc())
+        return dict(input=filename, ok=False, seconds=time.time() - start, output=result_base + '_error.txt')
+    return dict(input=filename, ok=True, seconds=time.time() - start, output=output)
+
+
+def run_batch(filenames, output_dir='.', workers=None, cache_dir=None, result_format='table', stats=False,
+              timeout=None):
+    """Sizes every input file in a pool of worker processes.
+
+    :param filenames: input files
+    :param output_dir: directory for the result and error files, created if needed
+    :param workers: number of processes, default one per CPU
+    :param cache_dir: compiled network cache shared by the workers, None for no cache
+    :param result_format: 'table', 'csv' or 'jsonl'
+    :param stats: write the instrumentation of every input to <name>_stats.json
+    :param timeout: seconds the sizing of one input may take, None for no limit
+    :return: list of dicts (input, ok, seconds, output), in input order
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    bases = result_names(filenames, output_dir)
+    options = (cache_dir, result_format, stats, timeout)
+    if workers == 1:  # no pool, handy for debugging
+        return [run_job(filename, base, *options) for filename, base in zip(filenames, bases)]
+    jobs = [None] * len(filenames)
+    lost = _run_pool(list(range(len(filenames))), filenames, bases, options, workers, jobs)
+    # a worker that died took every job still running with it; each of those runs again in a
+    # pool of its own, so only the job that kills its worker fails
+    for k in lost:
+        if _run_pool([k], filenames, bases, options, 1, jobs):
+            jobs[k] = _lost_job(filenames[k], bases[k])
+    return jobs
+
+
+def _run_pool(indices, filenames, bases, options, workers, jobs):
+    # runs the jobs of these indices into jobs, returns the indices lost to a broken pool
+    lost = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(run_job, filenames[k], bases[k], *options), k) for k in indices)
+        for future in as_completed(futures):
+            k = futures[future]
+            try:
+                jobs[k] = future.result()
+            except BrokenProcessPool:
+                lost.append(k)
+    return sorted(lost)
+
+
+def _lost_job(filename, base):
+    with open(base + '_error.txt', 'w') as file:
+        file.write('the worker process sizing %s died\n' % filename)
+    return dict(input=filename, ok=False, seconds=0.0, output=base + '_error.txt')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Size many pyduct input files in parallel.')
+    parser.add_argument('inputs', nargs='+', help='input files or directories of input files')
+    parser.add_argument('-o', '--output-dir', default='.', help='where to write the result files')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--pattern', default='*.txt', help='input file pattern inside directories')
+    parser.add_argument('--cache', nargs='?', const=default_cache_dir(), default=None, metavar='DIR',
+                        help='reuse compiled networks of unchanged inputs (default DIR: %(const)s)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='table', help='result file format')
+    parser.add_argument('--stats', action='store_true', help='write stage times and solver counts to <name>_stats.json')
+    parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                        help='fail an input whose sizing takes longer than this')
+    args = parser.parse_args(argv)
+
+    filenames = find_inputs(args.inputs, args.pattern)
+    if not filenames:
+        parser.error('no input files found')
+    jobs = run_batch(filenames, args.output_dir, args.workers, args.cache, args.format, args.stats, args.timeout)
+    failed = 0
+    for job in jobs:
+        status = 'ok' if job['ok'] else 'FAILED'
+        print('%-6s %8.2fs  %s -> %s' % (status, job['seconds'], job['input'], job['output']))
+        failed += not job['ok']
+    print('%d of %d inputs sized' % (len(jobs) - failed, len(jobs)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
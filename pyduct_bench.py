@@ -0,0 +1,136 @@
+# Stage by stage timing of calculate() on synthetic networks.
+#
+#   python pyduct_bench.py --topology balanced chain --sizes 100 1000 10000 100000 --json bench.json
+#   python pyduct_bench.py --startup-only
+#
+# Each size and topology gets a generated input file, which then runs through the
+# same stages as calculate(): parse, connect, flows, fan distances, sizing and
+# output. The best of --repeat runs of every stage is reported, in seconds and in
+# microseconds per fitting, so scaling curves and regressions show up directly.
+# The startup time of a headless run (interpreter plus `import pyduct`) is
+# measured too and checked against STARTUP_BUDGET.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyduct import (make_network, parse_keywords, print_results, setup_fan_distances, setup_flowrates,
+                    sizing_iterate_nick)
+from pyduct_friction import duct_size_cache, friction_cache
+from pyduct_generate import TOPOLOGIES, write_input
+
+STAGES = ('parse', 'connect', 'flows', 'fan_distances', 'sizing', 'output')
+STARTUP_BUDGET = 0.5  # [s] for a fresh interpreter to import pyduct, numpy included
+
+
+def startup_time(repeat=5):
+    # best wall time of a fresh interpreter importing pyduct, from this directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'import pyduct'], cwd=here)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_stages(filename, result_file):
+    # one pass through the calculate() stages, returns stage -> seconds and the ducts
+    times = {}
+    friction_cache.clear()  # every run solves from scratch
+    duct_size_cache.clear()
+
+    start = time.perf_counter()
+    with open(filename) as file:
+        ducts, columns = parse_keywords(file)
+    times['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    network = ducts['network'] = make_network(columns)
+    ducts['fittings'] = network.fittings
+    times['connect'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    setup_flowrates(network)
+    times['flows'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    setup_fan_distances(network)
+    times['fan_distances'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    convergence = sizing_iterate_nick(ducts)
+    times['sizing'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    print_results(ducts['fittings'], result_file, echo=False)
+    times['output'] = time.perf_counter() - start
+    return times, ducts, convergence
+
+
+def benchmark(topologies=TOPOLOGIES, sizes=(100, 1000, 10000), repeat=3, seed=0, workdir=None):
+    """Times every stage for each topology and network size.
+
+    :return: list of dicts, one per (topology, size): fittings, iterations and the best
+             time of each stage plus the total [s]
+    """
+    records = []
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        for topology in topologies:
+            for size in sizes:
+                filename = os.path.join(directory, '%s_%d.txt' % (topology, size))
+                write_input(filename, topology, size, seed=seed)
+                best = None
+                for i in range(repeat):
+                    times, ducts, convergence = time_stages(filename, os.path.join(directory, 'result.txt'))
+                    best = times if best is None else dict((stage, min(best[stage], times[stage])) for stage in STAGES)
+                record = dict(topology=topology, size=size, fittings=len(ducts['fittings']),
+                              iterations=convergence['iterations'], total=sum(best.values()))
+                record.update(best)
+                records.append(record)
+    return records
+
+
+def format_records(records):
+    header = '%-9s %8s %5s' % ('topology', 'fittings', 'iter') + ''.join(' %13s' % stage for stage in STAGES) + \
+             ' %10s %10s' % ('total [s]', 'us/fitting')
+    lines = [header, '-' * len(header)]
+    for record in records:
+        lines.append('%-9s %8d %5d' % (record['topology'], record['fittings'], record['iterations']) +
+                     ''.join(' %13.4f' % record[stage] for stage in STAGES) +
+                     ' %10.3f %10.2f' % (record['total'], 1e6 * record['total'] / record['fittings']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each stage of calculate() on synthetic networks.')
+    parser.add_argument('--topology', nargs='+', choices=TOPOLOGIES, default=list(TOPOLOGIES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000], help='fittings per network')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per network, the best is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the records to this file')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET, metavar='SECONDS',
+                        help='fail when starting up takes longer (default: %(default)s)')
+    parser.add_argument('--startup-only', action='store_true', help='only measure the startup time')
+    args = parser.parse_args(argv)
+
+    startup = startup_time()
+    over = startup > args.startup_budget
+    print('startup %.3f s, budget %.3f s%s' % (startup, args.startup_budget, ' EXCEEDED' if over else ''))
+    records = []
+    if not args.startup_only:
+        records = benchmark(args.topology, args.sizes, args.repeat, args.seed)
+        print(format_records(records))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(python=sys.version.split()[0], startup=startup, records=records), file, indent=1)
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
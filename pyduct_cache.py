@@ -0,0 +1,126 @@
+# On-disk cache of connected, flow-annotated networks.
+#
+# Parsing, connecting and setting up flows and fan distances always gives the same
+# network for the same input file, so the result is saved as an .npz of the network
+# columns, named after a hash of the input contents, the pyduct version and the source
+# of the modules that compile it. A changed input, or a change to how inputs are
+# parsed, connected or validated, simply misses and compiles again.
+
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from pyduct import __version__, read_ducts, setup_fan_distances, setup_flowrates
+from pyduct_network import DuctNetwork
+
+CACHE_FORMAT = 2  # bump when the saved columns change
+SETTING_KEYS = ('title', 'fan_pressure', 'air_density', 'roughness', 'rounding', 'fan_pressures')
+COMPILER_MODULES = ('pyduct', 'pyduct_network', 'pyduct_cache')  # their code decides what a compiled network holds
+
+_compiler_digest = None
+
+
+def default_cache_dir():
+    return os.environ.get('PYDUCT_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'pyduct')
+
+
+def compiler_digest():
+    # hash of the source of COMPILER_MODULES, so entries compiled by other code are never used
+    global _compiler_digest
+    if _compiler_digest is None:
+        digest = hashlib.sha256()
+        for name in COMPILER_MODULES:
+            with open(importlib.import_module(name).__file__, 'rb') as file:
+                digest.update(file.read())
+        _compiler_digest = digest.hexdigest()
+    return _compiler_digest
+
+
+def input_key(filename):
+    # content hash of the input, salted with the pyduct version, cache format and compiler digest
+    digest = hashlib.sha256(('pyduct %s cache %d compiler %s\n'
+                             % (__version__, CACHE_FORMAT, compiler_digest())).encode())
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compile_ducts(filename):
+    # the front end: parse, connect, flows and fan distances
+    ducts = read_ducts(filename)
+    setup_flowrates(ducts['network'])
+    setup_fan_distances(ducts['network'])
+    return ducts
+
+
+def save_ducts(ducts, path):
+    # written to a temporary file first so readers never see half a cache entry
+    settings = dict((key, ducts[key]) for key in SETTING_KEYS)
+    settings.update(version=__version__, format=CACHE_FORMAT, compiler=compiler_digest())
+    directory = os.path.dirname(path) or '.'
+    handle, temporary = tempfile.mkstemp(suffix='.npz', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, settings=np.array(json.dumps(settings)), **ducts['network'].arrays())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load_cached(path):
+    # the ducts saved at path, None when missing, unreadable or compiled by another version
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            settings = json.loads(str(data['settings']))
+            if (settings.get('version') != __version__ or settings.get('format') != CACHE_FORMAT or
+                    settings.get('compiler') != compiler_digest()):
+                return None
+            network = DuctNetwork.from_arrays(data)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    ducts = dict((key, settings[key]) for key in SETTING_KEYS)
+    ducts['fan_pressures'] = dict((int(ID), value) for ID, value in ducts['fan_pressures'].items())  # JSON keys are text
+    ducts.update(network=network, fittings=network.fittings)
+    return ducts
+
+
+def load_ducts(filename, cache_dir=None):
+    """The connected network of filename with its flows and fan distances set up.
+
+    With a cache_dir the compiled network is looked up there by the hash of the
+    input and saved there after compiling it on a miss. Inputs with errors are
+    never cached, they raise as usual.
+
+    :param cache_dir: cache directory, created if needed; None compiles without caching
+    :return: ducts dict as from read_ducts
+    """
+    if cache_dir is None:
+        return compile_ducts(filename)
+    path = os.path.join(cache_dir, input_key(filename) + '.npz')
+    ducts = load_cached(path)
+    if ducts is None:
+        ducts = compile_ducts(filename)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        save_ducts(ducts, path)
+    return ducts
+
+
+def clear_cache(cache_dir=None):
+    # removes every cache entry, returns how many there were
+    cache_dir = cache_dir or default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class Table1D(object):
+    """Loss coefficient tabulated against one variable.
+
+    Inputs outside the table are clamped to its end values, so the table is
+    never extrapolated. Accepts scalars or arrays.
+    """
+
+    def __init__(self, x, c):
+        self.x = np.asarray(x, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+
+    def __call__(self, x):
+        c = np.interp(x, self.x, self.c)
+        if np.ndim(c) == 0:
+            return float(c)
+        return c
+
+    def slope(self, x):
+        # dc/dx of the interpolation, from the right at the table points and zero where clamped
+        x = np.asarray(x, dtype=float)
+        i = np.clip(np.searchsorted(self.x, x, side='right') - 1, 0, len(self.x) - 2)
+        slope = (self.c[i + 1] - self.c[i]) / (self.x[i + 1] - self.x[i])
+        return np.where((x < self.x[0]) | (x >= self.x[-1]), 0.0, slope)
+
+
+class Table2D(object):
+    """Loss coefficient tabulated against two variables, c[i, j] at (x[i], y[j]).
+
+    Bilinear interpolation with both inputs clamped to the table edges.
+    Accepts scalars or arrays, which are broadcast against each other.
+    """
+
+    def __init__(self, x, y, c):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+
+    @staticmethod
+    def _cell(v, grid):
+        v = np.clip(v, grid[0], grid[-1])
+        i = np.clip(np.searchsorted(grid, v, side='right') - 1, 0, len(grid) - 2)
+        t = (v - grid[i]) / (grid[i + 1] - grid[i])
+        return i, t
+
+    def __call__(self, x, y):
+        i, tx = self._cell(np.asarray(x, dtype=float), self.x)
+        j, ty = self._cell(np.asarray(y, dtype=float), self.y)
+        c = self.c
+        c = ((1 - tx) * (1 - ty) * c[i, j] + tx * (1 - ty) * c[i + 1, j] +
+             (1 - tx) * ty * c[i, j + 1] + tx * ty * c[i + 1, j + 1])
+        if np.ndim(c) == 0:
+            return float(c)
+        return c
+
+    def gradient(self, x, y):
+        # (dc/dx, dc/dy) of the interpolation, from the right at the table points and zero where clamped
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        i, tx = self._cell(x, self.x)
+        j, ty = self._cell(y, self.y)
+        c = self.c
+        dx = ((1 - ty) * (c[i + 1, j] - c[i, j]) + ty * (c[i + 1, j + 1] - c[i, j + 1])) / (self.x[i + 1] - self.x[i])
+        dy = ((1 - tx) * (c[i, j + 1] - c[i, j]) + tx * (c[i + 1, j + 1] - c[i + 1, j])) / (self.y[j + 1] - self.y[j])
+        dx = np.where((x < self.x[0]) | (x >= self.x[-1]), 0.0, dx)
+        dy = np.where((y < self.y[0]) | (y >= self.y[-1]), 0.0, dy)
+        return dx, dy
+
+
+TABLES = {}
+
+
+def register_table(name, table):
+    # tables are looked up by name only when registering or through loss_coefficient,
+    # the pressure drop functions hold direct references
+    TABLES[name] = table
+    return table
+
+
+def loss_coefficient(name, *args):
+    return TABLES[name](*args)
+
+
+# Table from 2009 ASHRAE Handbook 21.50 for SD5-10 Tee, Concial Branch Tapered into Body, Diverging
+# rows are A_(branch/main)/A_common, columns are Q_(branch/main)/Q_common
+_SD5_10_RATIOS = [.1, .2, .3, .4, .5, .6, .7, .8, .9]
+# c_branch values
+SD5_10_BRANCH = register_table('sd5_10_branch', Table2D(_SD5_10_RATIOS, _SD5_10_RATIOS, [
+    [0.65, 0.24, 0.15, 0.11, 0.09, 0.07, 0.06, 0.05, 0.05],
+    [2.98, 0.65, 0.33, 0.24, 0.18, 0.15, 0.13, 0.11, 0.10],
+    [7.36, 1.56, 0.65, 0.39, 0.29, 0.24, 0.20, 0.17, 0.15],
+    [13.78, 2.98, 1.20, 0.65, 0.43, 0.33, 0.27, 0.24, 0.21],
+    [22.24, 4.92, 1.98, 1.04, 0.65, 0.47, 0.36, 0.30, 0.26],
+    [32.73, 7.36, 2.98, 1.56, 0.96, 0.65, 0.49, 0.39, 0.33],
+    [45.26, 10.32, 4.21, 2.21, 1.34, 0.90, 0.65, 0.51, 0.42],
+    [59.82, 13.78, 5.67, 2.98, 1.80, 1.20, 0.86, 0.65, 0.52],
+    [76.41, 17.75, 7.36, 3.88, 2.35, 1.56, 1.11, 0.83, 0.65]]))
+# c_main values
+SD5_10_MAIN = register_table('sd5_10_main', Table2D(_SD5_10_RATIOS, _SD5_10_RATIOS, [
+    [0.13, 0.16, 0.57, 0.74, 0.74, 0.70, 0.65, 0.60, 0.56],
+    [0.20, 0.13, 0.15, 0.16, 0.28, 0.57, 0.69, 0.74, 0.75],
+    [0.90, 0.13, 0.13, 0.14, 0.15, 0.16, 0.20, 0.42, 0.57],
+    [2.88, 0.20, 0.14, 0.13, 0.14, 0.15, 0.15, 0.16, 0.34],
+    [6.25, 0.37, 0.17, 0.14, 0.13, 0.14, 0.14, 0.15, 0.15],
+    [11.88, 0.90, 0.20, 0.13, 0.14, 0.13, 0.14, 0.14, 0.15],
+    [18.62, 1.71, 0.33, 0.18, 0.16, 0.14, 0.13, 0.15, 0.14],
+    [26.88, 2.88, 0.50, 0.20, 0.15, 0.14, 0.13, 0.13, 0.14],
+    [36.45, 4.46, 0.90, 0.30, 0.19, 0.16, 0.15, 0.14, 0.13]]))
+
+# Table from ASHRAE 2009 chapter 21 for pleated 90 degree elbow, c_o against diameter [inches]
+PLEATED_ELBOW_90 = register_table('pleated_elbow_90', Table1D([4, 6, 8, 10, 12, 14, 16],
+                                                              [0.57, 0.43, 0.34, 0.28, 0.26, 0.25, 0.25]))
@@ -0,0 +1,224 @@
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import pyduct_instrument
+
+TIME_BUDGET = 300.0  # [s] default for one solve, a solve still running after it gives up
+
+
+class SolverError(RuntimeError):
+    """Raised when a solver does not converge, meets bad input or runs out of time.
+
+    solver is the function that gave up, iterations and elapsed [s] what it spent
+    and residual its last residual (NaN if it never got one); the message leaves
+    them out when the solver gave up before iterating. Pickles back whole from a
+    worker process.
+    """
+
+    def __init__(self, solver, detail, iterations=0, residual=float('nan'), elapsed=0.0):
+        self.solver = solver
+        self.detail = detail
+        self.iterations = iterations
+        self.residual = residual
+        self.elapsed = elapsed
+        message = '%s %s' % (solver, detail)
+        if iterations:
+            message += ' (%d iterations, %.3g s, residual %g)' % (iterations, elapsed, residual)
+        super(SolverError, self).__init__(message)
+
+    def __reduce__(self):
+        # args holds the formatted message only, which the default pickling would pass back as solver
+        return SolverError, (self.solver, self.detail, self.iterations, self.residual, self.elapsed)
+
+    def info(self):
+        return dict(solver=self.solver, detail=self.detail, iterations=self.iterations, residual=self.residual,
+                    elapsed=self.elapsed)
+
+
+def reynolds(dia, velocity):  # dia [inches], velocity [fpm]
+    return 8.5 * (dia / 12) * velocity  # eqn (21)
+
+
+def swamee_jain(dia, velocity, roughness):
+    # explicit approximation of the Colebrook equation, within about 1% of it
+    Re = reynolds(dia, velocity)
+    return 0.25 / np.log10(roughness / (3.7 * (dia / 12)) + 5.74 / Re ** 0.9) ** 2
+
+
+def colebrook_f(dia, velocity, roughness, tol=1e-12, maxiter=8, budget=None):
+    """Darcy friction factor from the Colebrook equation, eqn (19), for arrays of ducts.
+
+    Starts from the Swamee-Jain approximation and refines every duct together
+    with Newton steps on x = 1/sqrt(f), where the equation reads
+    x + 2 log10(a + b x) = 0. That function is increasing and concave, so after
+    the first step the iterates climb monotonically onto the root. Iteration stops
+    once the largest relative step is below tol (tol=None always takes maxiter
+    steps). Three steps already reach machine precision for turbulent flow, so the
+    result agrees with the old fsolve solution to within fsolve's own xtol
+    (1.5e-8 relative). Raises SolverError if some duct is not converged after
+    maxiter steps or budget seconds (default TIME_BUDGET), which only happens for
+    bad input: non-finite or zero diameters and velocities, or laminar flow.
+
+    :param dia: diameter [inches]
+    :param velocity: velocity [fpm]
+    :param roughness: absolute roughness [ft]
+    :return: friction factor, a float for scalar input or an array
+    """
+    dia, velocity, roughness = np.broadcast_arrays(np.asarray(dia, dtype=float), np.asarray(velocity, dtype=float),
+                                                   np.asarray(roughness, dtype=float))
+    start = time.perf_counter()
+    deadline = start + (TIME_BUDGET if budget is None else budget)
+    steps = 0
+    converged = tol is None
+    with np.errstate(all='ignore'):  # bad ducts are reported below
+        a = roughness / (3.7 * (dia / 12))
+        b = 2.51 / reynolds(dia, velocity)
+        x = 1 / np.sqrt(swamee_jain(dia, velocity, roughness))
+        for i in range(maxiter):
+            inner = a + b * x
+            step = (x + 2 * np.log10(inner)) / (1 + 2 * b / (inner * np.log(10)))
+            # a step from the right of the root may overshoot below zero
+            x = np.maximum(x - step, 1e-3)
+            steps += 1
+            if tol is not None and np.all(np.abs(step) <= tol * x):
+                converged = True
+                break
+            if time.perf_counter() > deadline:
+                break
+        f = 1 / x ** 2
+    stats = pyduct_instrument.current
+    if stats is not None:
+        stats.count('colebrook_f.calls')
+        stats.count('colebrook_f.ducts', f.size)
+        stats.count('colebrook_f.iterations', steps)
+    if not converged or not np.all(np.isfinite(x)):
+        bad = ~np.isfinite(x) if converged else ~(np.abs(step) <= tol * x)
+        first = np.argmax(bad.ravel())
+        raise SolverError('colebrook_f', 'did not converge for %d of %d ducts, the first %g in. at %g fpm'
+                          % (np.count_nonzero(bad), bad.size, dia.flat[first], velocity.flat[first]), steps,
+                          float(np.max(np.abs(step / x)[bad])) if steps and not converged else float('nan'),
+                          time.perf_counter() - start)
+    if f.ndim == 0:
+        return float(f)
+    return f
+
+
+def size_ducts(flow, dpdl, density, roughness, tol=1e-12, maxiter=50, budget=None):
+    """Round duct diameters that give a pressure drop per foot with Darcy-Weisbach and Colebrook.
+
+    Solves every duct together. For a friction factor f the Darcy-Weisbach
+    equation inverts directly to D^5 = 12 f density (4 Q / (1097 pi))^2 / dpdl, so
+    the diameter is found by fixed point iteration on f. f depends only weakly
+    on D, so each pass cuts the error by roughly a factor of 20. Raises SolverError
+    for flows or pressure drops that are not positive, or when some duct is not
+    converged after maxiter passes or budget seconds (default TIME_BUDGET).
+
+    :param flow: flow rate [cfm]
+    :param dpdl: pressure drop per length [in. wg/ft]
+    :param density: air density [lbm/ft^3]
+    :param roughness: absolute roughness [ft]
+    :return: diameter [inches], a float for scalar input or an array
+    """
+    flow, dpdl = np.broadcast_arrays(np.asarray(flow, dtype=float), np.asarray(dpdl, dtype=float))
+    bad = ~((flow > 0) & (dpdl > 0) & np.isfinite(flow) & np.isfinite(dpdl))
+    if bad.any():
+        first = np.argmax(bad.ravel())
+        raise SolverError('size_ducts', 'needs positive flows and pressure drops, got %g cfm at %g in. wg/ft'
+                          % (flow.flat[first], dpdl.flat[first]))
+    C = 12 * density * (4 * flow / (1097 * np.pi)) ** 2 / dpdl
+    f = np.full(flow.shape, 0.02)
+    start = time.perf_counter()
+    deadline = start + (TIME_BUDGET if budget is None else budget)
+    passes = 0
+    converged = False
+    for i in range(maxiter):
+        dia = 12 * (C * f) ** 0.2
+        velocity = flow / ((np.pi * (dia / 12) ** 2) / 4)
+        f_new = colebrook_f(dia, velocity, roughness, budget=deadline - time.perf_counter())
+        change = np.abs(f_new - f)
+        converged = np.all(change <= tol * f_new)
+        f = f_new
+        passes += 1
+        if converged or time.perf_counter() > deadline:
+            break
+    dia = 12 * (C * f) ** 0.2
+    stats = pyduct_instrument.current
+    if stats is not None:
+        stats.count('size_ducts.calls')
+        stats.count('size_ducts.ducts', dia.size)
+        stats.count('size_ducts.iterations', passes)
+    if not converged:
+        raise SolverError('size_ducts', 'did not converge for %d of %d ducts'
+                          % (np.count_nonzero(change > tol * f), np.size(f)), passes, float(np.max(change / f)),
+                          time.perf_counter() - start)
+    if dia.ndim == 0:
+        return float(dia)
+    return dia
+
+
+class SolveCache(object):
+    """Least recently used store of solver results keyed on quantized inputs.
+
+    Inputs are bucketed on a log scale with a relative width of rtol, so solves
+    whose inputs agree to within about rtol share one entry. rtol=0 keys on the
+    exact values. At most maxsize entries are kept; maxsize=0 disables caching.
+    """
+
+    def __init__(self, maxsize=4096, rtol=1e-9):
+        self.maxsize = maxsize
+        self.rtol = rtol
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def key(self, *values):
+        if not self.rtol:
+            return values
+        step = math.log1p(self.rtol)
+        key = []
+        for v in values:
+            v = float(v)
+            if v == 0:
+                key.append(0)
+            else:  # the bucket and the sign apart, folding the sign into the bucket maps 1/v onto -v
+                key.append((round(math.log(abs(v)) / step), v > 0))
+        return tuple(key)
+
+    def get(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize, rtol=self.rtol)
+
+
+# shared by get_little_f and get_duct_size, the scalar entry points for callers sizing one
+# duct at a time; calculate never uses them, the batched sizing in size_network gets a new
+# dpdl every pass and calls size_ducts and colebrook_f directly
+friction_cache = SolveCache()
+duct_size_cache = SolveCache()
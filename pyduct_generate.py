@@ -0,0 +1,115 @@
+# Synthetic pyduct input files for testing and benchmarking.
+#
+#   python pyduct_generate.py balanced 10000 -o balanced_10k.txt
+#
+# Networks grow from one air handler and supply duct by repeatedly splitting an
+# open duct end with a tee (sometimes behind an elbow), until there are about the
+# asked number of fittings; every end left open gets a diffuser. The topology
+# decides which end is split next:
+#
+#   balanced  oldest end first, a breadth first tee tree of even depth
+#   chain     always the main outlet of the newest tee, one long trunk
+#   skewed    mostly the newest end, deep lopsided subtrees
+#   random    any open end
+
+import argparse
+import random
+import sys
+
+TOPOLOGIES = ('balanced', 'chain', 'skewed', 'random')
+DIFFUSER_FLOWS = list(range(50, 425, 25))  # [cfm]
+
+
+def _pick(topology, ends, rnd):
+    # index of the open end to split next
+    if topology == 'balanced':
+        return 0
+    if topology == 'chain':
+        return len(ends) - 2 if len(ends) > 1 else 0  # the main outlet, the branch is appended last
+    if topology == 'skewed':
+        return len(ends) - 1 if rnd.random() < 0.8 else rnd.randrange(len(ends))
+    return rnd.randrange(len(ends))
+
+
+def generate(topology, fittings, seed=0, elbows=0.15, rounding='nearest', fan_pressure=None):
+    """Input lines for a synthetic network.
+
+    :param topology: one of TOPOLOGIES
+    :param fittings: about how many fittings to generate, at least 3
+    :param elbows: chance of an elbow and extra duct before each tee
+    :param fan_pressure: [in. wg], default enough for about 0.1 in. wg per 100 ft on the longest
+           run plus 0.05 per elbow on it
+    :return: list of lines
+    """
+    if topology not in TOPOLOGIES:
+        raise ValueError('unknown topology %r, expected one of %s' % (topology, ', '.join(TOPOLOGIES)))
+    rnd = random.Random(seed)
+    body = ['fitting, 1, Air_Handling_Unit']
+    # open ends as (duct ID, fan distance at its far end [ft], elbows up to it)
+    length = rnd.randint(20, 60)
+    body.append('fitting, 2, Duct, 1, %d' % length)
+    ends = [(2, length, 0)]
+    count = 2
+    nextID = 3
+    deepest = (0, 0)
+    while count + len(ends) + 4 <= fittings:
+        duct, fandist, elbow_count = ends.pop(_pick(topology, ends, rnd))
+        up = str(duct)
+        if rnd.random() < elbows:
+            length = rnd.randint(5, 30)
+            body.append('fitting, %d, Elbow, %s' % (nextID, up))
+            body.append('fitting, %d, Duct, %d, %d' % (nextID + 1, nextID, length))
+            up = str(nextID + 1)
+            fandist += length
+            elbow_count += 1
+            nextID += 2
+            count += 2
+        tee = nextID
+        body.append('fitting, %d, Tee, %s' % (tee, up))
+        for port in ('main', 'branch'):
+            length = rnd.randint(5, 40)
+            body.append('fitting, %d, Duct, %d-%s, %d' % (nextID + 1, tee, port, length))
+            ends.append((nextID + 1, fandist + length, elbow_count))
+            nextID += 1
+        nextID += 1
+        count += 3
+    for duct, fandist, elbow_count in ends:
+        body.append('fitting, %d, Diffuser, %d, %d' % (nextID, duct, rnd.choice(DIFFUSER_FLOWS)))
+        deepest = max(deepest, (fandist, elbow_count))
+        nextID += 1
+
+    if fan_pressure is None:
+        fan_pressure = 0.1 + 0.001 * deepest[0] + 0.05 * deepest[1]
+    header = ["title, 'Synthetic %s network, %d fittings, seed %d'" % (topology, len(body), seed),
+              'fan_pressure, %.3f' % fan_pressure,
+              'air_density, 0.075',
+              'roughness, 0.0003',
+              'rounding, %s' % rounding]
+    return [line + '\n' for line in header + body]
+
+
+def write_input(filename, topology, fittings, **options):
+    with open(filename, 'w') as file:
+        file.writelines(generate(topology, fittings, **options))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic pyduct input file.')
+    parser.add_argument('topology', choices=TOPOLOGIES)
+    parser.add_argument('fittings', type=int, help='about how many fittings')
+    parser.add_argument('-o', '--output', help='input file to write (default: standard output)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--elbows', type=float, default=0.15, help='chance of an elbow before each tee')
+    parser.add_argument('--rounding', default='nearest', choices=('none', 'nearest', 'up', 'down', 'optimal'))
+    args = parser.parse_args(argv)
+    lines = generate(args.topology, args.fittings, args.seed, args.elbows, args.rounding)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.writelines(lines)
+    else:
+        sys.stdout.writelines(lines)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# Opt-in instrumentation of a calculation: stage wall times and solver counters.
+#
+# Nothing is recorded unless an Instrumentation is active. Until then the solvers
+# only find the module level `current` to be None, so the disabled cost is one
+# attribute lookup per solver call.
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+current = None  # the active Instrumentation, if any
+
+
+class Instrumentation(object):
+    """Wall time per pipeline stage, solver call and iteration counts, and the dpdl convergence.
+
+    Counters are named '<function>.<what>', e.g. colebrook_f.calls, colebrook_f.ducts
+    and colebrook_f.iterations. convergence holds the dpdl passes, final dpdl,
+    residual and converged flag of the sizing; with several air handlers those of
+    the first, the most passes, the largest residual and whether all converged,
+    and each air handler's own with its ID in 'air_handlers'. Counters include
+    those of trees sized in worker processes.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()  # stage -> seconds, summed over repeats
+        self.counts = {}
+        self.convergence = {}
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def as_dict(self):
+        return dict(stages=dict(self.stages), total=sum(self.stages.values()),
+                    counts=dict(sorted(self.counts.items())), convergence=dict(self.convergence))
+
+    def to_json(self, destination=None):
+        # the JSON text, also written to destination (a file name or stream) if given
+        import json  # only needed on export, kept off the import path
+        text = json.dumps(self.as_dict(), indent=1)
+        if isinstance(destination, str):
+            with open(destination, 'w') as file:
+                file.write(text)
+        elif destination is not None:
+            destination.write(text)
+        return text
+
+    def __repr__(self):
+        return 'Instrumentation(%r)' % self.as_dict()
+
+
+@contextmanager
+def recording(instrumentation=None):
+    # makes instrumentation (a new one by default) current for the block
+    global current
+    previous = current
+    current = instrumentation if instrumentation is not None else Instrumentation()
+    try:
+        yield current
+    finally:
+        current = previous
+
+
+@contextmanager
+def stage(name):
+    # times the block as a stage of the current instrumentation, if there is one
+    if current is None:
+        yield None
+    else:
+        with current.stage(name) as instrumentation:
+            yield instrumentation
+
+
+def count(name, n=1):
+    if current is not None:
+        current.count(name, n)
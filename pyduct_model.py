@@ -0,0 +1,179 @@
+import numpy as np
+
+from pyduct import (apply_rounding, diffuser_pressures, largest_path, make_connections, setup_fan_distances,
+                    setup_flowrates, size_network)
+from pyduct_ahu import fan_pressures, size_air_handlers
+from pyduct_cache import load_ducts
+from pyduct_network import AHU, DIFFUSER, DUCT, FITTING_TYPES, TEE
+
+
+class DuctModel(object):
+    """A sized duct network that is re-solved incrementally after edits.
+
+    The model keeps the unrounded solution and the dpdl it converged to. Edits
+    update flows along the path to the fan, fan distances below an edited duct
+    and the farthest diffuser in place, and remember which fittings changed.
+    solve() then re-sizes only those fittings (and the elbows, tees and diffusers
+    that take their size from them) as long as dpdl does not move, and the whole
+    network once it does. results() gives the rounded fittings exactly as a full
+    calculate() of the edited input would.
+
+    Networks with several air handlers are re-sized in full, one tree per air
+    handler (see pyduct_ahu), on every solve after an edit.
+    """
+
+    def __init__(self, ducts):
+        network = ducts['network']
+        if network is None:
+            network = ducts['network'] = make_connections(ducts['fittings'])
+        setup_flowrates(network)
+        setup_fan_distances(network)
+        self.ducts = ducts
+        self.network = network
+        self.dpdl = None
+        self.changed = None  # IDs edited since the last solve, None for everything
+        self.convergence = None
+        self._solved_fan_pressure = None
+        self.solve()
+
+    @classmethod
+    def from_file(cls, filename, cache_dir=None):
+        return cls(load_ducts(filename, cache_dir))
+
+    def _mark(self, i):
+        if self.changed is not None:
+            self.changed.add(int(self.network.ID[i]))
+
+    def _row(self, ID, fitting_type, what, value=None):
+        network = self.network
+        i = network.position[ID]
+        if network.type[i] != fitting_type:
+            raise ValueError('%s %s: only %s can be set' % (FITTING_TYPES[network.type[i]], ID, what))
+        if value is not None and not 0 < value < np.inf:  # as DuctNetwork.validate checks them
+            raise ValueError('%s %s: %s must be positive, not %g' % (FITTING_TYPES[network.type[i]], ID, what, value))
+        return i
+
+    def set_flow(self, ID, cfm):
+        network = self.network
+        i = self._row(ID, DIFFUSER, 'diffuser flows', cfm)
+        network.flow[i] = cfm
+        self._mark(i)
+        # re-add the flows up to the fan the same way setup_flowrates does
+        for i in network.route_rows(i)[1:]:
+            main = network.main_child[i]
+            if network.type[i] == TEE:
+                branch = network.branch_child[i]
+                network.flowMain[i] = network.flow[main]
+                network.flowBranch[i] = network.flow[branch]
+                network.flow[i] = network.flow[main] + network.flow[branch]
+            else:
+                network.flow[i] = network.flow[main]
+            self._mark(i)
+
+    def set_length(self, ID, length):
+        network = self.network
+        i = self._row(ID, DUCT, 'duct lengths', length)
+        longer = length > network.length[i]
+        network.length[i] = length
+        self._mark(i)
+
+        # fan distances below the duct, same sums as setup_fan_distances
+        largest_path(network)
+        farthest = network.farthest
+        farthest_moved = False
+        for i in network.subtree_rows(i)[1:]:
+            up = network.parent[i]
+            if network.type[up] == DUCT:
+                network.fandist[i] = network.fandist[up] + network.length[up]
+            else:
+                network.fandist[i] = network.fandist[up]
+            if i == farthest:
+                farthest_moved = True
+            elif longer and network.type[i] == DIFFUSER and self._farther(i, farthest):
+                farthest = i
+        if farthest_moved and not longer:
+            network.farthest = None  # the farthest diffuser got closer, look again
+        else:
+            network.farthest = farthest
+
+    def _farther(self, i, other):
+        # largest_path keeps the first of equally far diffusers in input order
+        fandist = self.network.fandist
+        if fandist[i] != fandist[other]:
+            return fandist[i] > fandist[other]
+        if self.network.type[other] != DIFFUSER:
+            return False
+        return i < other
+
+    def set_fan_pressure(self, fan_pressure, ID=None):
+        # the default fan pressure, or that of air handler ID only
+        if ID is None:
+            self.ducts['fan_pressure'] = fan_pressure
+        else:
+            self._row(ID, AHU, 'air handler fan pressures')
+            self.ducts.setdefault('fan_pressures', {})[ID] = fan_pressure
+
+    def _size_dependents(self, IDs):
+        # the edited fittings plus the elbows, tees and diffusers that take their size from them
+        network = self.network
+        dependents = set()
+        stack = [network.position[ID] for ID in IDs]
+        while stack:
+            i = stack.pop()
+            if i in dependents:
+                continue
+            dependents.add(i)
+            for down in (network.main_child[i], network.branch_child[i]):
+                if down >= 0 and network.type[down] != DUCT:
+                    stack.append(int(down))
+        return dependents
+
+    def solve(self):
+        ducts = self.ducts
+        network = self.network
+        pressures = fan_pressures(ducts)
+        if self.changed is not None and not self.changed and pressures == self._solved_fan_pressure:
+            return self.convergence
+        if len(pressures) > 1:
+            convergence = size_air_handlers(ducts, workers=1, finish=False)
+            diffusers = network.type == DIFFUSER
+            network.size[diffusers] = network.size[network.parent[diffusers]]
+            self.changed = set()
+            self.convergence = convergence
+            self._solved_fan_pressure = pressures
+            return convergence
+        ducts = dict(ducts, fan_pressure=pressures[int(network.ID[network.roots[0]])])
+
+        changed = None
+        if self.changed is not None:
+            rows = sorted(self._size_dependents(self.changed))
+            changed = set(network.ID[rows].tolist())
+            losses = np.array([network.pdrop[rows], network.pdropMain[rows], network.pdropBranch[rows]])
+        convergence = size_network(ducts, dpdl=self.dpdl, changed=changed)
+
+        if changed is not None and convergence['iterations'] == 1:
+            # dpdl stayed put, so only the re-sized fittings and the diffusers below them changed
+            now = np.array([network.pdrop[rows], network.pdropMain[rows], network.pdropBranch[rows]])
+            moved = network.ID[rows][np.any((now != losses) & ~(np.isnan(now) & np.isnan(losses)), axis=0)]
+            diffuser_pressures(network, moved.tolist())
+            resized = np.array(rows, dtype=np.int64)
+        else:
+            diffuser_pressures(network)
+            resized = np.arange(len(network.ID))
+        diffusers = resized[network.type[resized] == DIFFUSER]
+        network.size[diffusers] = network.size[network.parent[diffusers]]
+
+        self.dpdl = convergence['dpdl']
+        self.changed = set()
+        self.convergence = convergence
+        self._solved_fan_pressure = pressures
+        return convergence
+
+    def results(self):
+        # a copy of the network with the rounding option applied, as calculate() reports it
+        network = self.network.copy()
+        ducts = self.ducts
+        apply_rounding(network, ducts['rounding'], ducts['air_density'], ducts['roughness'], fan_pressures(ducts))
+        diffusers = network.type == DIFFUSER
+        network.size[diffusers] = network.size[network.parent[diffusers]]
+        return network.fittings
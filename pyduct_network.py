@@ -0,0 +1,405 @@
+from collections.abc import Mapping, MutableMapping, Sequence
+
+import numpy as np
+
+# fitting types and tee ports are stored as small integer codes into these tuples
+FITTING_TYPES = ('air_handling_unit', 'duct', 'tee', 'elbow', 'diffuser')
+AHU, DUCT, TEE, ELBOW, DIFFUSER = range(len(FITTING_TYPES))
+PORTS = (None, 'main', 'branch')
+NO_PORT, MAIN, BRANCH = range(len(PORTS))
+
+# per fitting float columns, NaN where the old fitting dicts held None
+FLOAT_COLUMNS = ('length', 'flow', 'flowMain', 'flowBranch', 'size', 'sizeMain', 'sizeBranch',
+                 'pdrop', 'pdropMain', 'pdropBranch', 'fandist', 'diffuser_psum')
+# integer columns that fix the connected topology, enough to rebuild a network without reconnecting it
+TOPOLOGY_COLUMNS = ('ID', 'type', 'IDup', 'port', 'parent', 'main_child', 'branch_child', 'roots', 'order',
+                    'unreachable')
+# every key a fitting view answers to, in the order of the old new_fitting() dict
+FITTING_KEYS = ('ID', 'type', 'IDup', 'BranchUP', 'IDdownMain', 'IDdownBranch', 'flow', 'flowMain', 'flowBranch',
+                'size', 'sizeMain', 'sizeBranch', 'pdrop', 'pdropMain', 'pdropBranch', 'length', 'fandist',
+                'diffuser_psum')
+
+
+class NetworkError(ValueError):
+    """Raised when the fittings do not form a complete supply tree."""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super(NetworkError, self).__init__(self.problems)
+
+    def __str__(self):
+        return '; '.join(self.problems)
+
+
+class FittingView(MutableMapping):
+    """One row of a DuctNetwork, read and written like the old fitting dicts.
+
+    The float values (flow, size, pdrop, ...) can be set, the topology keys are
+    read only. Views are made on demand and two views of the same row compare equal.
+    """
+
+    __slots__ = ('network', 'i')
+
+    def __init__(self, network, i):
+        self.network = network
+        self.i = i
+
+    def __getitem__(self, key):
+        network = self.network
+        i = self.i
+        column = network.columns.get(key)
+        if column is not None:
+            value = column[i]
+            return None if value != value else float(value)
+        if key == 'ID':
+            return int(network.ID[i])
+        if key == 'type':
+            return FITTING_TYPES[network.type[i]]
+        if key == 'IDup':
+            return None if network.type[i] == AHU else int(network.IDup[i])
+        if key == 'BranchUP':
+            return PORTS[network.port[i]]
+        if key == 'IDdownMain' or key == 'IDdownBranch':
+            j = (network.main_child if key == 'IDdownMain' else network.branch_child)[i]
+            return None if j < 0 else int(network.ID[j])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.network.columns:
+            raise KeyError('%r is fixed by the network topology' % key)
+        self.network.columns[key][self.i] = np.nan if value is None else value
+
+    def __delitem__(self, key):
+        raise KeyError('fitting keys cannot be removed')
+
+    def __iter__(self):
+        return iter(FITTING_KEYS)
+
+    def __len__(self):
+        return len(FITTING_KEYS)
+
+    def __eq__(self, other):
+        if isinstance(other, FittingView):
+            return self.network is other.network and self.i == other.i
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self):
+        return hash((id(self.network), self.i))
+
+    def __repr__(self):
+        return 'FittingView(%r)' % dict(self)
+
+
+class FittingList(Sequence):
+    # the rows of a network as fitting views, in input order
+    def __init__(self, network):
+        self.network = network
+
+    def __len__(self):
+        return len(self.network.ID)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [FittingView(self.network, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return FittingView(self.network, i)
+
+    def __iter__(self):
+        network = self.network
+        for i in range(len(network.ID)):
+            yield FittingView(network, i)
+
+
+class _Lookup(Mapping):
+    # ID -> fitting view (or row) through one of the network's row columns
+    def __init__(self, network, target=None, rows=False):
+        self.network = network
+        self.target = target
+        self.rows = rows
+
+    def __getitem__(self, ID):
+        i = self.network.position_of(ID)
+        if i >= 0 and self.target is not None:
+            i = int(self.target[i])
+        if i < 0:
+            raise KeyError(ID)
+        return i if self.rows else FittingView(self.network, i)
+
+    def _keys(self):
+        if self.target is None:
+            return self.network.ID
+        return self.network.ID[self.target >= 0]
+
+    def __iter__(self):
+        return iter(self._keys().tolist())
+
+    def __len__(self):
+        return len(self._keys())
+
+
+class DuctNetwork(object):
+    """Duct network stored as a struct of NumPy arrays, one row per fitting in input order.
+
+    The topology columns are ID, type (codes into FITTING_TYPES), IDup and port
+    (codes into PORTS), resolved into parent, main_child and branch_child rows
+    (-1 for none). The float columns are attributes named after the old fitting
+    dict keys (flow, size, pdrop, ...), also found by name in columns, and are
+    NaN where unset. order lists the rows from the fan to the terminals, so every
+    fitting comes after its upstream fitting.
+
+    fittings gives dict-like views of the rows for code written against the old
+    fitting dicts, and index, up, down_main, down_branch and position look them
+    up by ID.
+    """
+
+    def __init__(self, ID, type, IDup, port, length=None, flow=None):
+        self.ID = np.asarray(ID, dtype=np.int64)
+        self.type = np.asarray(type, dtype=np.int8)
+        self.IDup = np.asarray(IDup, dtype=np.int64)
+        self.port = np.asarray(port, dtype=np.int8)
+        self.columns = {}
+        for key in FLOAT_COLUMNS:
+            self.columns[key] = np.full(len(self.ID), np.nan)
+        if length is not None:
+            self.columns['length'][:] = length
+        if flow is not None:
+            self.columns['flow'][:] = flow
+        self._bind_columns()
+
+        self._sorted = np.argsort(self.ID, kind='stable')
+        self._sorted_ID = self.ID[self._sorted]
+        self._connect()
+        self.farthest = None  # row of the diffuser farthest from the fan, kept by largest_path
+
+    @classmethod
+    def from_fittings(cls, fittings):
+        # builds the arrays from fitting dicts, e.g. a network put together by hand
+        network = cls([fitting['ID'] for fitting in fittings],
+                      [FITTING_TYPES.index(fitting['type']) for fitting in fittings],
+                      [-1 if fitting['IDup'] is None else fitting['IDup'] for fitting in fittings],
+                      [PORTS.index(fitting['BranchUP']) for fitting in fittings])
+        for key in FLOAT_COLUMNS:
+            network.columns[key][:] = [np.nan if fitting[key] is None else fitting[key] for fitting in fittings]
+        return network
+
+    def arrays(self):
+        # every column by name, e.g. to save the network with np.savez
+        arrays = dict((key, getattr(self, key)) for key in TOPOLOGY_COLUMNS)
+        arrays.update(self.columns)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # the network saved by arrays(), without connecting it again
+        network = object.__new__(cls)
+        for key in TOPOLOGY_COLUMNS:
+            setattr(network, key, np.asarray(arrays[key]))
+        network.columns = dict((key, np.array(arrays[key], dtype=float)) for key in FLOAT_COLUMNS)
+        network._bind_columns()
+        network._bind_lookups()
+        network._sorted = np.argsort(network.ID, kind='stable')
+        network._sorted_ID = network.ID[network._sorted]
+        network.farthest = None
+        return network
+
+    def _bind_columns(self):
+        for key in FLOAT_COLUMNS:
+            setattr(self, key, self.columns[key])
+        self.fittings = FittingList(self)
+        self.index = _Lookup(self)
+        self.position = _Lookup(self, rows=True)  # ID -> row, the position in the input file
+
+    def _bind_lookups(self):
+        self.up = _Lookup(self, self.parent)
+        self.down_main = _Lookup(self, self.main_child)
+        self.down_branch = _Lookup(self, self.branch_child)
+
+    def copy(self):
+        # shares the topology, with its own copies of the float columns
+        network = object.__new__(DuctNetwork)
+        network.__dict__.update(self.__dict__)
+        network.columns = dict((key, column.copy()) for key, column in self.columns.items())
+        network._bind_columns()
+        network._bind_lookups()
+        return network
+
+    def positions(self, IDs):
+        # rows of an array of IDs, -1 where there is no such fitting
+        IDs = np.asarray(IDs, dtype=np.int64)
+        if not len(self._sorted_ID):
+            return np.full(IDs.shape, -1, dtype=np.int64)
+        k = np.minimum(np.searchsorted(self._sorted_ID, IDs), len(self._sorted_ID) - 1)
+        return np.where(self._sorted_ID[k] == IDs, self._sorted[k], -1)
+
+    def position_of(self, ID):
+        k = int(np.searchsorted(self._sorted_ID, ID))
+        if k < len(self._sorted_ID) and self._sorted_ID[k] == ID:
+            return int(self._sorted[k])
+        return -1
+
+    def _connect(self):
+        n = len(self.ID)
+        self.parent = np.full(n, -1, dtype=np.int64)
+        has_up = self.type != AHU
+        self.parent[has_up] = self.positions(self.IDup[has_up])  # stays -1 when the upstream fitting is missing
+        self.main_child = np.full(n, -1, dtype=np.int64)
+        self.branch_child = np.full(n, -1, dtype=np.int64)
+        child = np.nonzero(self.parent >= 0)[0]
+        branch = self.port[child] == BRANCH
+        self.main_child[self.parent[child[~branch]]] = child[~branch]
+        self.branch_child[self.parent[child[branch]]] = child[branch]
+        self.roots = np.nonzero(self.type == AHU)[0]
+        self._bind_lookups()
+
+        # depth first from each air handler so every fitting comes after its upstream fitting
+        main_child = self.main_child.tolist()
+        branch_child = self.branch_child.tolist()
+        order = []
+        stack = self.roots[::-1].tolist()
+        while stack:
+            i = stack.pop()
+            order.append(i)
+            if branch_child[i] >= 0:
+                stack.append(branch_child[i])
+            if main_child[i] >= 0:
+                stack.append(main_child[i])
+        self.order = np.array(order, dtype=np.int64)
+        reached = np.zeros(n, dtype=bool)
+        reached[self.order] = True
+        self.unreachable = np.nonzero(~reached)[0]  # rows not connected to an air handler
+
+    def validate(self):
+        """Checks the whole network in one pass before anything is solved.
+
+        Collects every problem and raises them together as a NetworkError: duplicate
+        IDs, missing air handlers, fittings whose upstream fitting does not exist,
+        loops, fittings sharing an outlet, branches off fittings that are not tees,
+        tees with an open port, fittings that lead to no diffuser, and diffuser flows
+        or duct lengths that are missing or not positive.
+        """
+        problems = []
+        n = len(self.ID)
+        names = [FITTING_TYPES[t] for t in self.type.tolist()]
+        ID = self.ID.tolist()
+
+        repeated = np.nonzero(self._sorted_ID[1:] == self._sorted_ID[:-1])[0]
+        for value in np.unique(self._sorted_ID[repeated]).tolist():
+            problems.append('fitting ID %d is used %d times' % (value, np.count_nonzero(self.ID == value)))
+        if not len(self.roots):
+            problems.append('there is no air handling unit')
+
+        orphans = np.nonzero((self.type != AHU) & (self.parent < 0))[0]
+        for i in orphans.tolist():
+            if self.IDup[i] < 0:
+                problems.append('%s %d has no upstream fitting' % (names[i], ID[i]))
+            else:
+                problems.append('%s %d connects to fitting %d, which does not exist' % (names[i], ID[i], self.IDup[i]))
+
+        # each unreachable row walks up until it meets an orphan, a reached row, a walked row or itself
+        state = np.zeros(n, dtype=np.int64)  # 0 not seen, -1 settled, else the number of the walk
+        state[self.order] = -1
+        state[orphans] = -1
+        state = state.tolist()
+        parent = self.parent.tolist()
+        for walk, start in enumerate(self.unreachable.tolist(), 1):
+            i = start
+            while i >= 0 and state[i] == 0:
+                state[i] = walk
+                i = parent[i]
+            if i >= 0 and state[i] == walk:  # came back onto this walk
+                loop = [i]
+                while parent[loop[-1]] != i:
+                    loop.append(parent[loop[-1]])
+                problems.append('fittings %s form a loop' % ', '.join(str(ID[j]) for j in reversed(loop)))
+            i = start
+            while i >= 0 and state[i] == walk:
+                state[i] = -1
+                i = parent[i]
+
+        child = np.nonzero(self.parent >= 0)[0]
+        up = self.parent[child]
+        branch = self.port[child] == BRANCH
+        outlets = np.bincount(up * 2 + branch, minlength=2 * n).reshape(n, 2)
+        for i in np.nonzero(outlets.max(axis=1) > 1)[0].tolist():
+            for port in np.nonzero(outlets[i] > 1)[0].tolist():
+                problems.append('%s %d has %d fittings on its %s outlet'
+                                % (names[i], ID[i], outlets[i, port], PORTS[port + 1]))
+        for i in np.unique(up[branch & (self.type[up] != TEE)]).tolist():
+            problems.append('%s %d has a branch fitting but is not a tee' % (names[i], ID[i]))
+        for i in np.unique(up[self.type[up] == DIFFUSER]).tolist():
+            problems.append('diffuser %d has fittings downstream of it' % ID[i])
+
+        reached = np.zeros(n, dtype=bool)
+        reached[self.order] = True
+        for i in np.nonzero(~reached & (self.type == DIFFUSER))[0].tolist():
+            problems.append('diffuser %d is not connected to an air handling unit' % ID[i])
+        main = self.main_child >= 0
+        branch = self.branch_child >= 0
+        for i in np.nonzero(reached & (self.type != DIFFUSER) & ~main & ~branch)[0].tolist():
+            problems.append('%s %d does not lead to a diffuser' % (names[i], ID[i]))
+        for i in np.nonzero((self.type == TEE) & (main != branch))[0].tolist():
+            problems.append('tee %d has no fitting on its %s port' % (ID[i], 'branch' if main[i] else 'main'))
+
+        for kind, column, what, unit in ((DIFFUSER, self.flow, 'flow rate', 'cfm'),
+                                         (DUCT, self.length, 'length', 'ft')):
+            rows = np.nonzero(self.type == kind)[0]
+            bad = rows[~(column[rows] > 0) | np.isinf(column[rows])]
+            for i in bad.tolist():
+                if column[i] != column[i]:
+                    problems.append('%s %d has no %s' % (names[i], ID[i], what))
+                else:
+                    problems.append('%s %d has a %s of %g %s' % (names[i], ID[i], what, column[i], unit))
+        if problems:
+            raise NetworkError(problems)
+
+    def view(self, i):
+        return FittingView(self, int(i))
+
+    @property
+    def root(self):
+        return self.view(self.roots[0])
+
+    def get(self, ID):
+        return self.index[ID]
+
+    def select(self, rows):
+        # a network of just these rows (e.g. one air handler's tree), in their given order and connected on its own
+        rows = np.asarray(rows, dtype=np.int64)
+        network = DuctNetwork(self.ID[rows], self.type[rows], self.IDup[rows], self.port[rows])
+        for key in FLOAT_COLUMNS:
+            network.columns[key][:] = self.columns[key][rows]
+        return network
+
+    def subtree_rows(self, i):
+        # the row and every row downstream of it, upstream fittings first
+        rows = []
+        stack = [int(i)]
+        while stack:
+            i = stack.pop()
+            rows.append(i)
+            if len(rows) > len(self.ID):
+                raise NetworkError(['fitting %d is on a loop' % self.ID[rows[0]]])
+            if self.branch_child[i] >= 0:
+                stack.append(int(self.branch_child[i]))
+            if self.main_child[i] >= 0:
+                stack.append(int(self.main_child[i]))
+        return rows
+
+    def subtree(self, ID):
+        return [self.view(i) for i in self.subtree_rows(self.position[ID])]
+
+    def route_rows(self, i):
+        # rows from the fitting in question back to its air handler
+        route = [int(i)]
+        while self.parent[route[-1]] >= 0:
+            route.append(int(self.parent[route[-1]]))
+            if len(route) > len(self.ID):  # only a loop is longer than the network, see validate
+                raise NetworkError(['fitting %d is on a loop' % self.ID[route[0]]])
+        return route
+
+    def path_to_fan(self, ID):
+        # IDs from the fitting in question back to its air handler
+        return self.ID[self.route_rows(self.position[ID])].tolist()
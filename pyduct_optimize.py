@@ -0,0 +1,336 @@
+# Standard size selection: the cheapest catalog sizes that keep every diffuser within the fan pressure.
+#
+# Used by the 'optimal' rounding option in place of rounding every duct the same
+# way. Each duct gets a size from a catalog; elbows and tees take theirs from
+# their neighbours as in size_network, and the pressure at every diffuser is
+# the route total that diffuser_pressures reports.
+#
+# The search is a dynamic program over the AHU-rooted tree. The pressure left
+# for a subtree is split into `bins` steps, and for every fitting, candidate size
+# and pressure step the cheapest subtree below it is found from its children
+# (tees add the cheapest choice of each outlet, as both outlets see the same
+# pressure). That is O(fittings * sizes^2 * bins) rather than exponential. Only
+# the catalog sizes near each duct's equal friction size are tried. Losses are
+# rounded to whole steps without bias, which comes closest to the optimum but
+# may overshoot the fan pressure; the search is then repeated with the target
+# lowered by the overshoot. It also runs once with the losses rounded up, so the
+# sizes that fit in steps fit in pressure too. On routes of many fittings both
+# roundings add up and can leave nothing that fits, so the sizes of rounding
+# every duct up, which always fit, are the fallback. Each air handler gets the
+# cheapest sizes found that keep its diffusers within its fan pressure.
+
+import numpy as np
+
+from pyduct import (diffuser_pressures, duct_pressure_drop, elbow_pressure_drop, fitting_pressure_drops,
+                    tee_pressure_drop)
+from pyduct_friction import SolverError
+from pyduct_network import AHU, BRANCH, DIFFUSER, DUCT, ELBOW, FITTING_TYPES, TEE, NetworkError
+
+# round duct diameters [in]: every inch to 24, then every 2 inches
+STANDARD_SIZES = np.concatenate([np.arange(3.0, 25.0), np.arange(26.0, 62.0, 2.0)])
+
+
+def surface_area(size):  # duct sheet metal per foot of length [ft^2/ft]
+    return np.pi * size / 12
+
+
+def optimize_sizes(network, fan_pressure, density, roughness, catalog=None, cost=surface_area, bins=512,
+                   smaller=6, larger=1, maxiter=5):
+    """Picks every duct's size from catalog at the least total cost, keeping every
+    diffuser's pressure drop within fan_pressure.
+
+    fan_pressure is one value for every air handler, or a dict of air handler ID
+    to its fan pressure. The network must already be sized (size_network), the
+    catalog sizes tried for each duct are the `smaller` ones below and `larger`
+    ones above the smallest catalog size that is at least its continuous size.
+    Sizes, pressure drops and diffuser_psum are updated in place. Raises
+    SolverError when no catalog sizes fit within the fan pressure, and
+    NetworkError for a tee, or an elbow not followed by a duct, right below an
+    air handler, as it would have no size to take.
+
+    :param catalog: available diameters [in], default STANDARD_SIZES continued in 2 inch steps
+           as far as the largest duct needs
+    :param cost: cost per foot of duct for an array of diameters, default surface area
+    :param bins: pressure steps between zero and fan_pressure
+    :param maxiter: searches with the losses rounded without bias, each with a lower target
+    :return: dict with the total cost, the largest diffuser pressure drop, the searches run and
+             the IDs of the air handlers whose sizes are those of rounding up, as the searches
+             found none cheaper that fit
+    """
+    if catalog is None:
+        largest = np.nanmax(network.size[network.type == DUCT], initial=0.0)
+        catalog = np.concatenate([STANDARD_SIZES, np.arange(STANDARD_SIZES[-1] + 2, largest + 2 * larger + 2, 2.0)])
+    catalog = np.unique(np.asarray(catalog, dtype=float))
+    order = network.order.tolist()
+    candidates = _candidates(network, catalog, smaller, larger, order)
+    followers = [network.type[i] != AHU and _follows(network, i) for i in range(len(network.ID))]
+    losses = _losses(network, candidates, followers, density, roughness)
+    costs = [cost(candidates[i]) * network.length[i] if network.type[i] == DUCT else None
+             for i in range(len(network.ID))]
+    # every row's air handler, as an index into roots, and that air handler's fan pressure
+    roots = network.roots.tolist()
+    tree = np.zeros(len(network.ID), dtype=np.int64)
+    for k, root in enumerate(roots):
+        tree[network.subtree_rows(root)] = k
+    if isinstance(fan_pressure, dict):
+        limit = np.array([fan_pressure[int(network.ID[root])] for root in roots], dtype=float)
+    else:
+        limit = np.full(len(roots), fan_pressure, dtype=float)
+    if (limit <= 0).any():
+        raise SolverError('optimize_sizes', 'needs a positive fan pressure to choose sizes, got %g in. wg'
+                          % limit.min())
+    diffusers = np.nonzero(network.type == DIFFUSER)[0]
+    ducts = np.nonzero(network.type == DUCT)[0]
+
+    # every choice is tried on the whole network, each air handler keeps the cheapest that fits
+    choices, worst, total = [], [], []
+
+    def trial(chosen):
+        _apply_sizes(network, candidates, chosen, density, roughness, order)
+        totals = diffuser_pressures(network)[0]
+        choices.append(chosen)
+        worst.append(np.zeros(len(roots)))
+        np.fmax.at(worst[-1], tree[diffusers], totals[diffusers])
+        total.append(np.bincount(tree[ducts], cost(network.size[ducts]) * network.length[ducts], len(roots)))
+        return worst[-1] - limit
+
+    trial(_rounded_up(network, candidates, followers, order))  # from the equal friction sizes, so first
+    trial(_search(network, candidates, followers, losses, costs, limit[tree] / bins, bins, order))
+    offset = (network.ID * 0.6180339887498949) % 1  # evenly spread over [0, 1), the same in any split of the network
+    target = limit.copy()
+    for search in range(1, maxiter + 1):
+        over = trial(_search(network, candidates, followers, losses, costs, target[tree] / bins, bins, order, offset))
+        if (over <= 0).all():
+            break
+        target[over > 0] -= over[over > 0] + limit[over > 0] / bins
+        if (target <= 0).any():
+            break
+    worst, total = np.array(worst), np.array(total)
+    fits = worst <= limit * (1 + 1e-9)  # rounding up keeps the equal friction pressures, to within their tolerance
+    if not fits.any(axis=0).all():
+        k = int(np.argmin(fits.any(axis=0)))
+        raise SolverError('optimize_sizes', 'found no catalog sizes within fan pressure %g in. wg of air handler %d, '
+                          'the best reaches %g' % (limit[k], network.ID[roots[k]], worst[:, k].min()))
+    # the last choice of the least cost, so the searches win a tie with rounding up
+    best = len(choices) - 1 - np.argmin(np.where(fits, total, np.inf)[::-1], axis=0)
+    _apply_sizes(network, candidates, np.choose(best[tree], choices), density, roughness, order)
+    diffuser_pressures(network)
+    columns = np.arange(len(roots))
+    return dict(cost=float(total[best, columns].sum()), worst=float(worst[best, columns].max()), searches=search + 1,
+                rounded_up=network.ID[network.roots[best == 0]].tolist())
+
+
+def _rounded_up(network, candidates, followers, order):
+    # every fitting's choice when each duct is rounded up to the smallest candidate at least its equal friction size
+    chosen = [0] * len(network.ID)
+    for i in order:
+        if network.type[i] == AHU:
+            continue
+        if followers[i]:
+            parent = network.parent[i]
+            chosen[i] = chosen[parent] if network.type[parent] != AHU else 0
+        else:
+            chosen[i] = min(int(np.searchsorted(candidates[i], network.size[i])), len(candidates[i]) - 1)
+    return chosen
+
+
+def _candidates(network, catalog, smaller, larger, order):
+    # the candidate sizes of every fitting; followers share the list of the fitting they copy their size from
+    types = network.type
+    candidates = [None] * len(types)
+    ducts = np.nonzero(types == DUCT)[0]
+    if np.isnan(network.size[ducts]).any():
+        raise SolverError('optimize_sizes', 'needs the network sized before choosing standard sizes')
+    up = np.searchsorted(catalog, network.size[ducts])  # smallest catalog size at least as large
+    for i, j in zip(ducts.tolist(), up.tolist()):
+        j = min(j, len(catalog) - 1)
+        candidates[i] = catalog[max(0, j - smaller):j + larger + 1]
+    for i in order:
+        if types[i] == DUCT or types[i] == AHU:
+            continue
+        down = network.main_child[i]
+        if types[i] == ELBOW and down >= 0 and types[down] == DUCT:
+            candidates[i] = candidates[down]
+        else:
+            parent = network.parent[i]
+            if types[parent] != AHU:
+                candidates[i] = candidates[parent]
+            elif types[i] == DIFFUSER:
+                candidates[i] = np.array([np.nan])
+            else:
+                raise NetworkError(['%s %d takes its size from the air handler' % (FITTING_TYPES[types[i]],
+                                                                                     network.ID[i])])
+    return candidates
+
+
+def _follows(network, i):
+    # True when fitting i has the size of its upstream fitting rather than a choice of its own
+    types = network.type
+    if types[i] == DUCT:  # unless the elbow above copies the duct, then they are one choice
+        return types[network.parent[i]] == ELBOW
+    if types[i] == ELBOW:
+        down = network.main_child[i]
+        return not (down >= 0 and types[down] == DUCT)
+    return True
+
+
+def _steps(loss, step, bins, offset=None):
+    # losses as whole pressure steps: rounded up, so a route that fits in steps fits in pressure, or
+    # rounded at a fixed offset of each fitting so the rounding does not add up along long routes of
+    # small losses; unusable sizes (NaN) never fit
+    steps = np.where(np.isnan(loss), bins + 1.0, loss / step)
+    steps = np.ceil(steps) if offset is None else np.floor(steps + offset)
+    return np.clip(steps, -bins, bins + 1).astype(np.int64)
+
+
+def _shift(cost, steps, bins):
+    # cost[..., b - steps]: the subtree cost when `steps` of the pressure left b are used up first
+    index = np.arange(bins + 1) - steps[..., None]
+    if cost.ndim == 2 and steps.ndim == 1:  # one shift per size, the usual case
+        shifted = cost[np.arange(len(cost))[:, None] if len(cost) > 1 else 0, np.clip(index, 0, bins)]
+    else:
+        shape = np.broadcast_shapes(cost.shape[:-1], index.shape[:-1]) + (bins + 1,)
+        shifted = np.take_along_axis(np.broadcast_to(cost, shape), np.broadcast_to(np.clip(index, 0, bins), shape),
+                                     -1)
+    shifted[index < 0] = np.inf
+    return shifted
+
+
+def _losses(network, candidates, followers, density, roughness):
+    """The route step loss of every candidate size, each fitting type in one batch.
+
+    :return: per row, the loss of each candidate size for ducts and elbows, of each
+             (size, through outlet size) pair for tees below tees (one per size if
+             the outlet follows the tee), None for everything else
+    """
+    types = network.type
+    losses = [None] * len(types)
+    for fitting_type in (DUCT, ELBOW):
+        rows = np.nonzero(types == fitting_type)[0].tolist()
+        if not rows:
+            continue
+        counts = [len(candidates[i]) for i in rows]
+        sizes = np.concatenate([candidates[i] for i in rows])
+        flows = np.repeat(network.flow[rows], counts)
+        if fitting_type == DUCT:
+            loss = duct_pressure_drop(sizes, flows, np.repeat(network.length[rows], counts), density, roughness)
+        else:
+            loss = elbow_pressure_drop(sizes, flows, density)
+        for i, part in zip(rows, np.split(loss, np.cumsum(counts)[:-1])):
+            losses[i] = part
+    tees = np.nonzero(types == TEE)[0]
+    for i in tees[types[network.parent[tees]] == TEE].tolist():
+        # a tee below a tee: its own loss for the port it hangs off is on every route through it
+        branch = network.port[i] == BRANCH
+        through = network.branch_child[i] if branch else network.main_child[i]
+        sizes = candidates[i]
+        outlet_sizes = sizes if followers[through] else candidates[through][None, :]
+        losses[i] = tee_pressure_drop(sizes if followers[through] else sizes[:, None], density, network.flow[i],
+                                      network.flow[through], outlet_sizes, branch)
+    return losses
+
+
+def _search(network, candidates, followers, losses, costs, step, bins, order, offset=None):
+    """Cheapest sizes for every pressure budget, bottom up, then the choices top down.
+
+    best[i][s, b] is the least cost of fitting i and everything below it, given i
+    has its s-th candidate size and b pressure steps are left where the route
+    enters it. Losses are those of route_step_losses: ducts and elbows their own
+    pressure drop, and a fitting below a tee the drop of its own column for the
+    port it hangs off (only tees have one). step is the pressure of one step for
+    each fitting, its air handler's fan pressure / bins. Losses are rounded up to
+    whole steps, or without bias at each fitting's offset if given (see _steps).
+
+    :return: the chosen candidate index of every fitting; under an air handler where
+             nothing fits in the steps the choices do not fit either
+    """
+    types = network.type.tolist()
+    parent = network.parent.tolist()
+    main_child = network.main_child.tolist()
+    branch_child = network.branch_child.tolist()
+    port = network.port.tolist()
+    steps = [None if loss is None else _steps(loss, step[i], bins, None if offset is None else offset[i])
+             for i, loss in enumerate(losses)]
+    best = {}
+    pick = {}  # row -> its choice, by budget (free fittings) or by (tee size, budget) (through outlets)
+    nothing = np.zeros((1, bins + 1))
+
+    def outlet_cost(c):
+        # least cost below outlet c for every size of its upstream fitting and budget
+        cost_c = best.pop(c)
+        if followers[c]:
+            return cost_c
+        pick[c] = np.argmin(cost_c, axis=0)
+        return np.min(cost_c, axis=0)[None, :]
+
+    for i in reversed(order):
+        t = types[i]
+        main, branch = main_child[i], branch_child[i]
+        if t == AHU:
+            continue
+        if t == DIFFUSER:
+            best[i] = nothing
+        elif t == DUCT or t == ELBOW:
+            below = outlet_cost(main) if main >= 0 else nothing
+            best[i] = _shift(below, steps[i], bins)
+            if t == DUCT:
+                best[i] += costs[i][:, None]
+        elif main < 0 or branch < 0:
+            raise NetworkError(['tee %d needs both a main and a branch outlet' % network.ID[i]])
+        elif types[parent[i]] != TEE:
+            best[i] = outlet_cost(main) + outlet_cost(branch)
+        else:
+            through, other = (branch, main) if port[i] == BRANCH else (main, branch)
+            other_cost = outlet_cost(other)
+            through_cost = best.pop(through)
+            if followers[through]:  # same size as the tee
+                best[i] = _shift(through_cost, steps[i], bins) + _shift(other_cost, steps[i], bins)
+            else:
+                total = _shift(through_cost[None, :, :], steps[i], bins) + \
+                    _shift(other_cost[:, None, :], steps[i], bins)
+                pick[through] = np.argmin(total, axis=1)  # [size, budget]
+                best[i] = np.min(total, axis=1)
+
+    # top down: each fitting's size index and the pressure steps left entering it
+    chosen = [-1] * len(types)
+    left = [0] * len(types)
+    for i in order:
+        t = types[i]
+        if t == AHU:
+            for c in (main_child[i], branch_child[i]):
+                if c < 0:
+                    continue
+                chosen[c] = int(np.argmin(best.pop(c)[:, bins]))
+                left[c] = bins
+            continue
+        s, b = chosen[i], left[i]
+        if t == DUCT or t == ELBOW:
+            b -= int(steps[i][s])
+        elif t == TEE and types[parent[i]] == TEE:
+            through = branch_child[i] if port[i] == BRANCH else main_child[i]
+            if followers[through]:
+                b -= int(steps[i][s])
+            else:
+                chosen[through] = int(pick[through][s, b])
+                b -= int(steps[i][s, chosen[through]])
+        for c in (main_child[i], branch_child[i]):
+            if c < 0:
+                continue
+            left[c] = min(max(b, 0), bins)
+            if followers[c]:
+                chosen[c] = s
+            elif chosen[c] < 0:
+                chosen[c] = int(pick[c][left[c]])
+    return chosen
+
+
+def _apply_sizes(network, candidates, chosen, density, roughness, order):
+    # sets the chosen sizes, the tee outlet sizes and the pressure drops that follow from them
+    types = network.type
+    for i in order:
+        if types[i] != AHU:
+            network.size[i] = candidates[i][chosen[i]]
+    tees = np.nonzero(types == TEE)[0]
+    network.sizeMain[tees] = network.size[network.main_child[tees]]
+    network.sizeBranch[tees] = network.size[network.branch_child[tees]]
+    fitting_pressure_drops(network, density, roughness)
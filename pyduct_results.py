@@ -0,0 +1,133 @@
+# Result export: the sized network as a fixed-width table, CSV or JSON Lines.
+#
+# Rows are formatted straight from the network columns a chunk at a time and
+# written through one buffered stream, so memory stays flat however large the
+# network is. Nothing in the network is changed while formatting.
+
+import io
+import os
+import sys
+
+import numpy as np
+
+from pyduct_network import AHU, FITTING_TYPES, DuctNetwork, FittingList
+
+FORMATS = ('table', 'csv', 'jsonl')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl'}  # anything else is a table
+FIELDS = ('ID', 'type', 'velocity', 'flow', 'pdrop', 'size', 'diffuser_psum')
+TABLE_HEADER = ' '.join(['ID'.rjust(4), 'Fitting'.rjust(20), 'Velocity (fpm)'.rjust(15), 'Q (cfm)'.rjust(15),
+                         'DeltaP (in. wg)'.rjust(16), 'Diameter (in)'.rjust(17),
+                         'Diffuser pressure (in. wg)'.rjust(25)])
+
+
+def as_network(fittings):
+    # the network behind ducts['fittings'], or a network built from plain fitting dicts
+    if isinstance(fittings, DuctNetwork):
+        return fittings
+    if isinstance(fittings, FittingList):
+        return fittings.network
+    return DuctNetwork.from_fittings(list(fittings))
+
+
+def result_chunks(network, chunk_size=4096):
+    """Yields the result columns of chunk_size fittings at a time, in input order.
+
+    Air handling units report zero size and velocity, missing sizes and pressure
+    drops are reported as zero and diffuser_psum is NaN for everything but diffusers.
+    """
+    for start in range(0, len(network.ID), chunk_size):
+        rows = slice(start, start + chunk_size)
+        ahu = network.type[rows] == AHU
+        size = np.where(ahu, 0.0, network.size[rows])
+        with np.errstate(divide='ignore', invalid='ignore'):  # TODO: @sziske needs to fix this, area is missing /4
+            velocity = np.where(ahu, 0.0, network.flow[rows] / (np.pi * (size / 12) * (size / 12)))
+        yield dict(ID=network.ID[rows], type=network.type[rows], velocity=velocity, flow=network.flow[rows],
+                   pdrop=np.nan_to_num(network.pdrop[rows], nan=0.0), size=np.nan_to_num(size, nan=0.0),
+                   diffuser_psum=network.diffuser_psum[rows])
+
+
+def _rows(chunk):
+    for i in range(len(chunk['ID'])):
+        psum = chunk['diffuser_psum'][i]
+        yield (int(chunk['ID'][i]), FITTING_TYPES[chunk['type'][i]], float(chunk['velocity'][i]),
+               float(chunk['flow'][i]), float(chunk['pdrop'][i]), float(chunk['size'][i]),
+               None if psum != psum else float(psum))
+
+
+def result_records(fittings, chunk_size=4096):
+    # one dict per fitting with the FIELDS as keys, diffuser_psum None for anything but diffusers
+    for chunk in result_chunks(as_network(fittings), chunk_size):
+        for row in _rows(chunk):
+            yield dict(zip(FIELDS, row))
+
+
+def format_table(chunk):
+    lines = []
+    for ID, fitting_type, velocity, flow, pdrop, size, psum in _rows(chunk):
+        line = '%4d %20s %15.3f %15.1f %16.3f %17.3f' % (ID, fitting_type, velocity, flow, pdrop, size)
+        if psum is not None:
+            line += ' %25.3f' % psum
+        lines.append(line + '\n')
+    return ''.join(lines)
+
+
+def format_csv(chunk):
+    import csv  # csv and json are only imported for their formats
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(
+        [ID, fitting_type, repr(velocity), repr(flow), repr(pdrop), repr(size), '' if psum is None else repr(psum)]
+        for ID, fitting_type, velocity, flow, pdrop, size, psum in _rows(chunk))
+    return buffer.getvalue()
+
+
+def format_jsonl(chunk):
+    import json
+    return ''.join(json.dumps(dict(zip(FIELDS, row))) + '\n' for row in _rows(chunk))
+
+
+FORMATTERS = dict(table=format_table, csv=format_csv, jsonl=format_jsonl)
+HEADERS = dict(table=TABLE_HEADER + '\n' + '-' * 120 + '\n', csv=','.join(FIELDS) + '\n', jsonl='')
+
+
+def result_format(destination, format=None):
+    # the format asked for, otherwise the one the file extension suggests
+    if format is None:
+        name = destination if isinstance(destination, str) else getattr(destination, 'name', '')
+        format = EXTENSIONS.get(os.path.splitext(str(name))[1].lower(), 'table')
+    if format not in FORMATS:
+        raise ValueError('unknown result format %r, expected one of %s' % (format, ', '.join(FORMATS)))
+    return format
+
+
+def write_results(fittings, destination='pyductresult.txt', format=None, echo=False, chunk_size=4096):
+    """Writes the results of a sized network.
+
+    :param fittings: ducts['fittings'], the network itself or a list of fitting dicts
+    :param destination: file name, or an open text stream which is left open
+    :param format: 'table', 'csv' or 'jsonl'; default from the file extension, else table
+    :param echo: also write everything to the console
+    :return: the format written
+    """
+    format = result_format(destination, format)
+    network = as_network(fittings)
+    formatter = FORMATTERS[format]
+    if isinstance(destination, str):
+        file = open(destination, 'w', buffering=1 << 20)
+    else:
+        file = destination
+    try:
+        for text in _texts(network, format, formatter, chunk_size):
+            file.write(text)
+            if echo:
+                sys.stdout.write(text)
+    finally:
+        if file is not destination:
+            file.close()
+    return format
+
+
+def _texts(network, format, formatter, chunk_size):
+    if HEADERS[format]:
+        yield HEADERS[format]
+    for chunk in result_chunks(network, chunk_size):
+        yield formatter(chunk)
@@ -0,0 +1,242 @@
+# Sensitivities of the diffuser pressures of a sized network to its sizes, flows and lengths.
+#
+#   python pyduct_sensitivity.py "Duct Design Sample Input.txt" --top 10
+#
+# The pressure drop from the fan to a diffuser is the route total of
+# diffuser_pressures: a sum of one step loss per fitting on the route (route_step_losses).
+# Each step loss depends only on its own fitting's diameter, flow and length, and
+# for a tee on the diameter and flow of one outlet. The derivatives of every step
+# loss are taken once, analytically from the duct (Darcy-Weisbach with
+# Colebrook), elbow and tee loss functions and their tables. A derivative of one
+# diffuser's pressure is then the sum of the step derivatives along its route.
+#
+# For one weighted sum of diffuser pressures, e.g. the critical path, a reverse
+# pass gives the gradient with respect to every variable at once. Each fitting
+# gets the summed weight of the diffusers below it, which is the adjoint of its
+# step loss. That costs O(fittings), as little as one sizing pass. In the
+# depth-first order every subtree is one run of diffusers, so the full Jacobian
+# of every diffuser pressure is filled from running sums at the same cost plus
+# its own size.
+#
+# Variables: every fitting's own diameter (size), with a tee's outlet diameters
+# (sizeMain, sizeBranch) those of the fittings on its outlets; every duct's length;
+# and every diffuser's flow, with the flows upstream their sums.
+
+import argparse
+import sys
+
+import numpy as np
+
+from pyduct import (diffuser_pressures, fitting_pressure_drops, largest_path, read_ducts, setup_fan_distances,
+                    setup_flowrates, sizing_iterate_nick)
+from pyduct_fittings import PLEATED_ELBOW_90, SD5_10_BRANCH, SD5_10_MAIN
+from pyduct_friction import SolverError, colebrook_f, reynolds
+from pyduct_network import BRANCH, DIFFUSER, DUCT, ELBOW, TEE
+
+VARIABLES = ('size', 'flow', 'length')
+
+
+class PressureSensitivities(object):
+    """Derivatives of the diffuser pressures (diffuser_psum) of a sized network.
+
+    Made once per network state, after sizing and rounding. The derivatives are
+    in in. wg per inch of diameter, per cfm of diffuser flow and per foot of duct.
+    Gradients are columns over the rows of the network, zero where a row is not a
+    variable of that kind. diffusers lists the diffuser rows in input order, the
+    rows of every Jacobian, and pressures their pressures at the sizes that are
+    differentiated; the network's own diffuser_psum is from before rounding.
+
+    The tables are piecewise linear, so at their grid points the derivative is
+    the one from above, and where a ratio is clamped to the table it is zero.
+    """
+
+    def __init__(self, network, density, roughness):
+        self.network = network
+        n = len(network.ID)
+        sized = network.copy()
+        for column in (sized.pdrop, sized.pdropMain, sized.pdropBranch):
+            column[np.isnan(column)] = 0.0  # rows without a loss of that kind
+        fitting_pressure_drops(sized, density, roughness)
+
+        # d(step loss)/d(variable) of each row, for its own variables and for one outlet of a tee
+        self.own = dict((key, np.zeros(n)) for key in VARIABLES)
+        self.outlet = np.full(n, -1, dtype=np.int64)
+        self.outlet_size = np.zeros(n)
+        self.outlet_flow = np.zeros(n)
+        types = network.type
+
+        rows = np.nonzero(types == DUCT)[0]
+        if len(rows):
+            p, D, q, L = sized.pdrop[rows], sized.size[rows], sized.flow[rows], sized.length[rows]
+            velocity = q / ((np.pi * (D / 12) ** 2) / 4)
+            x = 1 / np.sqrt(colebrook_f(D, velocity, roughness))
+            # implicit derivative of the Colebrook equation x + 2 log10(a + b x) = 0, with a ~ 1/D and b ~ D/q
+            a = roughness / (3.7 * (D / 12))
+            b = 2.51 / reynolds(D, velocity)
+            inner = (a + b * x) * np.log(10)
+            dx_dlogD = (2 * a / inner - 2 * x * b / inner) / (1 + 2 * b / inner)
+            dx_dlogq = (2 * x * b / inner) / (1 + 2 * b / inner)
+            # pdrop ~ f L q^2 / D^5 with f = 1 / x^2
+            self.own['size'][rows] = p / D * (-5 - 2 * dx_dlogD / x)
+            self.own['flow'][rows] = p / q * (2 - 2 * dx_dlogq / x)
+            self.own['length'][rows] = p / L
+
+        rows = np.nonzero(types == ELBOW)[0]
+        if len(rows):
+            p, D, q = sized.pdrop[rows], sized.size[rows], sized.flow[rows]
+            # pdrop = c_o(D) q^2 / D^4 times a constant
+            self.own['size'][rows] = p * (-4 / D + PLEATED_ELBOW_90.slope(D) / PLEATED_ELBOW_90(D))
+            self.own['flow'][rows] = 2 * p / q
+
+        # route_step_losses charges a tee below a tee with its own loss into the outlet on its port
+        rows = np.nonzero(types == TEE)[0]
+        rows = rows[network.parent[rows] >= 0]
+        rows = rows[types[network.parent[rows]] == TEE]
+        for branch, table in ((False, SD5_10_MAIN), (True, SD5_10_BRANCH)):
+            port_rows = rows[(network.port[rows] == BRANCH) == branch]
+            if not len(port_rows):
+                continue
+            D, q = sized.size[port_rows], sized.flow[port_rows]
+            if branch:
+                outlet = network.branch_child[port_rows]
+                D_out, q_out, p = sized.sizeBranch[port_rows], sized.flowBranch[port_rows], sized.pdropBranch[port_rows]
+            else:
+                outlet = network.main_child[port_rows]
+                D_out, q_out, p = sized.sizeMain[port_rows], sized.flowMain[port_rows], sized.pdropMain[port_rows]
+            # pdrop = c(area ratio, flow ratio) p_v with p_v ~ q^2 / D^4
+            area_ratio = (D_out / D) ** 2
+            flow_ratio = q_out / q
+            p_v = density * ((q / ((np.pi * (D / 12) ** 2) / 4)) / 1097) ** 2
+            dc_darea, dc_dflow = table.gradient(area_ratio, flow_ratio)
+            self.own['size'][port_rows] = -4 * p / D - 2 * p_v * dc_darea * area_ratio / D
+            self.own['flow'][port_rows] = 2 * p / q - p_v * dc_dflow * flow_ratio / q
+            self.outlet[port_rows] = outlet
+            self.outlet_size[port_rows] = 2 * p_v * dc_darea * area_ratio / D_out
+            self.outlet_flow[port_rows] = p_v * dc_dflow / q
+
+        # depth first order: each subtree is rows[start:end] of it, and one run of the diffusers
+        order = network.order
+        self.position = np.full(n, -1, dtype=np.int64)
+        self.position[order] = np.arange(len(order))
+        count = np.ones(n, dtype=np.int64).tolist()
+        parent = network.parent.tolist()
+        for i in order[::-1].tolist():
+            if parent[i] >= 0:
+                count[parent[i]] += count[i]
+        self.end = self.position + np.array(count)
+        is_diffuser = types[order] == DIFFUSER
+        before = np.concatenate([[0], np.cumsum(is_diffuser)])  # diffusers before each order position
+        self.first_diffuser = before[self.position]
+        self.last_diffuser = before[self.end]
+        self.diffusers = np.nonzero(types == DIFFUSER)[0]
+        self.pressures = diffuser_pressures(sized)[0][self.diffusers]
+        self._rank = self.first_diffuser[self.diffusers]  # depth first rank of each diffuser, in input order
+
+    def adjoint(self, weights):
+        # summed weight of the diffusers below every row, the adjoint of each step loss
+        w = np.zeros(len(self.network.ID))
+        w[self.diffusers] = np.asarray(weights, dtype=float)
+        total = np.concatenate([[0.0], np.cumsum(w[self.network.order])])
+        return total[self.end] - total[self.position]
+
+    def gradient(self, weights):
+        """Gradient of sum(weights * diffuser pressures) in one reverse pass.
+
+        :param weights: one per diffuser, in the order of diffusers
+        :return: dict of size, flow and length gradient columns
+        """
+        network = self.network
+        adjoint = self.adjoint(weights)
+        tees = np.nonzero(self.outlet >= 0)[0]
+        size = adjoint * self.own['size']
+        np.add.at(size, self.outlet[tees], adjoint[tees] * self.outlet_size[tees])
+        length = adjoint * self.own['length']
+
+        # a diffuser's flow passes through every fitting on its route, and the tee outlets on it
+        through = adjoint * self.own['flow']
+        np.add.at(through, self.outlet[tees], adjoint[tees] * self.outlet_flow[tees])
+        parent = network.parent.tolist()
+        route = through.tolist()
+        for i in network.order.tolist():
+            if parent[i] >= 0:
+                route[i] += route[parent[i]]
+        flow = np.zeros(len(network.ID))
+        flow[self.diffusers] = np.array(route)[self.diffusers]
+        return dict(size=size, flow=flow, length=length)
+
+    def diffuser(self, ID):
+        # gradient of the pressure at one diffuser
+        weights = np.zeros(len(self.diffusers))
+        weights[np.searchsorted(self.diffusers, self.network.position[ID])] = 1.0
+        return self.gradient(weights)
+
+    def critical_path(self):
+        # gradient of the pressure at the end of the critical path, the diffuser farthest from the fan
+        return self.diffuser(largest_path(self.network)['ID'])
+
+    def jacobian(self, variable):
+        """Every diffuser pressure's derivative with respect to every variable of one kind.
+
+        :param variable: 'size' or 'length' for a diffusers x fittings array, 'flow' for
+               diffusers x diffusers; both axes in input order
+        """
+        if variable not in VARIABLES:
+            raise ValueError('unknown variable %r, expected one of %s' % (variable, ', '.join(VARIABLES)))
+        n = len(self.network.ID)
+        nd = len(self.diffusers)
+        rows = np.arange(n)
+        tees = np.nonzero(self.outlet >= 0)[0]
+        # each term adds its value to the diffusers below its row, in one column or a run of columns
+        if variable == 'flow':
+            terms = [(rows, self.first_diffuser, self.last_diffuser, self.own['flow']),
+                     (tees, self.first_diffuser[self.outlet[tees]], self.last_diffuser[self.outlet[tees]],
+                      self.outlet_flow[tees])]
+            width = nd
+        else:
+            terms = [(rows, rows, rows + 1, self.own[variable])]
+            if variable == 'size':
+                terms.append((tees, self.outlet[tees], self.outlet[tees] + 1, self.outlet_size[tees]))
+            width = n
+        change = np.zeros((nd + 1, width + 1))  # both axes differenced, summed up below
+        for i, start, stop, value in terms:
+            top, bottom = self.first_diffuser[i], self.last_diffuser[i]
+            np.add.at(change, (top, start), value)
+            np.add.at(change, (top, stop), -value)
+            np.add.at(change, (bottom, start), -value)
+            np.add.at(change, (bottom, stop), value)
+        jacobian = np.cumsum(np.cumsum(change, axis=0), axis=1)[:nd, :width]
+        jacobian = jacobian[self._rank]
+        if variable == 'flow':
+            jacobian = jacobian[:, self._rank]
+        return jacobian
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fittings whose diameter changes the critical path pressure most.')
+    parser.add_argument('input', help='pyduct input file, sized as calculate would')
+    parser.add_argument('--top', type=int, default=10, help='how many fittings to list')
+    args = parser.parse_args(argv)
+    try:
+        ducts = read_ducts(args.input)
+        network = ducts['network']
+        setup_flowrates(network)
+        setup_fan_distances(network)
+        sizing_iterate_nick(ducts)
+    except (OSError, ValueError, SolverError) as error:  # InputError and NetworkError are ValueErrors
+        print('pyduct_sensitivity: %s' % error, file=sys.stderr)
+        return 1
+    sensitivities = PressureSensitivities(network, ducts['air_density'], ducts['roughness'])
+    gradient = sensitivities.critical_path()
+    farthest = largest_path(network)['ID']
+    pressure = sensitivities.pressures[np.searchsorted(sensitivities.diffusers, network.position[farthest])]
+    print('critical path pressure %.4f in. wg at diffuser %d' % (pressure, farthest))
+    print('%8s %10s %10s %21s' % ('ID', 'fitting', 'size (in)', 'dP/dsize (in. wg/in)'))
+    for i in np.argsort(gradient['size'])[:args.top].tolist():
+        if gradient['size'][i] == 0:
+            break
+        print('%8d %10s %10.2f %21.5f' % (network.ID[i], network.view(i)['type'], network.size[i], gradient['size'][i]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
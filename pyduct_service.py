@@ -0,0 +1,458 @@
+# Warm local service: keeps sized networks in memory and answers sizing requests.
+#
+#   python pyduct_service.py                 JSON Lines on standard input/output
+#   python pyduct_service.py --http 8765     JSON over HTTP POST on 127.0.0.1:8765
+#
+# Every request is one JSON object with an "op" and an optional "id" that is echoed
+# in its response, e.g.
+#
+#   {"id": 1, "op": "load", "network": "zone1", "path": "zone1.txt"}
+#   {"id": 2, "op": "edit", "network": "zone1", "edits": [{"set": "flow", "ID": 11, "value": 200}]}
+#   {"id": 3, "op": "solve", "network": "zone1", "fittings": false}
+#   {"id": 4, "op": "size", "spec": {"fan_pressure": 0.6, ..., "fittings": [...]}}
+#
+# and gets {"id": ..., "ok": true, "result": {...}} or {"id": ..., "ok": false,
+# "error": "...", "type": "..."} back, with the list of "problems" of a bad network or
+# the "solver" that gave up (its name, iterations, residual and seconds) when there
+# are any. Responses to stdin requests are written as they finish, so they can come
+# out of order. Over HTTP the body is one request or a list of them, answered with
+# one response or the list of responses.
+#
+# A "path" (and the "cache_dir" of its compiled network) may name any file over
+# stdin, which only the user who started the service can write to. With --root DIR
+# they must lie inside DIR, relative ones are taken from it; over HTTP without
+# --root requests may not name files at all. The HTTP service takes only
+# application/json bodies addressed to the host it listens on (or an --allow-host),
+# so a web page cannot post to it, and it warns when it listens on more than the
+# loopback.
+#
+# Operations:
+#   load      size a network from "path", input "text" or a "spec" and keep it as "network"
+#   edit      apply "edits" (flow of a diffuser, length of a duct, fan_pressure of all or
+#             one air handler) and re-solve
+#   solve     the current results of a kept network
+#   drop      forget a network
+#   list      the kept networks
+#   size      one-shot sizing of a path, text or spec, nothing is kept
+#
+# A spec is the ducts dict of process_keywords in JSON: the settings plus a list of
+# fittings with ID, type, IDup, BranchUP ("main", "branch" or null), length and flow.
+# Results hold the dpdl convergence and, unless "fittings" is false, the result
+# rows of every fitting as in the JSON Lines output.
+#
+# Kept networks are re-solved incrementally by DuctModel on one worker thread;
+# edits and solves that arrive for a network while it is being solved are applied
+# together and answered by a single re-solve. One-shot sizes run on a process pool,
+# which is replaced if one of its workers dies.
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from pyduct import make_network, new_duct_network, process_keywords
+from pyduct_cache import SETTING_KEYS, load_ducts
+from pyduct_friction import SolverError
+from pyduct_model import DuctModel
+from pyduct_network import FITTING_TYPES, PORTS, NetworkError
+from pyduct_results import result_records
+
+OPERATIONS = ('load', 'edit', 'solve', 'drop', 'list', 'size')
+MAX_BODY = 256 << 20  # [bytes] largest HTTP request body accepted
+LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+class RequestError(ValueError):
+    """Raised for a request the service cannot act on."""
+
+
+def ducts_from_spec(spec):
+    # the ducts dict of process_keywords from its JSON form
+    ducts = new_duct_network()
+    for key in SETTING_KEYS:
+        if key in spec:
+            ducts[key] = spec[key]
+    columns = dict(ID=[], type=[], IDup=[], port=[], length=[], flow=[])
+    for fitting in spec.get('fittings', []):
+        try:
+            fitting_type = str(fitting['type']).lower()
+            if fitting_type not in FITTING_TYPES:
+                raise RequestError('unknown fitting type %r' % fitting['type'])
+            port = fitting.get('BranchUP')
+            if port not in PORTS:
+                raise RequestError('unknown tee port %r' % port)
+            columns['ID'].append(int(fitting['ID']))
+            columns['type'].append(FITTING_TYPES.index(fitting_type))
+            columns['IDup'].append(-1 if fitting.get('IDup') is None else int(fitting['IDup']))
+            columns['port'].append(PORTS.index(port))
+            columns['length'].append(np.nan if fitting.get('length') is None else float(fitting['length']))
+            columns['flow'].append(np.nan if fitting.get('flow') is None else float(fitting['flow']))
+        except KeyError as error:
+            raise RequestError('fitting %r is missing %s' % (fitting, error))
+    if len(set(columns['ID'])) != len(columns['ID']):
+        raise RequestError('duplicate fitting IDs in spec')
+    network = ducts['network'] = make_network(columns)
+    ducts['fittings'] = network.fittings
+    return ducts
+
+
+def read_request_ducts(request):
+    # the ducts of a load or size request, from its path, text or spec
+    if 'path' in request:
+        return load_ducts(request['path'], request.get('cache_dir'))
+    if 'text' in request:
+        return process_keywords(request['text'].splitlines(True))
+    if 'spec' in request:
+        return ducts_from_spec(request['spec'])
+    raise RequestError('%s needs a path, text or spec' % request['op'])
+
+
+def model_result(model, fittings=True):
+    convergence = model.convergence
+    result = dict(dpdl=convergence['dpdl'], iterations=convergence['iterations'],
+                  converged=convergence['converged'], residual=convergence['residual'],
+                  fan_pressure=model.ducts['fan_pressure'])
+    if 'air_handlers' in convergence:  # several air handlers, each sized on its own
+        result['air_handlers'] = [dict((key, air_handler[key]) for key in
+                                       ('ID', 'fan_pressure', 'dpdl', 'iterations', 'converged', 'residual'))
+                                  for air_handler in convergence['air_handlers']]
+    if fittings:
+        result['fittings'] = list(result_records(model.results()))
+    return result
+
+
+def error_fields(error):
+    # the fields of a failed response: the message and type, and what NetworkError and SolverError tell
+    fields = dict(ok=False, error=str(error), type=type(error).__name__)
+    if isinstance(error, NetworkError):
+        fields['problems'] = error.problems
+    elif isinstance(error, SolverError):
+        fields['solver'] = error.info()
+    return fields
+
+
+def size_once(request):
+    # a one-shot size request, run in a worker process; a failure comes back as the
+    # fields of its response, so no exception has to cross the process boundary
+    try:
+        model = DuctModel(read_request_ducts(request))
+        return dict(ok=True, result=model_result(model, request.get('fittings', True)))
+    except Exception as error:
+        return error_fields(error)
+
+
+def apply_edit(model, edit):
+    what = edit.get('set')
+    if what in ('flow', 'length') and int(edit.get('ID', -1)) not in model.network.position:
+        raise RequestError('no fitting %r in the network' % edit.get('ID'))
+    if what == 'flow':
+        model.set_flow(int(edit['ID']), float(edit['value']))
+    elif what == 'length':
+        model.set_length(int(edit['ID']), float(edit['value']))
+    elif what == 'fan_pressure':  # of every air handler, or of air handler ID only
+        model.set_fan_pressure(float(edit['value']), None if edit.get('ID') is None else int(edit['ID']))
+    else:
+        raise RequestError('unknown edit %r, expected flow, length or fan_pressure' % what)
+
+
+class Service(object):
+    """Kept networks and the pools that solve them.
+
+    Requests naming a network are queued and carried out in arrival order. Edits
+    and solves queued next to each other are applied together and re-solved once.
+    The files that requests name must lie in root if given, and files=False
+    refuses every request that names one.
+    """
+
+    def __init__(self, processes=None, root=None, files=True):
+        self.root = None if root is None else os.path.realpath(root)
+        self.files = files
+        self.models = {}  # network name -> DuctModel, changed by the worker thread under lock
+        self.lock = threading.Lock()
+        self.pending = {}  # network name -> [(request, future)]
+        self.thread = ThreadPoolExecutor(1)  # the solvers' caches are not thread safe
+        self.workers = processes
+        self.processes = ProcessPoolExecutor(processes)
+
+    def close(self):
+        self.thread.shutdown()
+        self.processes.shutdown()
+
+    async def handle(self, request):
+        # the response to one request, errors included
+        response = dict(id=request.get('id') if isinstance(request, dict) else None)
+        try:
+            if not isinstance(request, dict):
+                raise RequestError('a request must be a JSON object')
+            op = request.get('op')
+            if op not in OPERATIONS:
+                raise RequestError('unknown op %r, expected one of %s' % (op, ', '.join(OPERATIONS)))
+            if op in ('load', 'size'):
+                request = self._confine(request)
+            if op == 'list':
+                with self.lock:
+                    networks = sorted(self.models)
+                response.update(ok=True, result=dict(networks=networks))
+            elif op == 'size':
+                response.update(await self._size(request))
+            else:
+                response.update(ok=True, result=await self._queue(request))
+        except Exception as error:
+            response.update(error_fields(error))
+        return response
+
+    def _confine(self, request):
+        # the request with its path and cache_dir resolved inside root
+        named = [key for key in ('path', 'cache_dir') if request.get(key) is not None]
+        if not named:
+            return request
+        if not self.files:
+            raise RequestError('this service reads no files, start it with --root DIR to load them from DIR')
+        if self.root is None:
+            return request
+        request = dict(request)
+        for key in named:
+            path = os.path.realpath(os.path.join(self.root, str(request[key])))
+            if os.path.commonpath([self.root, path]) != self.root:
+                raise RequestError('%s %r is outside %s' % (key, request[key], self.root))
+            request[key] = path
+        return request
+
+    async def _size(self, request):
+        # the response fields of a one-shot size; a pool whose worker died is replaced for the next requests
+        pool = self.processes
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, size_once, request)
+        except BrokenProcessPool:
+            if self.processes is pool:
+                self.processes = ProcessPoolExecutor(self.workers)
+                pool.shutdown(wait=False)
+            raise
+
+    async def _queue(self, request):
+        name = request.get('network')
+        if name is None:
+            raise RequestError('%s needs a network name' % request['op'])
+        if request['op'] == 'edit' and not isinstance(request.get('edits', []), list):
+            raise RequestError('edits must be a list')
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queued = self.pending.setdefault(name, [])
+        queued.append((request, future))
+        if len(queued) == 1:  # nobody is working on this network yet
+            loop.create_task(self._drain(name))
+        return await future
+
+    async def _drain(self, name):
+        # works through the queue of one network until it is empty
+        loop = asyncio.get_running_loop()
+        queued = self.pending[name]
+        while queued:
+            if queued[0][0]['op'] in ('load', 'drop'):
+                batch = queued[:1]
+            else:  # every edit and solve up to the next load or drop
+                n = 1
+                while n < len(queued) and queued[n][0]['op'] not in ('load', 'drop'):
+                    n += 1
+                batch = queued[:n]
+            try:
+                outcomes = await loop.run_in_executor(self.thread, self._run_batch, name, batch)
+            except Exception as error:
+                outcomes = [error] * len(batch)
+            del queued[:len(batch)]  # requests arriving meanwhile were appended behind the batch
+            for (request, future), outcome in zip(batch, outcomes):
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+        del self.pending[name]
+
+    def _run_batch(self, name, batch):
+        # runs on the worker thread, gives each request of the batch its result or exception
+        request = batch[0][0]
+        if request['op'] == 'load':
+            model = DuctModel(read_request_ducts(request))
+            with self.lock:
+                self.models[name] = model  # replaces a network of the same name
+            return [model_result(model, request.get('fittings', True))]
+        model = self.models.get(name)
+        if model is None:
+            raise RequestError('no network %r loaded' % name)
+        if request['op'] == 'drop':
+            with self.lock:
+                del self.models[name]
+                return [dict(networks=sorted(self.models))]
+
+        # apply every queued edit, solve once; a failing request keeps the edits before the failing one
+        errors = []
+        for request, future in batch:
+            try:
+                for edit in request.get('edits', []):
+                    apply_edit(model, edit)
+            except Exception as error:
+                errors.append(error)
+            else:
+                errors.append(None)
+        model.solve()
+        summary = model_result(model, fittings=False)
+        rows = None
+        outcomes = []
+        for (request, future), error in zip(batch, errors):
+            if error is not None:
+                outcomes.append(error)
+                continue
+            result = dict(summary, batched=len(batch))
+            if request.get('fittings', True):
+                if rows is None:
+                    rows = list(result_records(model.results()))
+                result['fittings'] = rows
+            outcomes.append(result)
+        return outcomes
+
+
+async def serve_stdio(service, reader, write):
+    # JSON Lines: one request per line in, one response per line out as each finishes
+    tasks = set()
+
+    async def answer(line):
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            response = dict(id=None, ok=False, error='bad JSON: %s' % error, type='RequestError')
+        else:
+            response = await service.handle(request)
+        write(json.dumps(response) + '\n')
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.strip():
+            task = asyncio.ensure_future(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def _stdin_reader():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_BODY)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    return reader
+
+
+def _stdout_write(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def is_loopback(host):
+    try:
+        return host in LOOPBACK_HOSTS or ipaddress.ip_address(host).is_loopback
+    except ValueError:  # a host name other than localhost
+        return False
+
+
+def host_name(header):
+    # the host of a Host header, without its port or the brackets of an IPv6 address
+    if header.startswith('['):
+        return header[1:].partition(']')[0]
+    return header if header.count(':') > 1 else header.partition(':')[0]
+
+
+async def http_connection(service, reader, writer, hosts=LOOPBACK_HOSTS):
+    # one HTTP/1.1 connection, kept alive for as many POSTs as the client sends;
+    # hosts are the names the client may address the service by
+    try:
+        while True:
+            start = await reader.readline()
+            if not start.strip():
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            method = start.split()[0].decode('latin-1').upper()
+            length = int(headers.get('content-length', 0))
+            content_type = headers.get('content-type', '').partition(';')[0].strip().lower()
+            data = None
+            if method != 'POST':
+                status, body = '405 Method Not Allowed', dict(ok=False, error='POST a JSON request')
+            elif host_name(headers.get('host', '')).lower() not in hosts:
+                status, body = '403 Forbidden', dict(ok=False, error='unexpected Host %r' % headers.get('host'))
+            elif content_type != 'application/json':
+                status, body = '415 Unsupported Media Type', dict(ok=False, error='POST application/json')
+            elif length > MAX_BODY:
+                status, body = '413 Payload Too Large', dict(ok=False, error='request body too large')
+            else:
+                data = await reader.readexactly(length)
+                try:
+                    request = json.loads(data.decode('utf-8'))
+                except ValueError as error:
+                    status, body = '400 Bad Request', dict(ok=False, error='bad JSON: %s' % error)
+                else:
+                    status = '200 OK'
+                    if isinstance(request, list):
+                        body = await asyncio.gather(*[service.handle(item) for item in request])
+                    else:
+                        body = await service.handle(request)
+            payload = json.dumps(body).encode('utf-8')
+            writer.write(('HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                          % (status, len(payload))).encode('latin-1') + payload)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close' or data is None:  # a refused body was not read
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, IndexError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run(service, port=None, host='127.0.0.1', allowed_hosts=()):
+    if port is None:
+        await serve_stdio(service, await _stdin_reader(), _stdout_write)
+        return
+    if not is_loopback(host):
+        sys.stderr.write('pyduct service: warning, %s is not a loopback address, anyone who can reach it can '
+                         'send requests\n' % host)
+    hosts = LOOPBACK_HOSTS + tuple(name.lower() for name in (host,) + tuple(allowed_hosts))
+    server = await asyncio.start_server(lambda r, w: http_connection(service, r, w, hosts), host, port,
+                                        limit=MAX_BODY)
+    sys.stderr.write('pyduct service on http://%s:%d\n' % (host, server.sockets[0].getsockname()[1]))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve pyduct sizing requests from memory.')
+    parser.add_argument('--http', type=int, metavar='PORT', help='serve HTTP on localhost instead of stdin/stdout')
+    parser.add_argument('--host', default='127.0.0.1', help='address for --http (default: %(default)s)')
+    parser.add_argument('--allow-host', action='append', default=[], metavar='NAME',
+                        help='Host header to accept besides localhost and --host, e.g. this machine\'s name')
+    parser.add_argument('--root', metavar='DIR', help='directory the files named by requests must lie in '
+                        '(default: any file over stdin, none over HTTP)')
+    parser.add_argument('-j', '--jobs', type=int, help='processes for one-shot size requests (default: all CPUs)')
+    args = parser.parse_args(argv)
+    service = Service(args.jobs, args.root, files=args.http is None or args.root is not None)
+    try:
+        asyncio.run(run(service, args.http, args.host, args.allow_host))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# Parameter sweeps over one parsed duct network.
+#
+# The input file is parsed, connected and given its flows and fan distances once.
+# Each worker process receives that network once, as its topology columns, and then
+# only the (fan_pressure, air_density, roughness, rounding) of each design point.
+# Networks with several air handlers, or a fan pressure of its own for one, size
+# every tree on its own as calculate does (see pyduct_ahu). A design point that
+# cannot be sized is marked infeasible in its row and the sweep carries on.
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pyduct import apply_rounding, diffuser_pressures, largest_path, size_network
+from pyduct_ahu import fan_pressures, size_air_handlers
+from pyduct_cache import load_ducts
+from pyduct_friction import SolverError
+from pyduct_network import DIFFUSER, DUCT, DuctNetwork, NetworkError
+
+# what a worker needs of the network, everything else is solved per point
+TOPOLOGY_KEYS = ('ID', 'type', 'IDup', 'port', 'length', 'flow', 'flowMain', 'flowBranch', 'fandist')
+SOLVED_KEYS = ('size', 'sizeMain', 'sizeBranch', 'pdrop', 'pdropMain', 'pdropBranch', 'diffuser_psum')
+
+_worker_ducts = None
+
+
+def prepare(filename, cache_dir=None):
+    # parse, connect and set up flows and fan distances once for the whole sweep
+    return load_ducts(filename, cache_dir)
+
+
+def compact_topology(ducts):
+    network = ducts['network']
+    return dict((key, getattr(network, key)) for key in TOPOLOGY_KEYS)
+
+
+def _rebuild(topology):
+    network = DuctNetwork(topology['ID'], topology['type'], topology['IDup'], topology['port'])
+    for key in ('length', 'flow', 'flowMain', 'flowBranch', 'fandist'):
+        network.columns[key][:] = topology[key]
+    return dict(fittings=network.fittings, network=network)
+
+
+def _init_worker(topology):
+    global _worker_ducts
+    _worker_ducts = _rebuild(topology)
+
+
+def evaluate_point(ducts, fan_pressure, air_density, roughness, rounding):
+    """Sizes the network for one design point and summarises it.
+
+    :param fan_pressure: fan pressure [in. wg] of every air handler, or a dict of
+           every air handler's ID to its own
+    :return: dict with dpdl, passes, converged flag, the pressure at the end of the
+             critical path [in. wg], the highest duct velocity [fpm], the total duct
+             surface area [ft^2] and the diffuser pressures in input order, all for
+             the sizes after rounding
+    """
+    network = ducts['network']
+    for key in SOLVED_KEYS:  # start every point from scratch
+        network.columns[key][:] = np.nan
+    own = fan_pressure if isinstance(fan_pressure, dict) else {}
+    ducts.update(fan_pressure=None if own else fan_pressure, fan_pressures=own, air_density=air_density,
+                 roughness=roughness, rounding=rounding)
+    if len(network.roots) > 1 or own:  # every tree with its own dpdl, as sizing_iterate_nick does
+        convergence = size_air_handlers(ducts, workers=1, finish=False)
+    else:
+        convergence = size_network(ducts)
+        diffuser_pressures(network)
+    apply_rounding(network, rounding, air_density, roughness, fan_pressure)
+    diffuser_pressures(network)  # every point reports the pressures of the sizes it chose
+
+    duct_rows = network.type == DUCT
+    sizes = network.size[duct_rows] / 12  # [ft]
+    flows = network.flow[duct_rows]
+    lengths = network.length[duct_rows]
+    velocities = flows / (np.pi * sizes ** 2 / 4)
+    return dict(dpdl=convergence['dpdl'], iterations=convergence['iterations'], converged=convergence['converged'],
+                critical_pressure=largest_path(network)['diffuser_psum'],
+                max_velocity=float(velocities.max()) if len(velocities) else 0.0,
+                duct_area=float(np.sum(np.pi * sizes * lengths)),
+                diffuser_psum=network.diffuser_psum[network.type == DIFFUSER].tolist())
+
+
+def _every_fan_pressure(ducts, given):
+    # fan pressure of every air handler, given (ID -> pressure) for some and the input file's for the rest
+    pressures = dict(ducts['fan_pressures'])
+    pressures.update(given)
+    return fan_pressures(dict(ducts, fan_pressures=pressures))
+
+
+def _evaluate_or_fail(ducts, point):
+    # an infeasible point gets a row of NaNs and its error, the rest of the sweep goes on
+    try:
+        row = evaluate_point(ducts, *point)
+    except (SolverError, NetworkError) as error:
+        diffusers = int(np.count_nonzero(ducts['network'].type == DIFFUSER))
+        return dict(dpdl=np.nan, iterations=getattr(error, 'iterations', 0), converged=False,
+                    critical_pressure=np.nan, max_velocity=np.nan, duct_area=np.nan, diffuser_psum=[np.nan] * diffusers,
+                    error=str(error))
+    row['error'] = ''
+    return row
+
+
+def _evaluate_in_worker(point):
+    return _evaluate_or_fail(_worker_ducts, point)
+
+
+def sweep(ducts, fan_pressure=None, air_density=None, roughness=None, rounding=None, workers=None, chunksize=4):
+    """Evaluates every combination of the given design parameters.
+
+    :param ducts: a network from prepare()
+    :param fan_pressure, air_density, roughness, rounding: lists of values to sweep,
+           None keeps the value from the input file. A fan pressure is one value for
+           every air handler, or a dict of air handler ID to its own, with the others
+           keeping the pressures of the input file
+    :param workers: worker processes, default one per CPU; 1 runs in this process
+    :return: dict of columns, one row per design point: the four parameters, dpdl,
+             iterations, converged, critical_pressure, max_velocity, duct_area, plus
+             diffuser_ID (one entry per diffuser) and diffuser_psum (points x diffusers).
+             With several air handlers dpdl is that of the first and iterations the most
+             of any; fan_pressure holds dicts if any point has one. A point that cannot
+             be sized (SolverError or NetworkError) is not feasible: its results are NaN,
+             iterations those it spent and error the message, '' for feasible points
+    """
+    if fan_pressure is None:
+        fan_pressure = [{} if ducts['fan_pressures'] else ducts['fan_pressure']]
+    fan_pressure = [_every_fan_pressure(ducts, value) if isinstance(value, dict) else value for value in fan_pressure]
+    axes = [fan_pressure] + [values if values is not None else [ducts[name]] for name, values in
+                             (('air_density', air_density), ('roughness', roughness), ('rounding', rounding))]
+    points = list(itertools.product(*axes))
+    topology = compact_topology(ducts)
+    if workers == 1:
+        local = _rebuild(topology)
+        rows = [_evaluate_or_fail(local, point) for point in points]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(topology,)) as pool:
+            rows = list(pool.map(_evaluate_in_worker, points, chunksize=chunksize))
+
+    per_air_handler = any(isinstance(point[0], dict) for point in points)
+    table = dict(fan_pressure=np.array([point[0] for point in points], dtype=object if per_air_handler else float),
+                 air_density=np.array([point[1] for point in points], dtype=float),
+                 roughness=np.array([point[2] for point in points], dtype=float),
+                 rounding=np.array([str(point[3]) for point in points]),
+                 diffuser_ID=ducts['network'].ID[ducts['network'].type == DIFFUSER],
+                 diffuser_psum=np.array([row['diffuser_psum'] for row in rows], dtype=float))
+    for key in ('dpdl', 'iterations', 'converged', 'critical_pressure', 'max_velocity', 'duct_area', 'error'):
+        table[key] = np.array([row[key] for row in rows])
+    table['feasible'] = table['error'] == ''
+    return table
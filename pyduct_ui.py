@@ -11,22 +11,36 @@ from PyQt5 import QtCore, QtWidgets
 class Ui_Dialog(object):
     def setupUi(self, Dialog):
         Dialog.setObjectName("Dialog")
-        Dialog.resize(626, 208)
+        Dialog.resize(760, 560)
         self.lineEdit = QtWidgets.QLineEdit(Dialog)
         self.lineEdit.setReadOnly(True)
-        self.lineEdit.setGeometry(QtCore.QRect(11, 32, 491, 22))
+        self.lineEdit.setGeometry(QtCore.QRect(11, 32, 625, 22))
         self.lineEdit.setObjectName("lineEdit")
         self.buttonBox = QtWidgets.QDialogButtonBox(Dialog)
-        self.buttonBox.setGeometry(QtCore.QRect(420, 170, 193, 28))
+        self.buttonBox.setGeometry(QtCore.QRect(556, 522, 193, 28))
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
         self.buttonBox.setStandardButtons(QtWidgets.QDialogButtonBox.Cancel | QtWidgets.QDialogButtonBox.Ok)
         self.buttonBox.setObjectName("buttonBox")
         self.pushButton = QtWidgets.QPushButton(Dialog)
-        self.pushButton.setGeometry(QtCore.QRect(510, 30, 93, 28))
+        self.pushButton.setGeometry(QtCore.QRect(656, 30, 93, 28))
         self.pushButton.setObjectName("pushButton")
+        self.tableView = QtWidgets.QTableView(Dialog)
+        self.tableView.setGeometry(QtCore.QRect(11, 70, 738, 396))
+        self.tableView.setObjectName("tableView")
+        self.progressBar = QtWidgets.QProgressBar(Dialog)
+        self.progressBar.setGeometry(QtCore.QRect(11, 478, 625, 22))
+        self.progressBar.setProperty("value", 0)
+        self.progressBar.setObjectName("progressBar")
+        self.cancelButton = QtWidgets.QPushButton(Dialog)
+        self.cancelButton.setEnabled(False)
+        self.cancelButton.setGeometry(QtCore.QRect(656, 475, 93, 28))
+        self.cancelButton.setObjectName("cancelButton")
+        self.statusLabel = QtWidgets.QLabel(Dialog)
+        self.statusLabel.setGeometry(QtCore.QRect(11, 526, 535, 20))
+        self.statusLabel.setText("")
+        self.statusLabel.setObjectName("statusLabel")
 
         self.retranslateUi(Dialog)
-        self.buttonBox.accepted.connect(Dialog.accept)
         self.buttonBox.rejected.connect(Dialog.reject)
         QtCore.QMetaObject.connectSlotsByName(Dialog)
 
@@ -34,3 +48,4 @@ class Ui_Dialog(object):
         _translate = QtCore.QCoreApplication.translate
         Dialog.setWindowTitle(_translate("Dialog", "Dialog"))
         self.pushButton.setText(_translate("Dialog", "Open File"))
+        self.cancelButton.setText(_translate("Dialog", "Stop"))
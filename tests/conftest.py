@@ -0,0 +1,13 @@
+# Shared setup of the tests, run them all from the repository root with
+#
+#   python -m pytest tests
+#
+# The pyduct modules live in the repository root, next to this directory; the
+# tests import ROOT and SAMPLE (the sample input shipped with pyduct) from here.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, 'Duct Design Sample Input.txt')
+
+sys.path.insert(0, ROOT)
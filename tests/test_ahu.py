@@ -0,0 +1,101 @@
+# Tests of networks with several air handlers, sized in this process and across a pool.
+#
+# Each air handler's tree must size exactly as a file holding only that tree,
+# and a tree that fails in a worker must fail as it does in this process.
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import pyduct
+import pyduct_instrument
+from conftest import ROOT
+from pyduct_ahu import size_air_handlers
+from pyduct_friction import SolverError
+from pyduct_network import NetworkError
+
+
+FIRST = """fitting, 1, air_handling_unit
+fitting, 2, duct, 1, 30
+fitting, 3, tee, 2
+fitting, 4, duct, 3-main, 20
+fitting, 5, diffuser, 4, 300
+fitting, 6, elbow, 3-branch
+fitting, 7, duct, 6, 40
+fitting, 8, diffuser, 7, 150
+"""
+
+SECOND = """fitting, 101, air_handling_unit
+fitting, 102, duct, 101, 50
+fitting, 103, tee, 102
+fitting, 104, duct, 103-main, 25
+fitting, 105, diffuser, 104, 400
+fitting, 106, duct, 103-branch, 10
+fitting, 107, diffuser, 106, 250
+"""
+
+SETTINGS = """fan_pressure, 0.6
+air_density, 0.075
+roughness, 0.0003
+rounding, none
+"""
+
+
+def sized(text, workers=1):
+    ducts = pyduct.process_keywords(text.splitlines(True))
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    convergence = pyduct.sizing_iterate_nick(ducts, workers=workers)
+    return ducts['network'], convergence
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_trees_size_as_files_of_their_own(workers):
+    network, convergence = sized(SETTINGS + 'fan_pressure, 0.9, 101\n' + FIRST + SECOND, workers)
+    assert [(c['ID'], c['fan_pressure']) for c in convergence['air_handlers']] == [(1, 0.6), (101, 0.9)]
+    for tree, fan_pressure in ((FIRST, '0.6'), (SECOND, '0.9')):
+        alone = sized(SETTINGS.replace('0.6', fan_pressure) + tree)[0]
+        rows = [network.position[ID] for ID in alone.ID.tolist()]
+        for key in ('flow', 'size', 'pdrop', 'diffuser_psum'):
+            np.testing.assert_allclose(getattr(network, key)[rows], getattr(alone, key), rtol=1e-12, err_msg=key)
+
+
+def test_worker_counters_are_added_up():
+    counts = []
+    for workers in (1, 2):
+        ducts = pyduct.process_keywords((SETTINGS + FIRST + SECOND).splitlines(True))
+        pyduct.setup_flowrates(ducts['network'])
+        pyduct.setup_fan_distances(ducts['network'])
+        with pyduct_instrument.recording() as instrumentation:
+            size_air_handlers(ducts, workers)
+        counts.append(instrumentation.counts)
+        assert [c['ID'] for c in instrumentation.convergence['air_handlers']] == [1, 101]
+    assert counts[0] == counts[1] and counts[0]['size_ducts.calls'] > 0
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_worker_errors_are_those_of_this_process(workers):
+    with pytest.raises(SolverError) as error:
+        sized(SETTINGS + 'fan_pressure, -0.5, 101\n' + FIRST + SECOND, workers)
+    assert str(error.value) == 'size_network has no pressure for the ducts, fan pressure -0.5 in. wg'
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_command_line_reports_a_failed_tree(tmp_path, jobs):
+    # run as python -m pyduct, where pyduct is imported a second time by pyduct_ahu
+    bad = tmp_path / 'multi_bad.txt'
+    bad.write_text(SETTINGS + 'fan_pressure, -0.5, 101\n' + FIRST + SECOND)
+    finished = subprocess.run([sys.executable, '-m', 'pyduct', str(bad), '-q', '-o', str(tmp_path / 'out.txt'),
+                               '-j', jobs], cwd=ROOT, capture_output=True, text=True)
+    assert finished.returncode == 1
+    assert finished.stderr == 'pyduct: size_network has no pressure for the ducts, fan pressure -0.5 in. wg\n'
+
+
+def test_every_air_handler_needs_a_fan_pressure():
+    settings = SETTINGS.replace('fan_pressure, 0.6\n', 'fan_pressure, 0.9, 101\nfan_pressure, 1.0, 7\n')
+    with pytest.raises(NetworkError) as error:
+        sized(settings + FIRST + SECOND)
+    assert error.value.problems == ['fan pressure given for 7, which is not an air handler',
+                                    'no fan pressure for air handler 1']
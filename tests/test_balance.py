@@ -0,0 +1,79 @@
+# Tests of the flow balancing simulation for fixed duct sizes.
+#
+# On the design sizes the dampers set from the design pressures must deliver the
+# design flows; rounded sizes must not.
+
+import numpy as np
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct_balance import balance_flows, design_terminals
+from pyduct_balance import main as balance_main
+from pyduct_network import DIFFUSER
+
+DENSITY = 0.075
+ROUGHNESS = 0.0003
+
+# the critical diffuser sits right on a tee port, so its damper has no resistance
+TEE_PORTS = """fan_pressure, 1.0
+air_density, 0.075
+roughness, 0.0003
+rounding, none
+fitting, 1, air_handling_unit
+fitting, 2, duct, 1, 50
+fitting, 3, tee, 2
+fitting, 4, diffuser, 3-main, 200
+fitting, 5, diffuser, 3-branch, 100
+"""
+
+
+def sized(lines, rounding=None):
+    ducts = pyduct.process_keywords(lines)
+    if rounding is not None:
+        ducts['rounding'] = rounding
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    pyduct.sizing_iterate_nick(ducts)
+    return ducts
+
+
+def sample_lines():
+    with open(SAMPLE) as file:
+        return file.readlines()
+
+
+def test_balance_design_sizes_give_design_flows():
+    ducts = sized(sample_lines())
+    network = ducts['network']
+    result = balance_flows(network, DENSITY, ROUGHNESS, ducts['fan_pressure'])
+    diffusers = network.type == DIFFUSER
+    np.testing.assert_allclose(result['network'].flow[diffusers], network.flow[diffusers], rtol=1e-9)
+
+
+def test_balance_diffuser_on_tee_port():
+    ducts = sized(TEE_PORTS.splitlines(True))
+    network = ducts['network']
+    assert np.nanmin(design_terminals(network, 1.0)) == 0.0
+    result = balance_flows(network, DENSITY, ROUGHNESS, 1.0)
+    diffusers = network.type == DIFFUSER
+    np.testing.assert_allclose(result['network'].flow[diffusers], [200.0, 100.0], rtol=1e-9)
+
+    # a damper on one port only: the other, without resistance, takes all of the flow
+    terminals = design_terminals(network, 1.0)
+    terminals[network.position[5]] = 1e-6
+    flow = balance_flows(network, DENSITY, ROUGHNESS, 1.0, terminals=terminals)['network'].flow
+    assert flow[network.position[5]] == 0.0
+    assert flow[network.position[4]] == pytest.approx(flow[network.position[1]])
+
+
+@pytest.mark.parametrize('rounding', ['up', 'optimal'])
+def test_balance_dampers_set_before_rounding(rounding, capsys):
+    # rounded sizes deliver other flows than the design, whatever the rounding mode
+    assert balance_main([SAMPLE, '--rounding', rounding]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    changes = [float(line.split()[-1].rstrip('%')) for line in lines[lines.index(next(
+        line for line in lines if line.split()[:1] == ['diffuser'])) + 1:]]
+    assert len(changes) == 5
+    assert max(abs(change) for change in changes) > 5.0
+
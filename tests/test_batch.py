@@ -0,0 +1,66 @@
+# Tests of the headless batch runner.
+
+import multiprocessing
+import os
+import shutil
+
+import pytest
+
+import pyduct
+import pyduct_batch
+from conftest import SAMPLE
+from pyduct_batch import find_inputs, main, result_names, run_batch
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    # the sample twice under the same name, and a file with a bad fitting line
+    zones = tmp_path / 'zones'
+    (zones / 'west').mkdir(parents=True)
+    shutil.copy(SAMPLE, str(zones / 'zone.txt'))
+    shutil.copy(SAMPLE, str(zones / 'west' / 'zone.txt'))
+    with open(SAMPLE) as file:
+        text = file.read()
+    (zones / 'bad.txt').write_text(text.replace('fitting,  10,  Duct', 'fitting,  10,  Pipe'))
+    return [str(zones), str(zones / 'west' / 'zone.txt')]
+
+
+def test_names_and_inputs(inputs):
+    filenames = find_inputs(inputs)
+    assert [os.path.basename(name) for name in filenames] == ['bad.txt', 'zone.txt', 'zone.txt']
+    assert [os.path.basename(name) for name in result_names(filenames, 'out')] == ['bad', 'zone', 'zone_2']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_keeps_going_past_a_bad_input(inputs, tmp_path, workers):
+    output = str(tmp_path / 'results')
+    jobs = run_batch(find_inputs(inputs), output, workers=workers, result_format='csv')
+    assert [job['ok'] for job in jobs] == [False, True, True]
+    with open(jobs[0]['output']) as file:
+        assert "unknown fitting type 'Pipe'" in file.read()
+    with open(jobs[1]['output']) as first, open(jobs[2]['output']) as second:
+        assert first.read() == second.read()
+    assert sorted(os.listdir(output)) == ['bad_error.txt', 'zone_2_result.csv', 'zone_result.csv']
+
+
+def test_command_line_fails_when_any_input_fails(inputs, tmp_path, capsys):
+    assert main(inputs[1:] + ['-o', str(tmp_path / 'one'), '-j', '1']) == 0
+    assert main(inputs + ['-o', str(tmp_path / 'all'), '-j', '1']) == 1
+    assert capsys.readouterr().out.splitlines()[-1] == '2 of 3 inputs sized'
+
+
+def test_a_dying_worker_fails_only_its_own_input(inputs, tmp_path, monkeypatch):
+    # the forked workers inherit the patched calculate, which kills the worker sizing bad.txt
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip('needs forked workers')
+
+    def calculate(filename, *args, **kwargs):
+        if filename.endswith('bad.txt'):
+            os._exit(1)
+        return pyduct.calculate(filename, *args, **kwargs)
+
+    monkeypatch.setattr(pyduct_batch, 'calculate', calculate)
+    jobs = run_batch(find_inputs(inputs), str(tmp_path / 'results'), workers=2, result_format='csv')
+    assert [job['ok'] for job in jobs] == [False, True, True]
+    with open(jobs[0]['output']) as file:
+        assert file.read() == 'the worker process sizing %s died\n' % jobs[0]['input']
@@ -0,0 +1,70 @@
+# Tests of the on-disk compiled network cache.
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import pyduct_cache
+from conftest import SAMPLE
+from pyduct import InputError
+from pyduct_cache import clear_cache, compile_ducts, input_key, load_cached, load_ducts
+
+
+@pytest.fixture
+def sample(tmp_path):
+    path = str(tmp_path / 'zone.txt')
+    shutil.copy(SAMPLE, path)
+    return path
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    # the inputs compiled instead of loaded from the cache
+    compiled = []
+
+    def compile_and_count(filename):
+        compiled.append(filename)
+        return compile_ducts(filename)
+
+    monkeypatch.setattr(pyduct_cache, 'compile_ducts', compile_and_count)
+    return compiled
+
+
+def test_second_load_comes_from_the_cache(sample, tmp_path, compiles):
+    cache_dir = str(tmp_path / 'cache')
+    first = load_ducts(sample, cache_dir)
+    second = load_ducts(sample, cache_dir)
+    assert compiles == [sample]
+    assert os.listdir(cache_dir) == [input_key(sample) + '.npz']
+    assert [dict(view) for view in second['fittings']] == [dict(view) for view in first['fittings']]
+    for key in pyduct_cache.SETTING_KEYS:
+        assert second[key] == first[key]
+    np.testing.assert_array_equal(second['network'].order, first['network'].order)
+
+
+def test_changed_input_misses(sample, tmp_path, compiles):
+    cache_dir = str(tmp_path / 'cache')
+    load_ducts(sample, cache_dir)
+    with open(sample, 'a') as file:
+        file.write('fitting, 25, Duct, 23-nothing, 5\n')
+    with pytest.raises(InputError):
+        load_ducts(sample, cache_dir)
+    assert len(compiles) == 2
+    assert len(os.listdir(cache_dir)) == 1  # bad inputs are never cached
+    assert clear_cache(cache_dir) == 1 and os.listdir(cache_dir) == []
+
+
+def test_entries_of_other_compiler_code_are_not_used(sample, tmp_path, monkeypatch, compiles):
+    cache_dir = str(tmp_path / 'cache')
+    load_ducts(sample, cache_dir)
+    path = os.path.join(cache_dir, input_key(sample) + '.npz')
+    assert load_cached(path) is not None
+
+    # the parser or validation changed since the entry was saved
+    monkeypatch.setattr(pyduct_cache, '_compiler_digest', 'edited')
+    assert load_cached(path) is None
+    assert input_key(sample) + '.npz' != os.path.basename(path)
+    load_ducts(sample, cache_dir)
+    assert len(compiles) == 2
@@ -0,0 +1,56 @@
+# Tests of the headless python -m pyduct entry point.
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+import pyduct
+from conftest import ROOT, SAMPLE
+
+
+def run(*args):
+    return subprocess.run([sys.executable, '-m', 'pyduct'] + list(args), cwd=ROOT, capture_output=True,
+                          text=True)
+
+
+def test_results_to_standard_output(tmp_path, capsys):
+    stats = str(tmp_path / 'stats.json')
+    assert pyduct.main([SAMPLE, '-o', '-', '-f', 'csv', '--stats', stats]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'ID,type,velocity,flow,pdrop,size,diffuser_psum' and len(lines) == 23
+    with open(stats) as file:
+        assert 'sizing' in json.load(file)['stages']
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_bad_input_gives_a_message_not_a_traceback(tmp_path, cached):
+    # with --cache the input is read by pyduct_cache, through the imported pyduct module
+    with open(SAMPLE) as file:
+        text = file.read()
+    bad = tmp_path / 'bad.txt'
+    bad.write_text(text.replace('fitting,  10,  Duct', 'fitting,  10,  Pipe'))
+    cache = ['--cache', str(tmp_path / 'cache')] if cached else []
+    finished = run(str(bad), '-q', '-o', str(tmp_path / 'out.txt'), *cache)
+    assert finished.returncode == 1
+    assert finished.stderr == "pyduct: line 33: unknown fitting type 'Pipe'\n"
+
+
+def test_import_stays_light():
+    # the optional modules are only imported when a run asks for them
+    code = ('import sys, pyduct; print(sorted(m for m in sys.modules if m.split(".")[0] in '
+            '("scipy", "PyQt5", "pyduct_cache", "pyduct_ahu", "pyduct_optimize", "argparse", "json", "csv")))')
+    finished = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    assert finished.stdout == '[]\n'
+
+
+@pytest.mark.parametrize('setting', ['fan_pressure', 'air_density', 'roughness'])
+def test_missing_setting_gives_a_message(tmp_path, setting):
+    with open(SAMPLE) as file:
+        lines = [line for line in file if not line.startswith(setting + ',')]
+    bad = tmp_path / 'bad.txt'
+    bad.write_text(''.join(lines))
+    finished = run(str(bad), '-q', '-o', str(tmp_path / 'out.txt'))
+    assert finished.returncode == 1
+    assert finished.stderr == 'pyduct: no %s given\n' % setting
@@ -0,0 +1,66 @@
+# Tests of the ASHRAE loss tables against the scalar interpolation they replaced.
+
+import random
+
+import numpy as np
+import pytest
+
+import pyduct
+from pyduct_fittings import PLEATED_ELBOW_90, SD5_10_BRANCH, SD5_10_MAIN, Table1D, loss_coefficient
+
+
+def old_interp1D(x, xlist, ylist):
+    # findBetween and interp1D as pyduct had them
+    for position in range(len(xlist) - 1):
+        if xlist[position] <= x <= xlist[position + 1] or xlist[position] >= x >= xlist[position + 1]:
+            break
+    x1, x3 = xlist[position], xlist[position + 1]
+    y1, y3 = ylist[position], ylist[position + 1]
+    return (x - x1) * (y3 - y1) / (x3 - x1) + y1
+
+
+def old_interp2D(x, y, xlist, ylist, zmatrix):
+    for yposition in range(len(ylist) - 1):
+        if ylist[yposition] <= y <= ylist[yposition + 1]:
+            break
+    x1 = old_interp1D(x, xlist, zmatrix[:, yposition])
+    x2 = old_interp1D(x, xlist, zmatrix[:, yposition + 1])
+    return old_interp1D(y, ylist[yposition:yposition + 2], [x1, x2])
+
+
+@pytest.mark.parametrize('table', [SD5_10_BRANCH, SD5_10_MAIN])
+def test_tee_tables_match_old_interpolation(table):
+    rnd = random.Random(0)
+    points = [(rnd.uniform(0.1, 0.9), rnd.uniform(0.1, 0.9)) for i in range(500)]
+    old = np.array([old_interp2D(x, y, table.x, table.y, table.c) for x, y in points])
+    x, y = np.transpose(points)
+    np.testing.assert_allclose(table(x, y), old, rtol=1e-14, atol=1e-14)
+    assert table(*points[0]) == pytest.approx(old[0], rel=1e-14)
+    assert table(0.3, 0.7) == table.c[2, 6]
+
+
+def test_tables_clamp_to_their_edges():
+    assert SD5_10_BRANCH(0.01, 2.0) == SD5_10_BRANCH.c[0, -1]
+    assert SD5_10_MAIN(5.0, 0.0) == SD5_10_MAIN.c[-1, 0]
+    np.testing.assert_array_equal(PLEATED_ELBOW_90(np.array([2.0, 4.0, 16.0, 40.0])), [0.57, 0.57, 0.25, 0.25])
+    assert PLEATED_ELBOW_90(7.0) == pytest.approx(old_interp1D(7.0, PLEATED_ELBOW_90.x, PLEATED_ELBOW_90.c))
+
+
+def test_tables_by_name_and_slopes():
+    assert loss_coefficient('pleated_elbow_90', 9.0) == PLEATED_ELBOW_90(9.0)
+    assert loss_coefficient('sd5_10_main', 0.45, 0.55) == SD5_10_MAIN(0.45, 0.55)
+    table = Table1D([0, 1, 3], [0, 2, 3])
+    np.testing.assert_array_equal(table.slope(np.array([-1.0, 0.5, 1.0, 2.0, 3.0])), [0, 2, 0.5, 0.5, 0])
+
+
+def test_batched_tee_losses_match_one_at_a_time():
+    rnd = random.Random(1)
+    dia = np.array([rnd.uniform(6, 30) for i in range(50)])
+    outlet = dia * np.array([rnd.uniform(0.3, 1.0) for i in range(50)])
+    flow = np.array([rnd.uniform(500, 5000) for i in range(50)])
+    outlet_flow = flow * np.array([rnd.uniform(0.1, 0.9) for i in range(50)])
+    for branch in (False, True):
+        batch = pyduct.tee_pressure_drop(dia, 0.075, flow, outlet_flow, outlet, branch)
+        single = [pyduct.tee_pressure_drop(*args, branch=branch) for args in
+                  zip(dia, [0.075] * 50, flow, outlet_flow, outlet)]
+        np.testing.assert_allclose(batch, single, rtol=1e-15)
@@ -0,0 +1,120 @@
+# Tests of the friction factor and duct size solvers, their caches and how they give up.
+#
+# get_little_f and get_duct_size must answer exactly as the uncached solvers do,
+# whatever was asked before, and colebrook_f as the scipy fsolve code it
+# replaced (skipped without scipy).
+
+import math
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+import pyduct
+from pyduct_friction import SolveCache, SolverError, colebrook_f, duct_size_cache, friction_cache, size_ducts
+
+DENSITY = 0.075
+ROUGHNESS = 0.0003
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    friction_cache.clear()
+    duct_size_cache.clear()
+    yield
+    friction_cache.clear()
+    duct_size_cache.clear()
+
+
+def test_key_keeps_reciprocals_and_signs_apart():
+    cache = SolveCache()
+    # these two used to share a bucket, the sign was folded into it
+    assert cache.key(0.49999999995325944) != cache.key(1.9999999981869623)
+    assert cache.key(2.0) != cache.key(-2.0) != cache.key(0.5)
+    assert cache.key(0.0) != cache.key(1.0)
+    assert cache.key(1.0) == cache.key(1.0 + 1e-12)
+    assert SolveCache(rtol=0).key(1.0, 2.0) == (1.0, 2.0)
+
+
+def test_cached_duct_size_is_never_stale():
+    for dpdl in (0.49999999995325944, 1.9999999981869623, 0.25, 4.0):
+        expected = size_ducts(300.0, dpdl, DENSITY, ROUGHNESS)
+        assert pyduct.get_duct_size(dpdl * 10, 300.0, 10, DENSITY, ROUGHNESS) == expected
+    assert duct_size_cache.misses == 4
+    assert pyduct.get_duct_size(40.0, 300.0, 10, DENSITY, ROUGHNESS) == size_ducts(300.0, 4.0, DENSITY, ROUGHNESS)
+    assert duct_size_cache.hits == 1
+
+
+def test_cached_friction_factor():
+    f = pyduct.get_little_f(12.0, 1500.0, ROUGHNESS)
+    assert f == colebrook_f(12.0, 1500.0, ROUGHNESS)
+    assert pyduct.get_little_f(12.0, 1500.0, ROUGHNESS) == f
+    assert (friction_cache.hits, friction_cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_goes_first():
+    cache = SolveCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c'), len(cache)) == (1, 3, 2)
+    disabled = SolveCache(maxsize=0)
+    disabled.put('a', 1)
+    assert len(disabled) == 0
+
+
+def test_solvers_give_up_with_a_solver_error():
+    with pytest.raises(SolverError) as error:
+        colebrook_f([12.0, 0.0], 1500.0, ROUGHNESS)
+    assert error.value.solver == 'colebrook_f' and 'did not converge for 1 of 2 ducts' in error.value.detail
+    with pytest.raises(SolverError) as error:
+        size_ducts([300.0, -1.0], 0.1, DENSITY, ROUGHNESS)
+    assert error.value.info()['detail'] == 'needs positive flows and pressure drops, got -1 cfm at 0.1 in. wg/ft'
+    with pytest.raises(SolverError) as error:
+        size_ducts(300.0, 0.1, DENSITY, ROUGHNESS, maxiter=1)
+    assert error.value.iterations == 1 and error.value.residual > 0
+    with pytest.raises(SolverError):
+        size_ducts(300.0, 0.1, DENSITY, ROUGHNESS, budget=0)
+
+
+def test_solver_error_pickles():
+    error = SolverError('size_network', 'did not converge', 12, 0.25, 1.5)
+    copy = pickle.loads(pickle.dumps(error))
+    assert copy.info() == error.info() and str(copy) == str(error)
+    copy = pickle.loads(pickle.dumps(SolverError('colebrook_f', 'bad input')))
+    assert math.isnan(copy.residual) and str(copy) == 'colebrook_f bad input'
+
+
+def random_ducts(count, seed=0):
+    rnd = random.Random(seed)
+    dia = np.array([rnd.uniform(3, 48) for i in range(count)])
+    velocity = np.array([rnd.uniform(200, 4000) for i in range(count)])
+    roughness = np.array([rnd.choice((0.00003, 0.0003, 0.003)) for i in range(count)])
+    return dia, velocity, roughness
+
+
+def fsolve_little_f(dia, velocity, roughness):
+    # the friction factor as pyduct solved it before colebrook_f
+    from scipy.optimize import fsolve
+
+    def func(f):
+        Re = 8.5 * (dia / 12) * velocity
+        with np.errstate(invalid='ignore'):  # fsolve tries negative f on its way
+            return -2 * np.log10((roughness / (3.7 * (dia / 12))) + (2.51 / (Re * np.sqrt(f)))) - 1 / np.sqrt(f)
+
+    guess = 10
+    while True:
+        f = fsolve(func, guess, full_output=True)
+        if int(f[2]) == 1:
+            return f[0][0]
+        guess = guess / 2.0
+
+
+def test_colebrook_matches_fsolve():
+    pytest.importorskip('scipy.optimize')
+    dia, velocity, roughness = random_ducts(300)
+    old = np.array([fsolve_little_f(*duct) for duct in zip(dia, velocity, roughness)])
+    assert np.max(np.abs(colebrook_f(dia, velocity, roughness) / old - 1)) < 1e-13
\ No newline at end of file
@@ -0,0 +1,45 @@
+# Tests of the synthetic network generator and the stage benchmark.
+
+import pytest
+
+import pyduct
+from pyduct_bench import STAGES, benchmark, format_records
+from pyduct_generate import TOPOLOGIES, generate
+from pyduct_network import DIFFUSER
+
+
+def depth(network):
+    # most fittings on any route from the fan
+    return max(len(network.route_rows(i)) for i in range(len(network.ID)) if network.type[i] == DIFFUSER)
+
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_generated_networks_are_valid(topology):
+    lines = generate(topology, 500, seed=2)
+    assert lines == generate(topology, 500, seed=2)
+    ducts = pyduct.process_keywords(lines)
+    network = ducts['network']
+    network.validate()
+    assert 490 <= len(network.ID) <= 500
+    assert ducts['rounding'] == 'nearest' and ducts['fan_pressure'] > 0.1
+    pyduct.setup_flowrates(network)
+    pyduct.setup_fan_distances(network)
+    assert pyduct.sizing_iterate_nick(ducts)['converged']
+
+
+def test_topologies_differ_in_depth():
+    depths = dict((topology, depth(pyduct.process_keywords(generate(topology, 1000))['network']))
+                  for topology in ('balanced', 'chain'))
+    assert depths['chain'] > 10 * depths['balanced']
+    with pytest.raises(ValueError):
+        generate('star', 100)
+
+
+def test_benchmark_times_every_stage(tmp_path):
+    records = benchmark(['balanced', 'chain'], [50, 200], repeat=1, workdir=str(tmp_path))
+    assert [(record['topology'], record['size']) for record in records] == [
+        ('balanced', 50), ('balanced', 200), ('chain', 50), ('chain', 200)]
+    for record in records:
+        assert all(record[stage] >= 0 for stage in STAGES)
+        assert record['total'] == pytest.approx(sum(record[stage] for stage in STAGES))
+    assert len(format_records(records).splitlines()) == 2 + len(records)
@@ -0,0 +1,77 @@
+# Tests of the GUI's background calculation, skipped without PyQt5.
+#
+# Qt runs on its offscreen platform, no display is needed.
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip('PyQt5.QtWidgets')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication  # after the skip, main needs PyQt5 too
+
+import main
+from conftest import SAMPLE
+from pyduct import CALCULATE_STAGES
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # calculate writes pyductresult.txt here
+    return QApplication.instance() or QApplication([])
+
+
+def signals(worker):
+    # every signal the worker emits, in order
+    emitted = []
+    worker.stage.connect(lambda stage: emitted.append(('stage', stage)))
+    worker.iteration.connect(lambda *info: emitted.append(('iteration',) + info))
+    worker.finished_ok.connect(lambda ducts: emitted.append(('finished_ok', ducts)))
+    worker.failed.connect(lambda message: emitted.append(('failed', message)))
+    worker.cancelled.connect(lambda: emitted.append(('cancelled',)))
+    return emitted
+
+
+def test_worker_reports_every_stage_and_pass(app):
+    worker = main.CalculateThread(SAMPLE)
+    emitted = signals(worker)
+    worker.run()  # in this thread, so every signal arrives directly
+    stages = [item[1] for item in emitted if item[0] == 'stage']
+    assert stages == list(CALCULATE_STAGES)
+    passes = [item[1] for item in emitted if item[0] == 'iteration']
+    assert passes == list(range(1, len(passes) + 1)) and passes
+    assert emitted[-1][0] == 'finished_ok'
+    model = main.ResultsModel(emitted[-1][1]['network'])
+    assert (model.rowCount(), model.columnCount()) == (22, 7)
+    assert model.data(model.index(0, 1)) == 'air_handling_unit'
+    assert model.data(model.index(0, 6)) == ''
+
+
+def test_worker_stops_and_fails_cleanly(app, tmp_path):
+    worker = main.CalculateThread(SAMPLE)
+    emitted = signals(worker)
+    worker.cancel()
+    worker.run()
+    assert emitted == [('cancelled',)]
+
+    worker = main.CalculateThread(str(tmp_path / 'missing.txt'))
+    emitted = signals(worker)
+    worker.run()
+    assert emitted[-1][0] == 'failed' and 'missing.txt' in emitted[-1][1]
+
+
+def test_dialog_stays_responsive_while_sizing(app):
+    window = main.main_window()
+    window.ui.lineEdit.setText(SAMPLE)
+    window.runPyduct()
+    assert window.worker is not None
+    deadline = time.time() + 30
+    while window.worker is not None and time.time() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    assert window.worker is None
+    assert window.ui.tableView.model().rowCount() == 22
+    assert window.ui.statusLabel.text().startswith('22 fittings sized')
+    window.close()
@@ -0,0 +1,47 @@
+# Tests of the opt-in solver instrumentation.
+
+import io
+import json
+
+import pyduct
+import pyduct_instrument
+from conftest import SAMPLE
+from pyduct_instrument import Instrumentation
+
+
+def calculate(**options):
+    return pyduct.calculate(SAMPLE, io.StringIO(), echo=False, **options)
+
+
+def test_nothing_is_recorded_unless_asked():
+    ducts = calculate()
+    assert 'instrumentation' not in ducts
+    assert pyduct_instrument.current is None
+
+
+def test_stages_counts_and_convergence():
+    ducts = calculate(instrument=True)
+    instrumentation = ducts['instrumentation']
+    assert list(instrumentation.stages) == ['parse', 'flows', 'fan_distances', 'sizing', 'output']
+    counts = instrumentation.counts
+    passes = counts['size_network.passes']
+    assert counts['size_ducts.calls'] == passes and counts['size_ducts.ducts'] == 10 * passes
+    assert counts['colebrook_f.ducts'] >= counts['colebrook_f.calls'] > 0
+    # the batched sizing never goes through the scalar solve caches, so there is nothing of theirs to report
+    assert not [name for name in counts if 'cache' in name]
+    assert instrumentation.convergence['iterations'] == passes
+    assert instrumentation.convergence['converged'] is True
+    assert pyduct_instrument.current is None
+
+    exported = json.loads(instrumentation.to_json())
+    assert exported['counts'] == dict(sorted(counts.items()))
+    assert exported['total'] == sum(instrumentation.stages.values())
+
+
+def test_runs_add_up_in_one_instrumentation():
+    instrumentation = Instrumentation()
+    calculate(instrument=instrumentation)
+    once = dict(instrumentation.counts)
+    ducts = calculate(instrument=instrumentation)
+    assert ducts['instrumentation'] is instrumentation
+    assert instrumentation.counts['size_network.passes'] == 2 * once['size_network.passes']
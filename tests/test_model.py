@@ -0,0 +1,40 @@
+# Tests of the incremental re-solve model for edited networks.
+#
+# Every edit followed by solve must give what a full re-solve of the edited
+# input gives.
+
+import numpy as np
+import pytest
+
+import pyduct
+from pyduct_generate import generate
+from pyduct_model import DuctModel
+from pyduct_network import DIFFUSER, DUCT
+
+
+@pytest.mark.parametrize('rounding', ['none', 'up'])
+def test_model_matches_full_resolve(rounding):
+    lines = generate('random', 300, seed=3, rounding=rounding)
+    model = DuctModel(pyduct.process_keywords(lines))
+    network = model.network
+    diffuser = int(network.ID[network.type == DIFFUSER][7])
+    duct = int(network.ID[network.type == DUCT][11])
+    length = float(network.length[network.position[duct]]) + 37
+    model.set_flow(diffuser, 333.0)
+    model.solve()
+    model.set_length(duct, length)
+    model.solve()
+    model.set_fan_pressure(1.3)
+    model.solve()
+    results = model.results().network
+
+    full = pyduct.process_keywords(lines)
+    full['fan_pressure'] = 1.3
+    full['network'].flow[full['network'].position[diffuser]] = 333.0
+    full['network'].length[full['network'].position[duct]] = length
+    pyduct.setup_flowrates(full['network'])
+    pyduct.setup_fan_distances(full['network'])
+    pyduct.sizing_iterate_nick(full)
+    for key in ('flow', 'fandist', 'size', 'pdrop', 'pdropMain', 'pdropBranch', 'diffuser_psum'):
+        np.testing.assert_allclose(getattr(results, key), getattr(full['network'], key), rtol=1e-7, atol=1e-12,
+                                   err_msg=key)
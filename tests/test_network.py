@@ -0,0 +1,198 @@
+# Tests of the indexed duct network: lookups, connections and topology passes.
+#
+# The ID lookups and routes are checked against plain linear scans of the
+# fitting dicts, as find_fitting did them.
+
+import pickle
+
+import numpy as np
+import pytest
+
+import pyduct
+from pyduct_network import AHU, DIFFUSER, DUCT, DuctNetwork, NetworkError
+
+# two tees, an elbow and the fittings listed out of order
+SMALL = """fan_pressure, 0.6
+air_density, 0.075
+roughness, 0.0003
+fitting, 1, air_handling_unit
+fitting, 2, duct, 1, 30
+fitting, 3, tee, 2
+fitting, 7, duct, 4-branch, 15
+fitting, 4, tee, 3-main
+fitting, 5, duct, 4-main, 20
+fitting, 6, diffuser, 5, 300
+fitting, 8, elbow, 7
+fitting, 9, diffuser, 8, 200
+fitting, 10, elbow, 3-branch
+fitting, 11, duct, 10, 40
+fitting, 12, diffuser, 11, 150
+"""
+
+# every kind of problem the parser lets through, and a loop the routes must not walk
+BROKEN = """fan_pressure, 0.6
+fitting, 1, air_handling_unit
+fitting, 2, duct, 1, 0
+fitting, 3, tee, 2
+fitting, 4, diffuser, 3-main, 0
+fitting, 5, duct, 99, 10
+fitting, 6, diffuser, 5, 100
+fitting, 7, elbow, 8
+fitting, 8, elbow, 7
+fitting, 9, diffuser, 8, 100
+"""
+
+
+def small_ducts():
+    return pyduct.process_keywords(SMALL.splitlines(True))
+
+
+def scan_path(ID, fittings):
+    # IDs from the fitting back to its air handler by linear search
+    path = [ID]
+    while pyduct.find_fitting(path[-1], fittings)['IDup'] is not None:
+        path.append(pyduct.find_fitting(path[-1], fittings)['IDup'])
+    return path
+
+
+def test_lookups_match_linear_scan():
+    network = small_ducts()['network']
+    fittings = [dict(view) for view in network.fittings]
+    for fitting in fittings:
+        ID = fitting['ID']
+        assert dict(network.index[ID]) == pyduct.find_fitting(ID, fittings)
+        assert network.fittings[network.position[ID]]['ID'] == ID
+        if fitting['IDup'] is not None:
+            assert network.up[ID]['ID'] == fitting['IDup']
+        for key, lookup in (('IDdownMain', network.down_main), ('IDdownBranch', network.down_branch)):
+            below = [f['ID'] for f in fittings if f['IDup'] == ID and
+                     (f['BranchUP'] == 'branch') == (key == 'IDdownBranch')]
+            assert fitting[key] == (below[0] if below else None)
+            assert (lookup[ID]['ID'] if ID in lookup else None) == fitting[key]
+        assert network.path_to_fan(ID) == scan_path(ID, fittings)
+
+
+def test_order_puts_upstream_fittings_first():
+    network = small_ducts()['network']
+    order = network.order.tolist()
+    assert sorted(order) == list(range(len(network.ID)))
+    seen = set()
+    for i in order:
+        assert network.parent[i] < 0 or network.parent[i] in seen
+        seen.add(i)
+    assert sorted(view['ID'] for view in network.subtree(4)) == [4, 5, 6, 7, 8, 9]
+
+
+def test_make_connections_of_fitting_dicts():
+    fittings = [dict(view) for view in small_ducts()['fittings']]
+    for fitting in fittings:
+        fitting['IDdownMain'] = fitting['IDdownBranch'] = None
+    network = pyduct.make_connections(fittings)
+    assert isinstance(network, DuctNetwork)
+    by_ID = dict((fitting['ID'], fitting) for fitting in fittings)
+    assert (by_ID[3]['IDdownMain'], by_ID[3]['IDdownBranch']) == (4, 10)
+    assert (by_ID[4]['IDdownMain'], by_ID[4]['IDdownBranch']) == (5, 7)
+    assert by_ID[12]['IDdownMain'] is None
+    pyduct.setup_fan_distances(network)
+    assert network.index[9]['fandist'] == 45
+    assert pyduct.largest_path(network)['ID'] == 12
+
+
+def test_the_original_call_sequence_on_fittings():
+    # what calculate did before the network arrays: every step given ducts['fittings']
+    sized = small_ducts()
+    pyduct.setup_flowrates(sized['network'])
+    pyduct.setup_fan_distances(sized['network'])
+    pyduct.sizing_iterate_nick(sized)
+    expected = [dict(view) for view in sized['fittings']]
+
+    ducts = small_ducts()
+    fittings = ducts['fittings']
+    pyduct.make_connections(fittings)
+    pyduct.setup_flowrates(fittings)
+    pyduct.setup_fan_distances(fittings)
+    assert pyduct.largest_path(fittings)['ID'] == 12
+    pyduct.sizing_iterate_nick(ducts)
+    assert [dict(view) for view in fittings] == expected
+    assert pyduct.pressure_drop_sum(12, fittings) == pyduct.pressure_drop_sum(12, ducts['network'])
+    assert pyduct.fitting_loss_sum(fittings) == pyduct.fitting_loss_sum(ducts['network'])
+
+    # and on fitting dicts, which get the results written into them
+    fittings = [dict(view) for view in small_ducts()['fittings']]
+    ducts = dict(pyduct.new_duct_network(), fan_pressure=0.6, air_density=0.075, roughness=0.0003, fittings=fittings)
+    pyduct.make_connections(fittings)
+    pyduct.setup_flowrates(fittings)
+    pyduct.setup_fan_distances(fittings)
+    farthest = pyduct.largest_path(fittings)
+    assert farthest is fittings[-1] and farthest['fandist'] == 70
+    pyduct.sizing_iterate_nick(ducts)
+    assert fittings == expected
+    assert pyduct.fitting_loss_sum(fittings) == pyduct.fitting_loss_sum(sized['network'])
+
+
+def test_flows_add_up_from_the_diffusers():
+    network = small_ducts()['network']
+    pyduct.setup_flowrates(network)
+    flow = dict((view['ID'], view['flow']) for view in network.fittings)
+    assert (flow[1], flow[3], flow[4], flow[10]) == (650, 650, 500, 150)
+    assert (network.index[4]['flowMain'], network.index[4]['flowBranch']) == (300, 200)
+    assert (network.index[3]['flowMain'], network.index[3]['flowBranch']) == (500, 150)
+
+
+def test_network_error_pickles():
+    error = NetworkError(['air_handling_unit 1 has no duct', 'diffuser 9 has no flow rate'])
+    copy = pickle.loads(pickle.dumps(error))
+    assert copy.problems == error.problems
+    assert str(copy) == str(error) == 'air_handling_unit 1 has no duct; diffuser 9 has no flow rate'
+
+
+def test_validation_lists_every_problem():
+    network = pyduct.process_keywords(BROKEN.splitlines(True))['network']
+    with pytest.raises(NetworkError) as error:
+        pyduct.setup_flowrates(network)
+    assert error.value.problems == ['duct 5 connects to fitting 99, which does not exist',
+                                    'fittings 8, 7 form a loop',
+                                    'elbow 8 has 2 fittings on its main outlet',
+                                    'diffuser 6 is not connected to an air handling unit',
+                                    'diffuser 9 is not connected to an air handling unit',
+                                    'tee 3 has no fitting on its branch port',
+                                    'diffuser 4 has a flow rate of 0 cfm',
+                                    'duct 2 has a length of 0 ft']
+    with pytest.raises(NetworkError):
+        network.path_to_fan(9)
+
+    # the parser refuses duplicate IDs, a network built directly is checked for them too
+    network = DuctNetwork([1, 2, 2, 3], [AHU, DUCT, DUCT, DIFFUSER], [-1, 1, 1, 2], np.zeros(4, dtype=np.int64))
+    with pytest.raises(NetworkError) as error:
+        network.validate()
+    assert error.value.problems[0] == 'fitting ID 2 is used 2 times'
+    assert 'diffuser 3 has no flow rate' in error.value.problems
+
+
+def test_fitting_views_read_and_write_the_columns():
+    network = small_ducts()['network']
+    view = network.index[5]
+    assert dict(view) == dict(pyduct.new_fitting(), ID=5, type='duct', IDup=4, BranchUP='main', IDdownMain=6,
+                              length=20.0, fandist=0.0)
+    view['size'] = 9.5
+    assert network.size[network.position[5]] == 9.5
+    view['size'] = None
+    assert view['size'] is None
+    with pytest.raises(KeyError):
+        view['IDup'] = 3
+    assert view == network.fittings[5] and view != network.fittings[4]
+    assert [v['ID'] for v in network.fittings[-2:]] == [11, 12]
+
+
+def test_arrays_round_trip_and_copies():
+    network = small_ducts()['network']
+    pyduct.setup_flowrates(network)
+    loaded = DuctNetwork.from_arrays(network.arrays())
+    assert [dict(view) for view in loaded.fittings] == [dict(view) for view in network.fittings]
+    assert loaded.order.tolist() == network.order.tolist()
+    copy = network.copy()
+    copy.flow[:] = 0
+    assert network.index[1]['flow'] == 650
+    tree = network.select(network.subtree_rows(network.position[4]))
+    assert tree.ID.tolist() == [4, 5, 6, 7, 8, 9]
+    assert tree.parent[0] == -1 and tree.index[8]['IDdownMain'] == 9
@@ -0,0 +1,115 @@
+# Tests of the 'optimal' standard size selection.
+#
+# On a small network the chosen sizes must cost what the cheapest feasible
+# combination found by brute force costs, and every rounding mode must leave
+# the design pressures in diffuser_psum. A deep chain, where the rounding of
+# the losses to pressure steps adds up, must still get sizes that fit.
+
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct_balance import balance_flows
+from pyduct_generate import generate
+from pyduct_network import AHU, DIFFUSER, DUCT
+from pyduct_optimize import STANDARD_SIZES, _apply_sizes, _candidates, _follows, optimize_sizes
+
+DENSITY = 0.075
+ROUGHNESS = 0.0003
+
+SMALL = """fan_pressure, %s
+air_density, 0.075
+roughness, 0.0003
+fitting, 1, air_handling_unit
+fitting, 2, duct, 1, 30
+fitting, 3, tee, 2
+fitting, 4, tee, 3-main
+fitting, 5, duct, 4-main, 20
+fitting, 6, diffuser, 5, 300
+fitting, 7, duct, 4-branch, 15
+fitting, 8, elbow, 7
+fitting, 9, diffuser, 8, 200
+fitting, 10, elbow, 3-branch
+fitting, 11, duct, 10, 40
+fitting, 12, tee, 11
+fitting, 13, diffuser, 12-main, 150
+fitting, 14, duct, 12-branch, 10
+fitting, 15, diffuser, 14, 100
+"""
+
+
+def sized(lines, rounding=None):
+    ducts = pyduct.process_keywords(lines)
+    if rounding is not None:
+        ducts['rounding'] = rounding
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    pyduct.sizing_iterate_nick(ducts)
+    return ducts
+
+
+def sample_lines():
+    with open(SAMPLE) as file:
+        return file.readlines()
+
+
+@pytest.mark.parametrize('fan_pressure', [0.3, 0.5, 1.0])
+def test_optimal_matches_brute_force(fan_pressure):
+    ducts = pyduct.process_keywords((SMALL % fan_pressure).splitlines(True))
+    network = ducts['network']
+    pyduct.setup_flowrates(network)
+    pyduct.setup_fan_distances(network)
+    pyduct.size_network(ducts)
+    pyduct.diffuser_pressures(network)
+    trial = network.copy()
+    result = optimize_sizes(network, fan_pressure, DENSITY, ROUGHNESS, catalog=STANDARD_SIZES, bins=2000, smaller=2)
+
+    # every combination of the same candidate sizes, two below to one above each duct's continuous size
+    order = trial.order.tolist()
+    candidates = _candidates(trial, STANDARD_SIZES, 2, 1, order)
+    free = [i for i in range(len(trial.ID)) if trial.type[i] != AHU and not _follows(trial, i)]
+    ducts = trial.type == DUCT
+    best = math.inf
+    for combination in itertools.product(*[range(len(candidates[i])) for i in free]):
+        chosen = [0] * len(trial.ID)
+        for i, s in zip(free, combination):
+            chosen[i] = s
+        for i in order:
+            if trial.type[i] != AHU and _follows(trial, i):
+                chosen[i] = chosen[trial.parent[i]]
+        _apply_sizes(trial, candidates, chosen, DENSITY, ROUGHNESS, order)
+        totals = pyduct.diffuser_pressures(trial)[0]
+        if np.max(totals[trial.type == DIFFUSER]) <= fan_pressure:
+            best = min(best, np.sum(np.pi * trial.size[ducts] / 12 * trial.length[ducts]))
+    assert result['worst'] <= fan_pressure
+    assert result['cost'] == pytest.approx(best, rel=1e-12)
+
+
+@pytest.mark.parametrize('rounding', ['nearest', 'up', 'down', 'optimal'])
+def test_rounding_keeps_the_design_pressures(rounding):
+    design = sized(sample_lines(), 'none')['network']
+    network = sized(sample_lines(), rounding)['network']
+    diffusers = network.type == DIFFUSER
+    np.testing.assert_array_equal(network.diffuser_psum, design.diffuser_psum)
+    assert not np.allclose(network.size[network.type == DUCT], design.size[design.type == DUCT])
+
+    # so the default dampers are those of the design sizes, and the rounded sizes change the flows
+    flow = balance_flows(network, DENSITY, ROUGHNESS, 1.0)['network'].flow
+    assert np.max(np.abs(flow[diffusers] / network.flow[diffusers] - 1)) > 0.05
+
+
+def test_deep_chain_falls_back_to_rounding_up():
+    # rounded to pressure steps, the losses of 1000 fittings in a row leave the searches nothing that fits
+    ducts = pyduct.process_keywords(generate('chain', 1000, rounding='optimal'))
+    network = ducts['network']
+    pyduct.setup_flowrates(network)
+    pyduct.setup_fan_distances(network)
+    optimized = pyduct.sizing_iterate_nick(ducts)['optimized']
+    totals = pyduct.diffuser_pressures(network)[0]
+    assert optimized['worst'] == pytest.approx(totals[network.type == DIFFUSER].max())
+    assert optimized['worst'] <= ducts['fan_pressure']
+    assert optimized['rounded_up'] == [1]
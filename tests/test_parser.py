@@ -0,0 +1,60 @@
+# Tests of the streaming input parser and its diagnostics.
+
+import pickle
+
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct import InputError, parse_keywords, tokenize
+
+
+def test_tokenizer_drops_comments_and_blank_lines():
+    lines = ['# a comment\n', '\n', 'Fan_Pressure, 1.0  # in. wg\n', "title, 'Zone #2' # quoted\n",
+             'title, Building #5 supply\n', 'fitting, 3, duct, 1, 50\n']
+    assert list(tokenize(lines)) == [(3, 'fan_pressure', ' 1.0  '), (4, 'title', " 'Zone #2' "),
+                                     (5, 'title', ' Building #5 supply\n'), (6, 'fitting', ' 3, duct, 1, 50\n')]
+
+
+def test_fitting_columns():
+    ducts, columns = parse_keywords(['fan_pressure, 1.2\n', 'fan_pressure, 0.9, 101\n', 'rounding, UP\n',
+                                     'fitting, 101, Air_Handling_Unit\n', 'fitting, 2, duct, 101, 30\n',
+                                     'fitting, 3.0, tee, 2\n', 'fitting, 4, diffuser, 3-Branch, 150\n',
+                                     'fitting, 5, diffuser, 3-main, 250\n'])
+    assert (ducts['fan_pressure'], ducts['fan_pressures'], ducts['rounding']) == (1.2, {101: 0.9}, 'up')
+    assert columns['ID'] == [101, 2, 3, 4, 5]
+    assert columns['IDup'] == [-1, 101, 2, 3, 3]
+    assert columns['port'] == [0, 0, 0, 2, 1]
+    assert columns['length'][1] == 30 and columns['flow'][3:] == [150, 250]
+
+
+def test_every_bad_line_is_reported_with_its_number():
+    lines = ['fan_pressure, lots\n', 'fitting, 1, air_handling_unit\n', 'fitting, 2, pipe, 1, 3\n',
+             'fitting, 3, duct, 1\n', 'fitting, 4, tee, 3-side\n', 'fitting, 1, elbow, 4\n',
+             'fitting, 5.5, diffuser, 4, 100\n', 'fitting, 6, elbow\n']
+    with pytest.raises(InputError) as raised:
+        parse_keywords(lines)
+    assert [line for line, message in raised.value.errors] == [1, 3, 4, 5, 6, 7, 8]
+    assert str(raised.value).splitlines() == [
+        "line 1: could not convert string to float: 'lots'",
+        "line 3: unknown fitting type 'pipe'",
+        'line 4: fitting line is missing fields',
+        "line 5: unknown tee port '3-side'",
+        'line 6: duplicate fitting ID 1, first given on line 2',
+        "line 7: '5.5' is not a whole number fitting ID",
+        'line 8: elbow 6 has no upstream fitting']
+
+
+def test_input_error_pickles():
+    error = InputError([(3, "unknown fitting type 'pipe'"), (7, 'diffuser 9 has no upstream fitting')])
+    copy = pickle.loads(pickle.dumps(error))
+    assert copy.errors == error.errors
+    assert str(copy) == str(error)
+
+
+def test_streamed_file_parses_like_its_lines():
+    streamed = pyduct.read_ducts(SAMPLE)
+    with open(SAMPLE) as file:
+        listed = pyduct.process_keywords(file.readlines())
+    assert [dict(view) for view in streamed['fittings']] == [dict(view) for view in listed['fittings']]
+    assert streamed['title'] == listed['title'] == "'A Fictitious Small Office Building'"
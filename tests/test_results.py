@@ -0,0 +1,72 @@
+# Tests of the result writers.
+
+import csv
+import io
+import json
+import math
+
+import numpy as np
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct_results import FIELDS, TABLE_HEADER, result_format, result_records, write_results
+
+
+@pytest.fixture(scope='module')
+def network():
+    return pyduct.calculate(SAMPLE, io.StringIO(), echo=False)['network']
+
+
+def written(network, format, chunk_size=4096):
+    stream = io.StringIO()
+    assert write_results(network, stream, format, chunk_size=chunk_size) == format
+    assert not stream.closed
+    return stream.getvalue()
+
+
+def test_formats_agree(network):
+    records = list(result_records(network))
+    assert len(records) == len(network.ID)
+    rows = list(csv.DictReader(io.StringIO(written(network, 'csv'))))
+    lines = [json.loads(line) for line in written(network, 'jsonl').splitlines()]
+    for record, row, line in zip(records, rows, lines):
+        assert line == record
+        for key in FIELDS:
+            if record[key] is None:
+                assert row[key] == ''
+            elif isinstance(record[key], float):
+                assert float(row[key]) == record[key]
+            else:
+                assert row[key] == str(record[key])
+    diffuser = next(record for record in records if record['type'] == 'diffuser')
+    assert math.isfinite(diffuser['diffuser_psum'])
+    assert records[0]['type'] == 'air_handling_unit' and records[0]['size'] == 0.0
+
+
+def test_table_rows(network):
+    lines = written(network, 'table').splitlines()
+    assert lines[0] == TABLE_HEADER and lines[1] == '-' * 120
+    duct = network.position[3]
+    size = network.size[duct]
+    assert lines[2 + duct] == '%4d %20s %15.3f %15.1f %16.3f %17.3f' % (
+        3, 'duct', network.flow[duct] / (np.pi * (size / 12) ** 2), network.flow[duct], network.pdrop[duct], size)
+
+
+@pytest.mark.parametrize('format', ['table', 'csv', 'jsonl'])
+def test_chunks_and_network_untouched(network, format):
+    before = dict((key, column.copy()) for key, column in network.columns.items())
+    assert written(network, format, chunk_size=3) == written(network, format)
+    for key, column in network.columns.items():
+        np.testing.assert_array_equal(column, before[key])
+
+
+def test_format_from_extension(tmp_path, network):
+    assert result_format('out.CSV') == 'csv' and result_format('out.jsonl') == 'jsonl'
+    assert result_format('out.txt') == 'table' and result_format('out.csv', 'table') == 'table'
+    with pytest.raises(ValueError):
+        result_format('out.txt', 'xml')
+    path = str(tmp_path / 'out.jsonl')
+    pyduct.print_results(network.fittings, path, echo=False)
+    with open(path) as file:
+        assert file.read() == written(network, 'jsonl')
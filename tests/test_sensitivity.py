@@ -0,0 +1,80 @@
+# Tests of the adjoint sensitivities of the diffuser pressures.
+#
+# Every column of the Jacobians is checked against central finite differences
+# of a full pressure recalculation, and the gradients against the Jacobians.
+
+import numpy as np
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct_network import AHU, DIFFUSER, DUCT, TEE
+from pyduct_sensitivity import PressureSensitivities
+
+DENSITY = 0.075
+ROUGHNESS = 0.0003
+
+
+def sized(lines, rounding=None):
+    ducts = pyduct.process_keywords(lines)
+    if rounding is not None:
+        ducts['rounding'] = rounding
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    pyduct.sizing_iterate_nick(ducts)
+    return ducts
+
+
+def sample_lines():
+    with open(SAMPLE) as file:
+        return file.readlines()
+
+
+def finite_difference(network, variable, j, h):
+    # central difference of every diffuser pressure for one variable of row j
+    totals = []
+    for sign in (1, -1):
+        trial = network.copy()
+        if variable == 'size':
+            trial.size[j] += sign * h
+            parent = trial.parent[j]
+            if parent >= 0 and trial.type[parent] == TEE:
+                (trial.sizeMain if trial.main_child[parent] == j else trial.sizeBranch)[parent] += sign * h
+        elif variable == 'length':
+            trial.length[j] += sign * h
+        else:
+            trial.flow[j] += sign * h
+            for i in trial.route_rows(j)[1:]:
+                main = trial.main_child[i]
+                if trial.type[i] == TEE:
+                    branch = trial.branch_child[i]
+                    trial.flowMain[i], trial.flowBranch[i] = trial.flow[main], trial.flow[branch]
+                    trial.flow[i] = trial.flow[main] + trial.flow[branch]
+                else:
+                    trial.flow[i] = trial.flow[main]
+        for column in (trial.pdrop, trial.pdropMain, trial.pdropBranch):
+            column[np.isnan(column)] = 0.0
+        pyduct.fitting_pressure_drops(trial, DENSITY, ROUGHNESS)
+        totals.append(pyduct.diffuser_pressures(trial)[0][trial.type == DIFFUSER])
+    return (totals[0] - totals[1]) / (2 * h)
+
+
+@pytest.mark.parametrize('rounding', ['none', 'up'])
+def test_sensitivities_match_finite_differences(rounding):
+    network = sized(sample_lines(), rounding)['network']
+    sensitivities = PressureSensitivities(network, DENSITY, ROUGHNESS)
+    columns = dict(size=np.nonzero((network.type != AHU) & (network.type != DIFFUSER))[0],
+                   length=np.nonzero(network.type == DUCT)[0], flow=sensitivities.diffusers)
+    weights = np.random.default_rng(0).random(len(sensitivities.diffusers))
+    for variable, rows in columns.items():
+        jacobian = sensitivities.jacobian(variable)
+        scale = np.max(np.abs(jacobian))
+        for k, j in enumerate(rows.tolist()):
+            value = getattr(network, variable)[j]
+            expected = finite_difference(network, variable, j, 1e-5 * value)
+            column = jacobian[:, k] if variable == 'flow' else jacobian[:, j]
+            assert np.max(np.abs(column - expected)) < 1e-6 * scale, (variable, int(network.ID[j]))
+        gradient = sensitivities.gradient(weights)[variable]
+        if variable == 'flow':
+            gradient = gradient[sensitivities.diffusers]
+        np.testing.assert_allclose(gradient, weights @ jacobian, rtol=0, atol=1e-12 * scale)
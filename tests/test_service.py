@@ -0,0 +1,161 @@
+# Tests of the warm sizing service, driven through Service.handle and the JSON Lines loop.
+
+import asyncio
+import json
+import shutil
+import threading
+
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct_results import result_records
+from pyduct_service import Service, http_connection, is_loopback, serve_stdio
+
+
+def sample_text(old, new):
+    with open(SAMPLE) as file:
+        return file.read().replace(old, new)
+
+
+INFEASIBLE = sample_text('fan_pressure, 1.000', 'fan_pressure, -0.5')
+BROKEN = sample_text('12,  Duct                 , 8-branch', '12,  Duct                 , 99')
+
+
+@pytest.fixture
+def service():
+    service = Service(2)
+    yield service
+    service.close()
+
+
+def answer(service, *requests):
+    async def handle_all():
+        return [await service.handle(request) for request in requests]
+    return asyncio.run(handle_all())
+
+
+def test_bad_size_requests_do_not_break_the_pool(service):
+    infeasible, broken, good, again = answer(service, dict(id=1, op='size', text=INFEASIBLE),
+                                             dict(id=2, op='size', text=BROKEN),
+                                             dict(id=3, op='size', path=SAMPLE, fittings=False),
+                                             dict(id=4, op='size', text=INFEASIBLE))
+    assert (infeasible['id'], infeasible['ok'], infeasible['type']) == (1, False, 'SolverError')
+    assert infeasible['solver']['solver'] == 'size_network'
+    assert (broken['ok'], broken['type']) == (False, 'NetworkError')
+    assert broken['problems'] == ['duct 12 connects to fitting 99, which does not exist',
+                                  'diffuser 13 is not connected to an air handling unit',
+                                  'tee 8 has no fitting on its branch port']
+    assert good['ok'] and good['result']['converged']
+    assert (again['type'], again['error']) == (infeasible['type'], infeasible['error'])
+
+
+def test_pool_is_replaced_after_a_worker_dies(service):
+    assert answer(service, dict(op='size', path=SAMPLE, fittings=False))[0]['ok']
+    for process in list(service.processes._processes.values()):
+        process.kill()
+    first, second = answer(service, dict(op='size', path=SAMPLE, fittings=False),
+                           dict(op='size', path=SAMPLE, fittings=False))
+    assert first['ok'] or first['type'] == 'BrokenProcessPool'
+    assert second['ok']
+
+
+def test_kept_network_matches_a_full_calculation(service):
+    loaded, edited, listed, dropped = answer(
+        service, dict(op='load', network='zone', path=SAMPLE, fittings=False),
+        dict(op='edit', network='zone', edits=[dict(set='flow', ID=11, value=200)]),
+        dict(op='list'), dict(op='drop', network='zone'))
+    assert loaded['ok'] and listed['result'] == dict(networks=['zone'])
+    assert dropped['result'] == dict(networks=[])
+    ducts = pyduct.read_ducts(SAMPLE)
+    ducts['network'].flow[ducts['network'].position[11]] = 200
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    pyduct.sizing_iterate_nick(ducts)
+    expected = list(result_records(ducts['fittings']))
+    for row, record in zip(edited['result']['fittings'], expected):
+        assert row.keys() == record.keys()
+        for key, value in record.items():
+            assert row[key] == (pytest.approx(value, rel=1e-7) if isinstance(value, float) else value)
+
+    failed = answer(service, dict(op='edit', network='zone', edits=[]), dict(op='size'), dict(op='fly'))
+    assert [response['type'] for response in failed] == ['RequestError'] * 3
+
+
+def test_json_lines_keep_their_ids(service):
+    requests = [dict(id='a', op='size', text=INFEASIBLE), dict(id='b', op='list')]
+    lines = ''.join(json.dumps(request) + '\n' for request in requests) + 'not json\n'
+    written = []
+
+    async def serve():
+        reader = asyncio.StreamReader()
+        reader.feed_data(lines.encode())
+        reader.feed_eof()
+        await serve_stdio(service, reader, written.append)
+
+    asyncio.run(serve())
+    responses = dict((response['id'], response) for response in map(json.loads, written))
+    assert responses['a']['type'] == 'SolverError' and responses['b']['ok']
+    assert responses[None]['error'].startswith('bad JSON')
+
+
+def test_requests_read_files_inside_the_root_only(tmp_path):
+    shutil.copy(SAMPLE, str(tmp_path / 'zone.txt'))
+    service = Service(1, root=str(tmp_path))
+    try:
+        inside, cached, outside, up, cache_outside = answer(
+            service, dict(op='size', path='zone.txt', fittings=False),
+            dict(op='load', network='zone', path=str(tmp_path / 'zone.txt'), cache_dir='cache', fittings=False),
+            dict(op='size', path=SAMPLE), dict(op='load', network='zone', path='../zone.txt'),
+            dict(op='size', path='zone.txt', cache_dir=str(tmp_path.parent)))
+    finally:
+        service.close()
+    assert inside['ok'] and cached['ok'] and (tmp_path / 'cache').is_dir()
+    assert [response['type'] for response in (outside, up, cache_outside)] == ['RequestError'] * 3
+    assert 'is outside' in up['error']
+
+    with open(SAMPLE) as file:
+        text = file.read()
+    service = Service(1, files=False)
+    try:
+        refused, text = answer(service, dict(op='size', path=SAMPLE), dict(op='size', text=text))
+    finally:
+        service.close()
+    assert refused['type'] == 'RequestError' and text['ok']
+
+
+def test_models_change_under_the_lock(service):
+    # a list waits for a load that holds the lock instead of iterating the models as they change
+    answer(service, dict(op='load', network='zone', path=SAMPLE, fittings=False))
+    with service.lock:
+        listing = threading.Thread(target=answer, args=(service, dict(op='list')))
+        listing.start()
+        listing.join(0.2)
+        assert listing.is_alive()
+    listing.join()
+
+
+def test_http_takes_json_for_its_own_host_only(service):
+    body = json.dumps(dict(op='list')).encode()
+
+    def post(host, content_type):
+        return ('POST / HTTP/1.1\r\nHost: %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n'
+                % (host, content_type, len(body))).encode() + body
+
+    async def exchange(request):
+        server = await asyncio.start_server(lambda r, w: http_connection(service, r, w), '127.0.0.1', 0)
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+            writer.write(request)
+            await writer.drain()
+            status = (await reader.readline()).decode()
+            writer.close()
+        return status.split()[1]
+
+    statuses = [asyncio.run(exchange(post(host, content_type))) for host, content_type in
+                [('127.0.0.1:8765', 'application/json'), ('localhost', 'application/json; charset=utf-8'),
+                 ('[::1]:8765', 'application/json'), ('evil.example:8765', 'application/json'),
+                 ('localhost:8765', 'text/plain')]]
+    assert statuses == ['200', '200', '200', '403', '415']
+    assert is_loopback('127.0.0.2') and is_loopback('localhost')
+    assert not is_loopback('0.0.0.0') and not is_loopback('example.com')
@@ -0,0 +1,108 @@
+# Tests of the equal friction sizing loop, its batched duct sizes and the diffuser pressure totals.
+
+import random
+
+import numpy as np
+import pytest
+
+import pyduct
+from pyduct_friction import SolverError, colebrook_f, size_ducts
+from pyduct_generate import generate
+from pyduct_network import DIFFUSER, DUCT
+
+
+def prepared(lines, **settings):
+    ducts = pyduct.process_keywords(lines)
+    ducts.update(settings)
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    return ducts
+
+
+@pytest.mark.parametrize('topology', ['balanced', 'chain', 'random'])
+def test_secant_steps_reach_the_plain_fixed_point(topology):
+    lines = generate(topology, 300, seed=3)
+    plain = pyduct.size_network(prepared(lines), accelerate=False, maxiter=1000)
+    fast = pyduct.size_network(prepared(lines))
+    assert fast['converged'] and plain['converged']
+    assert fast['dpdl'] == pytest.approx(plain['dpdl'], rel=1e-6)
+    assert fast['iterations'] <= plain['iterations']
+    assert len(fast['history']) == fast['iterations']
+    assert abs(fast['residual']) < 1e-10
+
+
+def test_sizing_gives_up_after_maxiter():
+    ducts = prepared(generate('random', 300, seed=3))
+    with pytest.raises(SolverError) as raised:
+        pyduct.size_network(ducts, maxiter=1)
+    assert (raised.value.solver, raised.value.iterations) == ('size_network', 1)
+    assert 'did not converge' in str(raised.value)
+
+
+def test_sizing_needs_fan_pressure_for_the_ducts():
+    ducts = prepared(generate('balanced', 100), fan_pressure=0.0)
+    with pytest.raises(SolverError, match='has no pressure for the ducts'):
+        pyduct.size_network(ducts)
+
+
+def fsolve_duct_size(deltap, flow, length, density, roughness):
+    # the duct size as pyduct solved it before size_ducts, one duct at a time by fsolve on
+    # Darcy-Weisbach; the friction factor from colebrook_f, which tests/test_friction.py checks
+    from scipy.optimize import fsolve
+
+    def func(dia):
+        area = (np.pi * (dia / 12) ** 2) / 4
+        velocity = flow / area
+        f = colebrook_f(dia[0], velocity[0], roughness)
+        return deltap - ((12 * f * length) / (dia / 12)) * density * (velocity / 1097) ** 2
+
+    guess = .01
+    while True:
+        f = fsolve(func, guess, full_output=True)
+        if int(f[2]) == 1:
+            return f[0][0]
+        guess = guess * 2.0
+
+
+def test_size_ducts_matches_fsolve():
+    pytest.importorskip('scipy.optimize')
+    density, roughness = 0.075, 0.0003
+    rnd = random.Random(1)
+    flow = np.array([rnd.uniform(50, 5000) for i in range(20)])
+    dpdl = np.array([rnd.uniform(0.0005, 0.01) for i in range(20)])
+    old = np.array([fsolve_duct_size(s * 10.0, q, 10.0, density, roughness) for q, s in zip(flow, dpdl)])
+    assert np.max(np.abs(size_ducts(flow, dpdl, density, roughness) / old - 1)) < 1e-12
+
+
+def test_batched_sizes_match_one_duct_at_a_time():
+    ducts = prepared(generate('random', 300, seed=4))
+    network = ducts['network']
+    dpdl = pyduct.size_network(ducts)['dpdl']
+    density, roughness = ducts['air_density'], ducts['roughness']
+    for i in np.nonzero(network.type == DUCT)[0].tolist():
+        flow, length, size = network.flow[i], network.length[i], network.size[i]
+        assert size == pytest.approx(pyduct.get_duct_size(dpdl * length, flow, length, density, roughness), rel=1e-12)
+        assert pyduct.duct_pressure_drop(size, flow, length, density, roughness) == pytest.approx(network.pdrop[i],
+                                                                                                 rel=1e-9)
+
+
+@pytest.mark.parametrize('topology', ['balanced', 'skewed'])
+def test_diffuser_totals_match_route_sums(topology):
+    ducts = prepared(generate(topology, 300, seed=5))
+    network = ducts['network']
+    pyduct.size_network(ducts)
+    totals, fitting_totals = pyduct.diffuser_pressures(network)
+    diffusers = np.nonzero(network.type == DIFFUSER)[0]
+    routes = [pyduct.pressure_drop_sum(int(network.ID[i]), network) for i in diffusers.tolist()]
+    np.testing.assert_allclose(network.diffuser_psum[diffusers], routes, rtol=1e-12)
+    assert np.isnan(network.diffuser_psum[network.type != DIFFUSER]).all()
+    farthest = pyduct.largest_path(network)
+    assert fitting_totals[network.farthest] == pytest.approx(pyduct.fitting_loss_sum(network), rel=1e-12)
+
+    # totals below a few fittings only, as an incremental re-solve asks for them
+    tops = [int(network.ID[diffusers[3]]), int(network.ID[network.parent[diffusers[10]]])]
+    partial = pyduct.route_totals(network, tops)[0]
+    covered = ~np.isnan(partial)
+    assert covered.sum() >= 3 and covered[diffusers[3]] and covered[diffusers[10]]
+    np.testing.assert_allclose(partial[covered], totals[covered], rtol=1e-12)
+    assert farthest['diffuser_psum'] == totals[network.farthest]
@@ -0,0 +1,39 @@
+# Tests of the parameter sweep over one parsed network.
+
+
+import numpy as np
+import pytest
+
+import pyduct
+from conftest import SAMPLE
+from pyduct_network import DIFFUSER
+from pyduct_sweep import prepare, sweep
+
+
+def test_points_match_a_full_calculation():
+    table = sweep(prepare(SAMPLE), fan_pressure=[0.8, 1.2], rounding=['none', 'up'], workers=1)
+    assert table['feasible'].all()
+    assert list(table['rounding']) == ['none', 'up', 'none', 'up']
+    assert table['converged'].all()
+    ducts = pyduct.read_ducts(SAMPLE)
+    ducts.update(fan_pressure=1.2, rounding='up')
+    pyduct.setup_flowrates(ducts['network'])
+    pyduct.setup_fan_distances(ducts['network'])
+    convergence = pyduct.sizing_iterate_nick(ducts)
+    network = ducts['network']
+    assert table['dpdl'][3] == pytest.approx(convergence['dpdl'], rel=1e-12)
+    pyduct.diffuser_pressures(network)  # the sweep reports the pressures of the rounded sizes
+    np.testing.assert_allclose(table['diffuser_psum'][3], network.diffuser_psum[network.type == DIFFUSER],
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_infeasible_point_does_not_stop_the_sweep(workers):
+    table = sweep(prepare(SAMPLE), fan_pressure=[0.0, 1.0, -0.5], rounding=['none', 'optimal'], workers=workers,
+                  chunksize=1)
+    assert list(table['feasible']) == [False, False, True, True, False, False]
+    assert 'has no pressure for the ducts' in table['error'][0]
+    assert table['error'][2] == table['error'][3] == ''
+    assert np.isnan(table['diffuser_psum'][0]).all() and np.isnan(table['dpdl'][5])
+    assert table['diffuser_psum'].shape == (6, 5)
+    assert (table['critical_pressure'][2:4] <= 1.0 + 1e-9).all()